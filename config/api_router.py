@@ -3,6 +3,7 @@ from rest_framework.routers import DefaultRouter, SimpleRouter
 
 from osler.users.api.views import UserViewSet
 from osler.core.api.views import PatientViewSet
+from osler.labs.api.views import LabSeriesViewSet
 
 if settings.DEBUG:
     router = DefaultRouter()
@@ -11,6 +12,7 @@ else:
 
 router.register("users", UserViewSet)
 router.register("patients",PatientViewSet)
+router.register("lab-series", LabSeriesViewSet, basename="lab-series")
 
 app_name = "api"
 urlpatterns = router.urls
@@ -348,6 +348,44 @@ OSLER_WORKUP_COPY_FORWARD_MESSAGE = (u"Migrated from previous workup on {date}.
 # Dashboard settings
 OSLER_CLINIC_DAYS_PER_PAGE = 20
 
+# Number of patients per page of the patient search
+OSLER_PATIENTS_PER_PAGE = 50
+
+# Most possible duplicates shown for a new patient's name at intake
+OSLER_DUPLICATE_PATIENT_LIMIT = 50
+
+# Number of notes per page of the patient timeline API, by default and at most
+OSLER_TIMELINE_PAGE_SIZE = 25
+OSLER_TIMELINE_MAX_PAGE_SIZE = 200
+
+# Most points a downsampled lab series from the lab series API may have
+OSLER_LAB_SERIES_MAX_POINTS = 2000
+
+# Number of labs per page of the unreviewed abnormal lab worklist
+OSLER_LAB_WORKLIST_PAGE_SIZE = 50
+
+# Days of dispensing the stock report averages over by default, and the
+# days of remaining stock below which it flags a drug for reordering
+OSLER_INVENTORY_CONSUMPTION_DAYS = 30
+OSLER_INVENTORY_REORDER_DAYS = 30
+
+# Cache (alias in CACHES) for rendered workup PDFs, how long to keep them,
+# in seconds, and whether to render them in the background on signing.
+# The PDFs are patient records, so they get a cache of their own, and are
+# only kept for about as long as a clinic day's downloads take.
+OSLER_WORKUP_PDF_CACHE = 'workup_pdf'
+OSLER_WORKUP_PDF_CACHE_TIMEOUT = 60 * 60 * 24
+OSLER_WORKUP_PDF_PRERENDER = True
+
+# Processes to render batches of workup PDFs with (1 to render in the
+# request's own process). Each packet request starts its own pool, so keep
+# this small.
+OSLER_WORKUP_PDF_WORKERS = 2
+
+# The most clinic days, and the most workups, one PDF packet may cover
+OSLER_WORKUP_PDF_PACKET_MAX_DAYS = 31
+OSLER_WORKUP_PDF_PACKET_MAX_WORKUPS = 200
+
 OSLER_DEFAULT_DASHBOARD = 'dashboard-active'
 OSLER_ROLE_DASHBOARDS = {
     'Attending': 'dashboard-attending',
@@ -356,6 +394,22 @@ OSLER_ROLE_DASHBOARDS = {
 # List of IP addresses to exclude from audit
 OSLER_AUDIT_BLACK_LIST = []
 
+# How AuditMiddleware saves page view records: 'sync' saves each one during
+# its request, so none can be lost; 'buffered' saves them in batches of up
+# to OSLER_AUDIT_BATCH_SIZE from a background thread, at least every
+# OSLER_AUDIT_FLUSH_INTERVAL seconds, keeping the write off the request path
+# at the cost of losing the unsaved batch if the process crashes.
+OSLER_AUDIT_WRITER = 'sync'
+OSLER_AUDIT_BATCH_SIZE = 100
+OSLER_AUDIT_FLUSH_INTERVAL = 2.0
+
+# Number of days of raw page view records kept by the rollup_pageviews
+# command; older ones survive only as daily rollups
+OSLER_AUDIT_RETENTION_DAYS = 180
+
+# Number of page view records per page of a patient's access report
+OSLER_AUDIT_RECORDS_PER_PAGE = 50
+
 # Name of about link in top bar
 OSLER_ABOUT_NAME = "About"
 
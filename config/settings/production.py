@@ -45,7 +45,19 @@ CACHES = {
             # http://jazzband.github.io/django-redis/latest/#_memcached_exceptions_behavior
             "IGNORE_EXCEPTIONS": True,
         },
-    }
+    },
+    # rendered workup PDFs (see OSLER_WORKUP_PDF_CACHE), apart from the
+    # rest so that they can be flushed or pointed at another Redis alone
+    "workup_pdf": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": env("WORKUP_PDF_REDIS_URL", default=env("REDIS_URL")),
+        "KEY_PREFIX": "workup_pdf",
+        "TIMEOUT": OSLER_WORKUP_PDF_CACHE_TIMEOUT,  # noqa F405
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "IGNORE_EXCEPTIONS": True,
+        },
+    },
 }
 
 # SECURITY
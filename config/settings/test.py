@@ -25,7 +25,11 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
         "LOCATION": "",
-    }
+    },
+    "workup_pdf": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "workup_pdf",
+    },
 }
 
 # PASSWORDS
@@ -52,3 +56,6 @@ EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# Save audit records during the request so tests can check for them
+OSLER_AUDIT_WRITER = 'sync'
+
@@ -7,6 +7,7 @@ from django.utils.timezone import now
 from django.urls import reverse
 
 from osler.core.models import Patient
+from osler.core.tests.factories import PatientFactory
 from osler.core.tests.test_views import log_in_user, build_user
 from osler.users.tests import factories as user_factories
 
@@ -176,3 +177,26 @@ class TestAppointmentViews(TestCase):
             response.content.decode('utf-8'))
 
         self.assertEqual(len(arrived_links), 1)
+
+    def test_check_in_day(self):
+        # volunteers can't activate patients
+        response = self.client.post(reverse('appointment-check-in-day'),
+                                    {'date': now().date().isoformat()})
+        self.assertEqual(response.status_code, 403)
+        log_in_user(self.client,
+                    build_user([user_factories.CaseManagerGroupFactory]))
+
+        no_show = models.Appointment.objects.create(
+            comment='no show', clindate=now().date(), clintime=time(10, 0),
+            appointment_type='PSYCH_NIGHT', author=self.user,
+            author_type=self.user.groups.first(), pt_showed=False,
+            patient=PatientFactory())
+
+        response = self.client.post(reverse('appointment-check-in-day'),
+                                    {'date': now().date().isoformat()})
+
+        self.assertRedirects(response, reverse('dashboard-active'),
+                             fetch_redirect_response=False)
+        self.assertTrue(self.apt.patient.get_status().is_active)
+        self.assertFalse(no_show.patient.encounter_set.filter(
+            clinic_day=now().date()).exists())
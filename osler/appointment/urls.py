@@ -20,6 +20,9 @@ unwrapped_urlconf = [  # pylint: disable=invalid-name
     path(r'<int:pk>/arrived',
          views.mark_arrived,
          name='appointment-mark-arrived'),
+    path(r'check-in',
+         views.check_in_day,
+         name='appointment-check-in-day'),
 ]
 
 wrap_config = {}
@@ -1,12 +1,16 @@
 from __future__ import unicode_literals
 import collections
+import datetime
 
 from django.urls import reverse
+from django.http import HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404, HttpResponseRedirect
 from django.utils.timezone import now
+from django.views.decorators.http import require_POST
 
 from osler.core.views import NoteFormView, NoteUpdate
-from osler.core.models import Patient
+from osler.core.models import Encounter, Patient
+from osler.users.decorators import active_permission_required
 from osler.users.utils import get_active_role
 
 from osler.appointment.models import Appointment
@@ -52,6 +56,26 @@ def mark_arrived(request, pk):
                                         args=(apt.patient.pk,)))
 
 
+@require_POST
+@active_permission_required('core.activate_Patient', raise_exception=True)
+def check_in_day(request):
+    """Give every patient with an appointment on the posted date, except
+    those marked as no-shows, an active encounter that day.
+    """
+
+    try:
+        clindate = datetime.date.fromisoformat(request.POST.get('date', ''))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid date.")
+
+    patients = Appointment.objects.filter(clindate=clindate) \
+        .exclude(pt_showed=False) \
+        .values_list('patient', flat=True)
+    Encounter.objects.check_in(patients, clindate)
+
+    return HttpResponseRedirect(reverse("dashboard-active"))
+
+
 class AppointmentUpdate(NoteUpdate):
     template_name = "core/form-update.html"
     model = Appointment
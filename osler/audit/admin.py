@@ -1,7 +1,41 @@
 from __future__ import unicode_literals
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-from .models import PageviewRecord
+from .models import PageviewRecord, PageviewDailyRollup
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that, for an unfiltered queryset on PostgreSQL, uses the
+    planner's estimate of the table's size instead of a count(*), which
+    has to scan the whole table.
+
+    Small tables, where the estimate is least accurate and the scan is
+    cheap, are still counted exactly.
+    """
+
+    EXACT_COUNT_BELOW = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where:
+            return super().count
+
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return super().count
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s",
+                           [self.object_list.model._meta.db_table])
+            row = cursor.fetchone()
+
+        if row is None or row[0] < self.EXACT_COUNT_BELOW:
+            return super().count
+        return int(row[0])
 
 
 class PageviewRecordAdmin(admin.ModelAdmin):
@@ -13,6 +47,10 @@ class PageviewRecordAdmin(admin.ModelAdmin):
     """
     actions = None
 
+    paginator = EstimatedCountPaginator
+    # don't count(*) the whole table for the "N total" link when filtering
+    show_full_result_count = False
+
     list_filter = (
         'status_code',
         'role'
@@ -56,3 +94,16 @@ class PageviewRecordAdmin(admin.ModelAdmin):
 
 
 admin.site.register(PageviewRecord, PageviewRecordAdmin)
+
+
+class PageviewDailyRollupAdmin(PageviewRecordAdmin):
+    """Read-only, like PageviewRecordAdmin."""
+
+    list_filter = ('day',)
+    list_display = ('day', 'user', 'url_pattern', 'count')
+    search_fields = ('user__username', 'user__first_name', 'user__last_name',
+                     'url_pattern')
+    date_hierarchy = 'day'
+
+
+admin.site.register(PageviewDailyRollup, PageviewDailyRollupAdmin)
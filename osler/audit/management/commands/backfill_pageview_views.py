@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from osler.audit.models import PageviewRecord
+from osler.audit.utils import PATIENT_OBJECT_VIEWS, patient_object, \
+    resolve_patient_pks, resolve_path, view_fields
+
+
+class Command(BaseCommand):
+    help = """Fills in the view name, object pk, and patient pk of page view
+    records saved before those were recorded, by resolving their URLs
+    against the current URLconf and looking up the patients of the
+    workups, labs, etc. that they name."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Update at most this many records per transaction.")
+
+    def handle(self, *args, **options):
+        # records saved before views of a patient's workups, labs, etc.
+        # were attributed to the patient are redone too
+        pending = PageviewRecord.objects \
+            .filter(Q(view_name__isnull=True) |
+                    Q(view_name__in=PATIENT_OBJECT_VIEWS,
+                      patient_pk__isnull=True)) \
+            .order_by('pk')
+
+        # many records share a URL, so only resolve each one once
+        resolved = {}
+        n_records = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                batch = list(pending.filter(pk__gt=last_pk)
+                             .only('pk', 'url')[:options['batch_size']])
+                if not batch:
+                    break
+
+                if len(resolved) > 10000:
+                    resolved.clear()
+
+                for record in batch:
+                    if record.url not in resolved:
+                        match = resolve_path(record.url)
+                        resolved[record.url] = (
+                            view_fields(match, resolve_objects=False),
+                            patient_object(match))
+                    fields, record.patient_object = resolved[record.url]
+                    for field, value in fields.items():
+                        setattr(record, field, value)
+
+                # look up the patients of the batch's other objects (e.g.
+                # workups) with a query per model
+                resolve_patient_pks(batch)
+
+                PageviewRecord.objects.bulk_update(
+                    batch, ['view_name', 'object_pk', 'patient_pk'])
+
+            n_records += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write("Backfilled %s page view records." % n_records)
@@ -0,0 +1,129 @@
+import csv
+import datetime
+import gzip
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.timezone import localdate, make_aware, now
+
+from osler.audit.models import PageviewRecord, PageviewDailyRollup
+from osler.audit.utils import url_pattern
+
+
+def start_of_day(day):
+    return make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+class Command(BaseCommand):
+    help = """Rolls page view records up into daily per-user, per-URL-pattern
+    counts (PageviewDailyRollup), then deletes records older than the
+    retention horizon, optionally archiving them to a gzipped CSV first.
+    Meant to be run daily, e.g. from cron."""
+
+    ARCHIVE_FIELDS = ['id', 'timestamp', 'user_id', 'role_id', 'user_ip',
+                      'method', 'url', 'referrer', 'status_code']
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.OSLER_AUDIT_RETENTION_DAYS,
+            help="Keep raw records from this many days back (default "
+                 "%(default)s).")
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Delete at most this many records per transaction.")
+        parser.add_argument(
+            '--archive-dir',
+            help="Write records to a gzipped CSV in this directory before "
+                 "deleting them.")
+
+    def handle(self, *args, **options):
+        n_days = self.rollup()
+        self.stdout.write("Rolled up %s days of page views." % n_days)
+
+        cutoff = start_of_day(localdate() - datetime.timedelta(
+            days=options['days']))
+        n_pruned = self.prune(cutoff, options['batch_size'],
+                              options['archive_dir'])
+        self.stdout.write("Pruned %s page view records." % n_pruned)
+
+    def rollup(self):
+        """Roll up each complete day (i.e. before today) since the last day
+        that was rolled up. Returns the number of days rolled up."""
+
+        records = PageviewRecord.objects.filter(
+            timestamp__lt=start_of_day(localdate()))
+        last_day = PageviewDailyRollup.objects.aggregate(Max('day'))['day__max']
+        if last_day is not None:
+            records = records.filter(
+                timestamp__gte=start_of_day(last_day + datetime.timedelta(1)))
+
+        days = list(records.dates('timestamp', 'day'))
+        for day in days:
+            self.rollup_day(day)
+
+        return len(days)
+
+    @transaction.atomic
+    def rollup_day(self, day):
+        # the database does the heavy lifting of counting views per URL,
+        # and we only merge URLs into patterns
+        per_url = PageviewRecord.objects \
+            .filter(timestamp__gte=start_of_day(day),
+                    timestamp__lt=start_of_day(day + datetime.timedelta(1))) \
+            .order_by() \
+            .values('user', 'url') \
+            .annotate(n=Count('pk'))
+
+        patterns = {}
+        counts = Counter()
+        for row in per_url.iterator():
+            if row['url'] not in patterns:
+                patterns[row['url']] = url_pattern(row['url'])[:256]
+            counts[(row['user'], patterns[row['url']])] += row['n']
+
+        PageviewDailyRollup.objects.filter(day=day).delete()
+        PageviewDailyRollup.objects.bulk_create(
+            PageviewDailyRollup(day=day, user_id=user, url_pattern=pattern,
+                                count=count)
+            for (user, pattern), count in counts.items())
+
+    def prune(self, cutoff, batch_size, archive_dir=None):
+        """Delete records from before cutoff in batches of batch_size,
+        archiving each batch first if archive_dir is given. Returns the
+        number of records deleted."""
+
+        archive_file = archive = None
+        if archive_dir is not None:
+            path = os.path.join(archive_dir, 'pageviews-%s.csv.gz' % (
+                now().strftime('%Y%m%d%H%M%S')))
+            archive_file = gzip.open(path, 'wt', newline='')
+            archive = csv.writer(archive_file)
+            archive.writerow(self.ARCHIVE_FIELDS)
+
+        old_records = PageviewRecord.objects \
+            .filter(timestamp__lt=cutoff).order_by('pk')
+
+        n_pruned = 0
+        try:
+            while True:
+                with transaction.atomic():
+                    batch = list(old_records.values_list(
+                        *self.ARCHIVE_FIELDS)[:batch_size])
+                    if not batch:
+                        break
+
+                    if archive is not None:
+                        archive.writerows(batch)
+                    PageviewRecord.objects.filter(
+                        pk__in=[row[0] for row in batch]).delete()
+
+                n_pruned += len(batch)
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+
+        return n_pruned
@@ -3,6 +3,9 @@ from django.contrib.auth.models import AnonymousUser, Group
 from django.conf import settings
 from django.apps import apps
 
+from osler.audit.utils import patient_object, view_fields
+from osler.audit.writers import get_audit_writer
+
 
 class AuditMiddleware:
 
@@ -21,21 +24,33 @@ class AuditMiddleware:
         else:
             user_ip = request.META.get('REMOTE_ADDR')
 
-        role = request.session.active_role_pk if hasattr(request.session, 'active_role_pk') else None
-        
+        role_pk = request.session.get('active_role_pk') \
+            if hasattr(request, 'session') else None
+
         if user_ip not in settings.OSLER_AUDIT_BLACK_LIST:
             PageviewRecord = apps.get_app_config('audit').get_model(
                 model_name='PageviewRecord')
 
-            PageviewRecord.objects.create(
+            def truncated(field, value):
+                max_length = PageviewRecord._meta.get_field(field).max_length
+                return value[:max_length] if value is not None else None
+
+            match = getattr(request, 'resolver_match', None)
+            record = PageviewRecord(
                 user=(None if isinstance(request.user, AnonymousUser)
                       else request.user),
-                role=role,
+                role_id=role_pk,
                 user_ip=user_ip,
                 method=request.method,
-                url=request.get_full_path(),
-                referrer=request.META.get('HTTP_REFERER', None),
-                status_code=response.status_code
-            )
+                url=truncated('url', request.get_full_path()),
+                referrer=truncated('referrer',
+                                   request.META.get('HTTP_REFERER', None)),
+                status_code=response.status_code,
+                # the patient of a view of e.g. a workup is looked up by
+                # the writer, which the buffered one does off the request
+                # path and for a whole batch at once
+                **view_fields(match, resolve_objects=False))
+            record.patient_object = patient_object(match)
+            get_audit_writer().write(record)
 
         return response
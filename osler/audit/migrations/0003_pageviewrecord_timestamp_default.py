@@ -0,0 +1,19 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:17
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0002_pageviewrecord_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pageviewrecord',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
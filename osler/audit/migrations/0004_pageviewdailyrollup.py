@@ -0,0 +1,35 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('audit', '0003_pageviewrecord_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pageviewrecord',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.CreateModel(
+            name='PageviewDailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('url_pattern', models.CharField(max_length=256)),
+                ('count', models.PositiveIntegerField()),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('day', 'user', 'url_pattern')},
+            },
+        ),
+    ]
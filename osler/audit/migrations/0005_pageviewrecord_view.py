@@ -0,0 +1,36 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0004_pageviewdailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pageviewrecord',
+            name='object_pk',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pageviewrecord',
+            name='patient_pk',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pageviewrecord',
+            name='view_name',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pageviewrecord',
+            index=models.Index(fields=['patient_pk', 'timestamp'], name='audit_pagev_patient_acd7ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pageviewrecord',
+            index=models.Index(fields=['view_name', 'object_pk'], name='audit_pagev_view_na_3bc26b_idx'),
+        ),
+    ]
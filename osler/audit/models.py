@@ -2,11 +2,18 @@ from __future__ import unicode_literals
 
 from django.db import models
 from django.conf import settings
+from django.utils.timezone import now
 from django.contrib.auth.models import Group
 
 
 class PageviewRecord(models.Model):
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient_pk', 'timestamp']),
+            models.Index(fields=['view_name', 'object_pk']),
+        ]
+
     HTTP_METHODS = ['GET', 'POST', 'HEAD', 'PUT', 'PATCH', 'DELETE',
                     'CONNECT', 'OPTIONS', 'TRACE']
 
@@ -30,8 +37,45 @@ class PageviewRecord(models.Model):
 
     status_code = models.PositiveSmallIntegerField()
 
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # The URLconf view the URL resolved to, and the pks of the object and
+    # patient it was about (see osler.audit.utils.view_fields). view_name is
+    # null for records from before these were recorded that haven't been
+    # backfilled yet, and '' if the URL didn't resolve.
+    view_name = models.CharField(max_length=200, blank=True, null=True)
+    object_pk = models.PositiveIntegerField(blank=True, null=True)
+    patient_pk = models.PositiveIntegerField(blank=True, null=True)
+
+    # set when the record is built rather than when it is saved, since
+    # saving may be deferred (see osler.audit.writers)
+    timestamp = models.DateTimeField(default=now, editable=False,
+                                     db_index=True)
 
     def __str__(self):
         return '%s by %s to %s at %s' % (self.method, self.user, self.url,
                                          self.timestamp)
+
+
+class PageviewDailyRollup(models.Model):
+    """The number of page views by one user of one URL pattern on one day.
+
+    Built from PageviewRecords by the rollup_pageviews management command,
+    so that usage can still be reported on after raw records are pruned.
+    """
+
+    class Meta:
+        unique_together = [('day', 'user', 'url_pattern')]
+
+    day = models.DateField(db_index=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        blank=True, null=True,
+        on_delete=models.DO_NOTHING
+    )
+    # the route of the URLconf entry the URL resolved to, e.g.
+    # "pt/(?P<pk>[0-9]+)/$"
+    url_pattern = models.CharField(max_length=256)
+    count = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '%s views by %s of %s on %s' % (
+            self.count, self.user, self.url_pattern, self.day)
@@ -0,0 +1,13 @@
+from django.urls import re_path
+
+from osler.core.urls import wrap_url
+from osler.audit import views
+
+app_name = 'audit'
+unwrapped_urlconf = [
+    re_path(r'^patient/(?P<pk>[0-9]+)/$',
+            views.patient_access_report,
+            name='patient-access'),
+]
+
+urlpatterns = [wrap_url(u, **{}) for u in unwrapped_urlconf]
@@ -0,0 +1,139 @@
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.apps import apps
+from django.urls import Resolver404, resolve
+
+# url_pattern of URLs that don't match any URLconf entry
+UNRESOLVED_PATTERN = '<unresolved>'
+
+# Views whose 'pk' URL argument is the pk of a patient. Everywhere else,
+# views about a patient take it as 'pt_id', and 'pk' is some other object.
+PATIENT_PK_VIEWS = {
+    'core:patient-detail',
+    'core:patient-update',
+    'core:patient-activate-detail',
+    'core:patient-activate-home',
+    'api:patient-detail',
+    'api:patient-timeline',
+    'api:lab-series-detail',
+    'audit:patient-access',
+}
+
+# Views whose URL names an object that belongs to a patient, by the model
+# of the object and the URL argument carrying its pk. The patient of these
+# is that object's patient_id.
+PATIENT_OBJECT_VIEWS = {
+    'workup': ('workup.Workup', 'pk'),
+    'workup-update': ('workup.Workup', 'pk'),
+    'workup-sign': ('workup.Workup', 'pk'),
+    'workup-error': ('workup.Workup', 'pk'),
+    'workup-pdf': ('workup.Workup', 'pk'),
+    'new-addendum': ('workup.Workup', 'wu_id'),
+    'basic-note-detail': ('workup.BasicNote', 'pk'),
+    'basic-note-update': ('workup.BasicNote', 'pk'),
+    'attestable-basic-note-detail': ('workup.AttestableBasicNote', 'pk'),
+    'attestable-basic-note-update': ('workup.AttestableBasicNote', 'pk'),
+    'attestable-basic-note-sign': ('workup.AttestableBasicNote', 'pk'),
+    'core:document-detail': ('core.Document', 'pk'),
+    'core:document-update': ('core.Document', 'pk'),
+    'core:update-action-item': ('core.ActionItem', 'pk'),
+    'core:done-action-item': ('core.ActionItem', 'ai_id'),
+    'core:reset-action-item': ('core.ActionItem', 'ai_id'),
+    'labs:lab-detail': ('labs.Lab', 'pk'),
+    'labs:lab-edit': ('labs.Lab', 'pk'),
+    'labs:lab-reviewed': ('labs.Lab', 'pk'),
+    'demographics-detail': ('demographics.Demographics', 'pk'),
+    'demographics-update': ('demographics.Demographics', 'pk'),
+    'appointment-update': ('appointment.Appointment', 'pk'),
+    'appointment-mark-no-show': ('appointment.Appointment', 'pk'),
+    'appointment-mark-arrived': ('appointment.Appointment', 'pk'),
+    'followup': ('followup.ActionItemFollowup', 'pk'),
+}
+
+
+def resolve_path(url):
+    """The ResolverMatch for url (a path, possibly with a query string), or
+    None if it doesn't match any URLconf entry."""
+    try:
+        return resolve(urlsplit(url).path)
+    except Resolver404:
+        return None
+
+
+def url_pattern(url):
+    """The route of the URLconf entry that url resolves to, so that e.g.
+    the detail pages of different patients count as the same page."""
+    match = resolve_path(url)
+    return match.route if match is not None else UNRESOLVED_PATTERN
+
+
+def _as_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def patient_object(match):
+    """The (model, pk) of the patient's object that match names, or None
+    if it doesn't name one."""
+    if match is None or match.view_name not in PATIENT_OBJECT_VIEWS:
+        return None
+
+    label, kwarg = PATIENT_OBJECT_VIEWS[match.view_name]
+    pk = _as_pk(match.kwargs.get(kwarg))
+    return (apps.get_model(label), pk) if pk is not None else None
+
+
+def object_patient_pks(objects):
+    """The patient_id of each of objects, an iterable of (model, pk), as a
+    dict keyed by (model, pk). Takes a query per model, and leaves out
+    objects that don't exist."""
+    pks_by_model = defaultdict(set)
+    for model, pk in objects:
+        pks_by_model[model].add(pk)
+
+    patient_pks = {}
+    for model, pks in pks_by_model.items():
+        for pk, patient_pk in model._default_manager.filter(
+                pk__in=pks).values_list('pk', 'patient_id'):
+            patient_pks[(model, pk)] = patient_pk
+    return patient_pks
+
+
+def resolve_patient_pks(records):
+    """Fill in the patient_pk of those of records (PageviewRecords) that
+    view some other object of a patient's, given as the (model, pk) in
+    their patient_object attribute, with a query per model."""
+    pending = [record for record in records
+               if record.patient_pk is None and
+               getattr(record, 'patient_object', None) is not None]
+    patient_pks = object_patient_pks(
+        record.patient_object for record in pending)
+    for record in pending:
+        record.patient_pk = patient_pks.get(record.patient_object)
+
+
+def view_fields(match, resolve_objects=True):
+    """The view_name, object_pk, and patient_pk to record for a request
+    that resolved to match (which may be None).
+
+    The patient of a view of some other object of the patient's is looked
+    up in the database, unless resolve_objects is False (in which case
+    it's left None, for the caller to fill in with resolve_patient_pks)."""
+    if match is None:
+        return {'view_name': '', 'object_pk': None, 'patient_pk': None}
+
+    object_pk = _as_pk(match.kwargs.get('pk'))
+    if match.view_name in PATIENT_PK_VIEWS:
+        patient_pk = object_pk
+    else:
+        patient_pk = _as_pk(match.kwargs.get('pt_id'))
+
+    obj = patient_object(match)
+    if patient_pk is None and obj is not None and resolve_objects:
+        patient_pk = object_patient_pks([obj]).get(obj)
+
+    return {'view_name': match.view_name[:200], 'object_pk': object_pk,
+            'patient_pk': patient_pk}
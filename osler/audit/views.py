@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.db.models import Count, Max
+from django.shortcuts import get_object_or_404, render
+
+from osler.core.models import Patient
+from osler.users.decorators import active_permission_required
+
+from osler.audit.models import PageviewRecord
+
+
+@active_permission_required('audit.view_pageviewrecord', raise_exception=True)
+def patient_access_report(request, pk):
+    """Who has looked at a patient's chart: a summary per user, and every
+    recorded page view about the patient, newest first."""
+
+    patient = get_object_or_404(Patient, pk=pk)
+    records = PageviewRecord.objects.filter(patient_pk=patient.pk)
+
+    per_user = list(records.order_by()
+                    .values('user')
+                    .annotate(views=Count('pk'), last_viewed=Max('timestamp'))
+                    .order_by('-last_viewed'))
+    users = get_user_model().objects.in_bulk(
+        [row['user'] for row in per_user if row['user'] is not None])
+    for row in per_user:
+        row['user'] = users.get(row['user'])
+
+    paginator = Paginator(
+        records.select_related('user', 'role').order_by('-timestamp', '-pk'),
+        settings.OSLER_AUDIT_RECORDS_PER_PAGE)
+    page = paginator.get_page(request.GET.get('page'))
+
+    return render(request, 'audit/patient_access.html',
+                  {'patient': patient,
+                   'per_user': per_user,
+                   'records': page})
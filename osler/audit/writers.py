@@ -0,0 +1,176 @@
+"""Sinks that AuditMiddleware hands PageviewRecords to for saving.
+
+OSLER_AUDIT_WRITER picks the sink: 'sync' saves each record inside the
+request that produced it, so a record exists as soon as the response does;
+'buffered' queues records in memory and saves them in batches from a
+background thread, keeping the write off the request path at the cost of
+losing at most one batch if the process dies without shutting down.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+
+from osler.audit.utils import resolve_patient_pks
+
+logger = logging.getLogger(__name__)
+
+
+class SynchronousAuditWriter:
+    """Saves each record immediately, in the caller's thread."""
+
+    def write(self, record):
+        resolve_patient_pks([record])
+        record.save()
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class BufferedAuditWriter:
+    """Queues records and saves them with bulk_create from a background
+    thread, whenever batch_size records are waiting or flush_interval
+    seconds have passed since the first of them was queued.
+
+    The thread is started on first use (and restarted in forked worker
+    processes), and remaining records are flushed at interpreter exit.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        atexit.register(self.close)
+
+    def write(self, record):
+        self._ensure_started()
+        self._queue.put(record)
+
+    def flush(self, timeout=None):
+        """Block until every record queued so far has been saved (or the
+        timeout, in seconds, runs out)."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Save all queued records and stop the background thread."""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            self._queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            # a forked child inherits the parent's queue but not its thread
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(
+                    target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            stopping = False
+            while not stopping:
+                batch, waiters, stopping = self._next_batch()
+                if batch:
+                    self._save(batch)
+                for waiter in waiters:
+                    waiter.set()
+        finally:
+            connection.close()
+
+    def _next_batch(self):
+        """Wait for the next batch of records. Returns the batch, any
+        flush() events to set once it is saved, and whether to stop."""
+        batch = []
+        waiters = []
+
+        item = self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is self._STOP:
+                return batch, waiters, True
+            elif isinstance(item, threading.Event):
+                # flush() wants everything before it saved now
+                waiters.append(item)
+                return batch, waiters, False
+
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, waiters, False
+
+            try:
+                item = self._queue.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return batch, waiters, False
+
+    def _save(self, batch):
+        PageviewRecord = apps.get_model('audit', 'PageviewRecord')
+        try:
+            resolve_patient_pks(batch)
+        except Exception:
+            # better saved without their patients than not at all
+            logger.exception("Failed to look up the patients of %s audit "
+                             "records.", len(batch))
+            connection.close()
+
+        try:
+            PageviewRecord.objects.bulk_create(batch)
+        except Exception:
+            logger.exception("Failed to save %s audit records together, "
+                             "saving them one by one.", len(batch))
+            # retry with a fresh connection, so that one bad record loses
+            # only itself rather than the whole batch
+            connection.close()
+            for record in batch:
+                try:
+                    record.save()
+                except Exception:
+                    logger.exception("Failed to save audit record %s.",
+                                     record)
+                    connection.close()
+
+
+_buffered_writer = None
+_buffered_writer_lock = threading.Lock()
+
+
+def get_audit_writer():
+    """The writer selected by OSLER_AUDIT_WRITER."""
+    global _buffered_writer
+
+    if settings.OSLER_AUDIT_WRITER == 'sync':
+        return SynchronousAuditWriter()
+
+    with _buffered_writer_lock:
+        if _buffered_writer is None:
+            _buffered_writer = BufferedAuditWriter(
+                batch_size=settings.OSLER_AUDIT_BATCH_SIZE,
+                flush_interval=settings.OSLER_AUDIT_FLUSH_INTERVAL)
+    return _buffered_writer
@@ -1,5 +1,7 @@
 import pytest
 
+from osler.core.models import invalidate_encounter_status_cache
+from osler.labs.utils import invalidate_lab_catalog
 from osler.users.models import User
 from osler.users.tests.factories import UserFactory
 
@@ -9,6 +11,15 @@ def media_storage(settings, tmpdir):
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def process_caches():
+    # rolling back a test's transaction doesn't send the signals that
+    # normally keep the cached encounter statuses and lab catalog current
+    yield
+    invalidate_encounter_status_cache()
+    invalidate_lab_catalog()
+
+
 @pytest.fixture
 def user() -> User:
     return UserFactory()
@@ -19,5 +19,11 @@ admin.site.register(models.ActionItem, admin_utils.ActionItemAdmin)
 class EncounterAdmin(SortableAdmin):
 	list_display = ('__str__', 'status')
 	list_filter = ('clinic_day','status')
+	actions = ['close_out']
 	#made a custom so I could javascript fix the url idk why
 	sortable_change_list_template = 'adminsortable/custom_change_list.html'
+
+	def close_out(self, request, queryset):
+		n_closed = queryset.close_out()
+		self.message_user(request, "Inactivated %s encounters." % n_closed)
+	close_out.short_description = "Inactivate selected active encounters"
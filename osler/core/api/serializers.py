@@ -31,7 +31,8 @@ class PatientSerializer(serializers.ModelSerializer):
     age = serializers.StringRelatedField(read_only=True)
     name = serializers.StringRelatedField(read_only=True)
     pk = serializers.StringRelatedField(read_only=True)
-    status = serializers.StringRelatedField(read_only=True)
+    status = serializers.StringRelatedField(source='get_status',
+                                            read_only=True)
     #case_managers = CaseManagerSerializer(many=True)
 
     # Put urls as model properties because unable to do:
@@ -90,4 +91,22 @@ class PatientSerializer(serializers.ModelSerializer):
                 kwargs['read_only'] = True
                 extra_kwargs[field_name] = kwargs
 
-        return extra_kwargs
\ No newline at end of file
+        return extra_kwargs
+
+class TimelineNoteSerializer(serializers.Serializer):
+    """Read-only summary of any kind of note in a patient's timeline."""
+
+    type = serializers.SerializerMethodField()
+    pk = serializers.IntegerField(read_only=True)
+    written_datetime = serializers.DateTimeField(read_only=True)
+    author = serializers.StringRelatedField(read_only=True)
+    author_type = serializers.StringRelatedField(read_only=True)
+    summary = serializers.SerializerMethodField()
+
+    def get_type(self, note):
+        return note._meta.model_name
+
+    def get_summary(self, note):
+        if hasattr(note, 'short_text'):
+            return note.short_text()
+        return str(note)
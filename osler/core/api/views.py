@@ -3,7 +3,9 @@ from builtins import str
 from functools import partial
 
 import django.utils.timezone
+from django.conf import settings
 from django.db.models import Min
+from django.utils.dateparse import parse_datetime
 
 from rest_framework import generics
 
@@ -13,19 +15,77 @@ from osler.referral import models as referrals
 
 from osler.workup.api import serializers
 
-from osler.core.api.serializers import PatientSerializer
+from osler.core.api.serializers import PatientSerializer, TimelineNoteSerializer
 from osler.core.models import Patient
+from osler.core import utils
 
 from rest_framework import status
-# from rest_framework.decorators import action
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin, UpdateModelMixin
 from rest_framework.response import Response
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, UpdateModelMixin, ListModelMixin
 from rest_framework.viewsets import GenericViewSet
 
+def decode_timeline_cursor(cursor):
+    """Turn a timeline cursor back into a Patient.timeline_key, or None if
+    it is malformed."""
+    values = utils.decode_cursor(cursor)
+    try:
+        written, label, pk = values
+        written = parse_datetime(written)
+    except (TypeError, ValueError):
+        return None
+
+    if written is None or not isinstance(label, str) or not isinstance(pk, int):
+        return None
+    return (written, label, pk)
+
+
 class PatientViewSet(CreateModelMixin,RetrieveModelMixin,UpdateModelMixin,ListModelMixin,GenericViewSet):
     serializer_class = PatientSerializer
-    queryset = Patient.objects.all()
+    queryset = Patient.objects.with_status()
+
+    @action(detail=True, methods=["GET"])
+    def timeline(self, request, pk=None):
+        """A page of the patient's notes of every kind, newest first.
+
+        Takes an optional page_size and the opaque cursor returned as
+        'next' by the previous page.
+        """
+        patient = self.get_object()
+
+        try:
+            page_size = int(request.query_params.get(
+                'page_size', settings.OSLER_TIMELINE_PAGE_SIZE))
+        except ValueError:
+            page_size = settings.OSLER_TIMELINE_PAGE_SIZE
+        page_size = max(1, min(page_size, settings.OSLER_TIMELINE_MAX_PAGE_SIZE))
+
+        before = None
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            before = decode_timeline_cursor(cursor)
+            if before is None:
+                raise ValidationError({'cursor': 'Invalid cursor'})
+
+        # one extra note tells us whether there is a next page
+        notes = list(patient.timeline(before=before, limit=page_size + 1))
+
+        next_url = None
+        if len(notes) > page_size:
+            notes = notes[:page_size]
+            written, label, note_pk = Patient.timeline_key(notes[-1])
+            params = request.query_params.copy()
+            params['cursor'] = utils.encode_cursor(
+                [written.isoformat(), label, note_pk])
+            next_url = request.build_absolute_uri(
+                '%s?%s' % (request.path, params.urlencode()))
+
+        return Response(status=status.HTTP_200_OK, data={
+            'next': next_url,
+            'results': TimelineNoteSerializer(notes, many=True).data,
+        })
 
 """    
 def active_patients_filter(qs):
@@ -0,0 +1,45 @@
+import datetime
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import localdate
+
+from osler.core import models
+
+
+class Command(BaseCommand):
+    help = """Gives patients an active encounter on a clinic day (today by
+    default), either the patients with the given pks or, with
+    --appointments, every patient with an appointment that day who hasn't
+    been marked as a no-show."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('patients', nargs='*', type=int,
+                            help="pks of the patients to check in.")
+        parser.add_argument(
+            '--appointments', action='store_true',
+            help="Check in the patients with appointments that day.")
+        parser.add_argument(
+            '--date', type=datetime.date.fromisoformat,
+            help="The clinic day, as YYYY-MM-DD.")
+
+    def handle(self, *args, **options):
+        clinic_day = options['date'] or localdate()
+
+        patients = set(options['patients'])
+        if options['appointments']:
+            Appointment = apps.get_model('appointment', 'Appointment')
+            patients.update(Appointment.objects
+                            .filter(clindate=clinic_day)
+                            .exclude(pt_showed=False)
+                            .values_list('patient', flat=True))
+        elif not patients:
+            raise CommandError("Give patient pks or --appointments.")
+
+        n_created, n_activated = models.Encounter.objects.check_in(
+            patients, clinic_day)
+
+        self.stdout.write(
+            "Checked in %s patients on %s (%s new encounters, %s "
+            "reactivated)." % (len(patients), clinic_day, n_created,
+                               n_activated))
@@ -0,0 +1,24 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import localdate
+
+from osler.core import models
+
+
+class Command(BaseCommand):
+    help = """Inactivates every active encounter on a clinic day (today by
+    default), e.g. at the end of clinic night."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date', type=datetime.date.fromisoformat,
+            help="The clinic day to close, as YYYY-MM-DD.")
+
+    def handle(self, *args, **options):
+        clinic_day = options['date'] or localdate()
+        n_closed = models.Encounter.objects \
+            .filter(clinic_day=clinic_day).close_out()
+
+        self.stdout.write("Inactivated %s encounters on %s." % (
+            n_closed, clinic_day))
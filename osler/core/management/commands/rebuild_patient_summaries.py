@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from osler.core import models
+
+
+class Command(BaseCommand):
+    help = """Rebuilds the PatientSummary of every patient from scratch.
+    Summaries are normally kept current by signals, so this is only needed
+    after bulk changes made without them (e.g. raw SQL or queryset.update).
+    With --missing, only builds summaries for patients that have none,
+    which is a deploy step after upgrading to a version with summaries."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help="Only build summaries for patients that don't have one.")
+
+    def handle(self, *args, **options):
+        if options['missing']:
+            n_patients = len(models.PatientSummary.objects.refresh_missing())
+        else:
+            n_patients = 0
+            for patient in models.Patient.objects \
+                    .with_actionitem_status().iterator():
+                models.PatientSummary.objects.refresh(patient)
+                n_patients += 1
+
+        self.stdout.write("Rebuilt summaries for %s patients." % n_patients)
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.2 on 2026-10-18 18:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workup', '0008_auto_20201207_1611'),
+        ('core', '0007_make_encounters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSummary',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='core.patient')),
+                ('is_attested', models.BooleanField(default=False)),
+                ('next_due_date', models.DateField(blank=True, null=True)),
+                ('next_due_name', models.CharField(blank=True, max_length=100)),
+                ('any_done', models.BooleanField(default=False)),
+                ('intake_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('latest_workup', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='workup.workup')),
+                ('status', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.encounterstatus')),
+            ],
+            options={
+                'verbose_name_plural': 'patient summaries',
+            },
+        ),
+    ]
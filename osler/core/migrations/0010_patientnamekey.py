@@ -0,0 +1,91 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:04
+
+import string
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Frozen copies of the key functions in osler.core.utils as they were when
+# this migration was written, so that later changes there can't change
+# what this migration does.
+
+def normalize_name(name):
+    if not name:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ''.join(c for c in decomposed.lower()
+                   if c in string.ascii_lowercase)
+
+
+SOUNDEX_CODES = dict(
+    [(c, '1') for c in 'bfpv'] + [(c, '2') for c in 'cgjkqsxz'] +
+    [(c, '3') for c in 'dt'] + [('l', '4')] + [(c, '5') for c in 'mn'] +
+    [('r', '6')])
+
+
+def soundex(name):
+    if not name:
+        return ''
+
+    code = [name[0]]
+    previous = SOUNDEX_CODES.get(name[0])
+    for c in name[1:]:
+        digit = SOUNDEX_CODES.get(c)
+        if digit is not None and digit != previous:
+            code.append(digit)
+        if c not in 'hw':
+            previous = digit
+
+    return (''.join(code) + '000')[:4]
+
+
+def name_keys(first_name, last_name):
+    keys = set()
+    for field, name in [('f', first_name), ('l', last_name)]:
+        name = normalize_name(name)
+        if not name:
+            continue
+        keys.add((field, 'e', name))
+        keys.add((field, 'p', soundex(name)))
+        keys.update((field, 'd', name[:i] + name[i + 1:])
+                    for i in range(1, len(name)))
+
+    return keys
+
+
+def index_patient_names(apps, schema_editor):
+    Patient = apps.get_model('core', 'Patient')
+    PatientNameKey = apps.get_model('core', 'PatientNameKey')
+
+    for patient in Patient.objects.all().iterator():
+        PatientNameKey.objects.bulk_create(
+            PatientNameKey(patient=patient, field=field, kind=kind, key=key)
+            for field, kind, key in name_keys(
+                patient.first_name, patient.last_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_patient_name_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientNameKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('f', 'first name'), ('l', 'last name')], max_length=1)),
+                ('kind', models.CharField(choices=[('e', 'normalized name'), ('d', 'deletion'), ('p', 'phonetic code')], max_length=1)),
+                ('key', models.CharField(max_length=100)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_keys', to='core.patient')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='patientnamekey',
+            index=models.Index(fields=['field', 'kind', 'key'], name='core_patien_field_062752_idx'),
+        ),
+        migrations.RunPython(index_patient_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_patientnamekey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='encounter',
+            index=models.Index(fields=['patient', 'clinic_day'], name='core_encoun_patient_e6339c_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.2 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_encounter_patient_clinic_day'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='patientnamekey',
+            name='core_patien_field_062752_idx',
+        ),
+        migrations.AddIndex(
+            model_name='patientnamekey',
+            index=models.Index(fields=['field', 'kind', 'key'], name='core_patientnamekey_key_like', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+    ]
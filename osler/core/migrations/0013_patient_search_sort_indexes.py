@@ -0,0 +1,88 @@
+# Generated by Django 3.1.2 on 2026-10-18 20:26
+
+import datetime
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def fill_sort_keys(apps, schema_editor):
+    PatientSummary = apps.get_model('core', 'PatientSummary')
+
+    summaries = PatientSummary.objects \
+        .select_related('latest_workup__encounter').iterator()
+    batch = []
+    for summary in summaries:
+        summary.last_seen = (
+            summary.latest_workup.encounter.clinic_day
+            if summary.latest_workup else
+            django.utils.timezone.localdate(summary.intake_date))
+        summary.next_due = summary.next_due_date or datetime.date.max
+        batch.append(summary)
+        if len(batch) >= 1000:
+            PatientSummary.objects.bulk_update(
+                batch, ['last_seen', 'next_due'])
+            batch = []
+    PatientSummary.objects.bulk_update(batch, ['last_seen', 'next_due'])
+
+
+# istartswith compiles to UPPER("col"::text) LIKE UPPER(%s) on PostgreSQL,
+# which only an index on that expression with text_pattern_ops can serve.
+# Django 3.1 can't declare expression indexes on a model, so they're made
+# here, and only on PostgreSQL.
+UPPER_NAME_INDEXES = [
+    ('core_patient_upper_last_name', 'last_name'),
+    ('core_patient_upper_first_name', 'first_name'),
+]
+
+
+def create_upper_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, column in UPPER_NAME_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX %s ON core_patient (UPPER(%s::text) '
+            'text_pattern_ops)' % (schema_editor.quote_name(name),
+                                   schema_editor.quote_name(column)))
+
+
+def drop_upper_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in UPPER_NAME_INDEXES:
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS %s' % schema_editor.quote_name(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_patientnamekey_pattern_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='core_patien_first_n_5013c7_idx',
+        ),
+        migrations.AddField(
+            model_name='patientsummary',
+            name='last_seen',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AddField(
+            model_name='patientsummary',
+            name='next_due',
+            field=models.DateField(default=datetime.date(9999, 12, 31)),
+        ),
+        migrations.AddIndex(
+            model_name='patientsummary',
+            index=models.Index(fields=['last_seen', 'patient'], name='core_patien_last_se_272cff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientsummary',
+            index=models.Index(fields=['next_due', 'patient'], name='core_patien_next_du_6f2b94_idx'),
+        ),
+        migrations.RunPython(fill_sort_keys, migrations.RunPython.noop),
+        migrations.RunPython(create_upper_name_indexes,
+                             drop_upper_name_indexes),
+    ]
@@ -1,11 +1,16 @@
 '''The datamodels for the Osler core'''
-from itertools import chain
-
-from django.db import models
+import datetime
+import heapq
+from itertools import chain, islice
+
+from django.apps import apps
+from django.db import connection, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
 from django.conf import settings
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 from django.utils.text import slugify
 from django.urls import reverse
 from django.core.exceptions import MultipleObjectsReturned
@@ -14,6 +19,7 @@ from simple_history.models import HistoricalRecords
 from adminsortable.models import SortableMixin
 
 from osler.core import validators
+from osler.core.process_cache import VersionedProcessCache
 from osler.core import utils
 
 from osler.users.utils import group_has_perm
@@ -162,6 +168,92 @@ class Provider(Person):
         return "Provider Object on %s." % self.user
 
 
+class PatientQuerySet(models.QuerySet):
+
+    def with_actionitem_status(self):
+        """Annotate each patient with the state of their completables
+        (i.e. every model in settings.OSLER_TODO_LIST_MANAGERS), computed
+        in the database from a UNION of the completable tables:
+
+            ai_overdue: number of incomplete items due today or earlier
+            ai_pending: number of incomplete items due after today
+            ai_done: number of completed items
+            ai_next_due_date: due date of the earliest incomplete item
+            ai_next_due_name: short name of that item
+
+        PatientSummary.objects.refresh() stores these for the patient
+        lists, and Patient.actionitem_status() uses them when present,
+        so neither has to load any action items.
+        """
+        union_sql, union_params = completables_union_sql()
+        patient_pk = '%s.%s' % (
+            connection.ops.quote_name(self.model._meta.db_table),
+            connection.ops.quote_name(self.model._meta.pk.column))
+
+        def completables_subquery(select, where, order='', params=()):
+            sql = ("SELECT %s FROM (%s) completables "
+                   "WHERE completables.c_patient = %s AND %s %s" %
+                   (select, union_sql, patient_pk, where, order))
+            return union_params + tuple(params), sql
+
+        def count(where, params=()):
+            params, sql = completables_subquery('COUNT(*)', where,
+                                                params=params)
+            return RawSQL(sql, params, output_field=models.IntegerField())
+
+        def earliest(column, output_field):
+            params, sql = completables_subquery(
+                'completables.%s' % column,
+                'completables.c_author IS NULL',
+                order='ORDER BY completables.c_due_date LIMIT 1')
+            return RawSQL(sql, params, output_field=output_field)
+
+        today = now().date()
+        return self.annotate(
+            ai_overdue=count('completables.c_author IS NULL AND '
+                             'completables.c_due_date <= %s', (today,)),
+            ai_pending=count('completables.c_author IS NULL AND '
+                             'completables.c_due_date > %s', (today,)),
+            ai_done=count('completables.c_author IS NOT NULL'),
+            ai_next_due_date=earliest('c_due_date', models.DateField()),
+            ai_next_due_name=earliest('c_name', models.CharField()))
+
+    def with_status(self):
+        """Annotate each patient with their latest encounter (the one on
+        the latest clinic day) as latest_encounter_id, and that encounter's
+        status as latest_status_id, from subqueries on the (patient,
+        clinic_day) index. Both are None for patients without encounters.
+
+        Patient.get_status() uses these when present, so patient lists can
+        show statuses without a query per patient.
+        """
+        latest = Encounter.objects \
+            .filter(patient=models.OuterRef('pk')) \
+            .order_by('-clinic_day', '-pk')
+        return self.annotate(
+            latest_encounter_id=models.Subquery(latest.values('pk')[:1]),
+            latest_status_id=models.Subquery(latest.values('status')[:1]))
+
+    def with_last_seen(self):
+        """Annotate each patient with last_seen_datetime, when their latest
+        completed workup was written (None if they have none).
+
+        Patient.last_seen() uses it when present.
+        """
+        return self.annotate(
+            last_seen_datetime=last_seen_subquery(models.OuterRef('pk')))
+
+
+def last_seen_subquery(patient):
+    """Subquery for the written_datetime of patient's (an expression for a
+    patient pk) latest completed workup, by clinic day like
+    Patient.latest_workup()."""
+    workups = apps.get_model('workup', 'Workup').objects \
+        .filter(patient=patient, is_pending=False) \
+        .order_by('-encounter__clinic_day')
+    return models.Subquery(workups.values('written_datetime')[:1])
+
+
 class Patient(Person):
 
     class Meta:
@@ -170,6 +262,12 @@ class Patient(Person):
             ('activate_Patient', "Can in/activate patients")
         ]
         ordering = ["last_name",]
+        # the patient search's case-insensitive prefix matches are served
+        # by indexes on UPPER(first_name) and UPPER(last_name), which are
+        # made on PostgreSQL by migration 0013
+        indexes = [
+            models.Index(fields=['last_name', 'first_name']),
+        ]
 
 
     case_managers = models.ManyToManyField(settings.AUTH_USER_MODEL)
@@ -222,6 +320,8 @@ class Patient(Person):
 
     history = HistoricalRecords()
 
+    objects = PatientQuerySet.as_manager()
+
     def age(self):
         return (now().date() - self.date_of_birth).days // 365
 
@@ -258,6 +358,13 @@ class Patient(Person):
             key=lambda ai: ai.due_date)
 
     def actionitem_status(self):
+        # Patients from Patient.objects.with_actionitem_status() already
+        # have everything we need annotated on them.
+        if hasattr(self, 'ai_next_due_date'):
+            return format_actionitem_status(
+                self.ai_next_due_date, self.ai_next_due_name,
+                self.ai_done > 0)
+
         # The active_action_items, done_action_items, and inactive_action_items
         # aren't a big deal to use when getting just one patient
         # For the all_patients page though (one of the pages that use status),
@@ -276,24 +383,16 @@ class Patient(Person):
                                           vaccine_action_items))
 
         done = [ai for ai in patient_action_items if ai.completion_author is not None]
-        overdue = [ai for ai in patient_action_items if ai.completion_author is None and ai.due_date <= now().date()]
-        pending = [ai for ai in patient_action_items if ai.completion_author is None and ai.due_date > now().date()]
-
-        if len(overdue) > 0:
-            oldest = min(overdue, key=lambda k: k.due_date)
-            tdelta = now().date() - oldest.due_date
-            return str(oldest.short_name())+" "+str(tdelta.days)+" days past due"
-
-            # due_dates = ", ".join([str((now().date()-ai.due_date).days) for ai in overdue])
-            # return "Action items " + due_dates + " days past due"
-        elif len(pending) > 0:
-            next_item = min(pending, key=lambda k: k.due_date)
-            tdelta = next_item.due_date - now().date()
-            return str(next_item.short_name())+" in "+str(tdelta.days)+" days"
-        elif len(done) > 0:
-            return "all actions complete"
-        else:
-            return "no pending actions"
+        not_done = [ai for ai in patient_action_items if ai.completion_author is None]
+
+        # the earliest incomplete item is the oldest overdue one if there
+        # are any overdue, otherwise it's the next pending one.
+        next_item = min(not_done, key=lambda k: k.due_date, default=None)
+        if next_item is None:
+            return format_actionitem_status(None, None, len(done) > 0)
+
+        return format_actionitem_status(
+            next_item.due_date, next_item.short_name(), len(done) > 0)
 
     def followup_set(self):
         followups = []
@@ -320,22 +419,73 @@ class Patient(Person):
         else:
             return None
 
+    # The reverse relations holding the notes in a patient's history, with
+    # the related objects needed to display each kind of note. Used by
+    # notes() and timeline().
+    NOTE_SETS = [
+        ('workup_set', [], []),
+        ('actionitemfollowup_set', [], []),
+        ('document_set', ['document_type'], []),
+        ('vaccinedose_set', ['which_dose__kind'], []),
+        ('vaccinefollowup_set', [], []),
+        ('patientcontact_set', ['contact_status'], ['appointment_location']),
+        ('dispensehistory_set', ['drug'], []),
+    ]
+
     def notes(self):
         '''Returns a list of all the notes (workups and followups) associated
         with this patient ordered by date written.'''
         note_list = []
 
-        note_list.extend(self.workup_set.all())
-        note_list.extend(self.followup_set())
-        note_list.extend(self.document_set.all())
-        note_list.extend(self.vaccinedose_set.all())
-        note_list.extend(self.vaccinefollowup_set.all())
-        note_list.extend(self.patientcontact_set.all())
-        note_list.extend(self.dispensehistory_set.all())
+        for note_set, _, _ in self.NOTE_SETS:
+            note_list.extend(getattr(self, note_set).all())
 
         return sorted(note_list, key=lambda k: k.written_datetime)
 
+    @staticmethod
+    def timeline_key(note):
+        """The position of note in a patient's timeline: notes are ordered
+        by written_datetime, with ties broken by note type and pk."""
+        return (note.written_datetime, note._meta.label_lower, note.pk)
+
+    def timeline(self, before=None, limit=None):
+        """Generate this patient's notes newest first.
+
+        Each kind of note is read from its own queryset, ordered by the
+        database, and the querysets are combined with a k-way merge, so
+        the whole history is never loaded or sorted in memory. If before
+        (a timeline_key) is given, the timeline starts at the first note
+        after it; if limit is given, at most that many notes are read
+        from each queryset and generated in total.
+        """
+        streams = []
+        for note_set, related, prefetch in self.NOTE_SETS:
+            notes = getattr(self, note_set) \
+                .select_related('author', 'author_type', *related) \
+                .prefetch_related(*prefetch) \
+                .order_by('-written_datetime', '-pk')
+
+            if before is not None:
+                written, label, pk = before
+                own_label = notes.model._meta.label_lower
+                earlier = models.Q(written_datetime__lt=written)
+                if own_label < label:
+                    earlier |= models.Q(written_datetime=written)
+                elif own_label == label:
+                    earlier |= models.Q(written_datetime=written, pk__lt=pk)
+                notes = notes.filter(earlier)
+
+            streams.append(notes[:limit] if limit is not None
+                           else notes.iterator())
+
+        return islice(heapq.merge(*streams, key=self.timeline_key,
+                                  reverse=True), limit)
+
     def last_seen(self):
+        # Patients from Patient.objects.with_last_seen() already know it
+        if hasattr(self, 'last_seen_datetime'):
+            return self.last_seen_datetime or now().date()
+
         if self.latest_workup() is not None:
             return self.latest_workup().written_datetime
         else:
@@ -354,15 +504,19 @@ class Patient(Person):
         return phones
 
     def last_encounter(self):
-        if Encounter.objects.filter(patient=self.pk).exists():
-            last_encounter = Encounter.objects.filter(patient=self.pk).order_by('clinic_day').last()
-            return last_encounter
-        else:
-            return None
+        return Encounter.objects.filter(patient=self.pk) \
+            .order_by('-clinic_day', '-pk').select_related('status').first()
 
     def get_status(self):
-        if self.last_encounter() is not None:
-            return self.last_encounter().status
+        # Patients from Patient.objects.with_status() already know it
+        if hasattr(self, 'latest_status_id'):
+            if self.latest_status_id is None:
+                return default_inactive_status()
+            return encounter_status(self.latest_status_id)
+
+        last_encounter = self.last_encounter()
+        if last_encounter is not None:
+            return last_encounter.status
         else:
             return default_inactive_status()
 
@@ -404,6 +558,45 @@ class Patient(Person):
         return group_has_perm(group, 'core.activate_Patient')
 
 
+def format_actionitem_status(due_date, short_name, any_done):
+    """Build the "Next AI Due" string shown in patient lists.
+
+    due_date and short_name describe the earliest incomplete completable
+    (or are None if there isn't one), and any_done is whether any
+    completable has been marked done.
+    """
+    if due_date is not None:
+        tdelta = (due_date - now().date()).days
+        if tdelta <= 0:
+            return str(short_name) + " " + str(-tdelta) + " days past due"
+        else:
+            return str(short_name) + " in " + str(tdelta) + " days"
+    elif any_done:
+        return "all actions complete"
+    else:
+        return "no pending actions"
+
+
+def completables_union_sql():
+    """SQL (and params) for a UNION ALL of every completable model in
+    settings.OSLER_TODO_LIST_MANAGERS, with the columns c_patient,
+    c_due_date, c_author (the completion author), and c_name (the short
+    name).
+    """
+    completables = [
+        apps.get_model(app, model).objects.order_by().values(
+            c_patient=models.F('patient'),
+            c_due_date=models.F('due_date'),
+            c_author=models.F('completion_author'),
+            c_name=Cast(apps.get_model(app, model).short_name_expression(),
+                        models.CharField()))
+        for app, model in settings.OSLER_TODO_LIST_MANAGERS]
+
+    union = completables[0].union(*completables[1:], all=True)
+    sql, params = union.query.get_compiler(connection=connection).as_sql()
+    return sql, tuple(params)
+
+
 class Note(models.Model):
     class Meta:
         abstract = True
@@ -478,6 +671,10 @@ class CompletableMixin(models.Model):
 
     objects = CompletableManager()
 
+    # related objects that displaying a completable (e.g. in the action
+    # item lists on the patient chart) needs, for use with select_related
+    DISPLAY_RELATED_FIELDS = ['author', 'author_type']
+
     completion_date = models.DateTimeField(blank=True, null=True)
     completion_author = models.ForeignKey(
         get_user_model(),
@@ -508,6 +705,16 @@ class CompletableMixin(models.Model):
             "All Completables must have an 'short_name' property that "
             "is indicates what one has to do of completable this is ")
 
+    @classmethod
+    def short_name_expression(cls):
+        """A database expression that evaluates to short_name(), so that
+        short names can be computed in queries (see
+        PatientQuerySet.with_actionitem_status).
+        """
+        raise NotImplementedError(
+            "All Completables must have a 'short_name_expression' "
+            "classmethod that computes short_name in the database.")
+
     def summary(self):
         """Text that should be displayed on the core:patient-detail view to
         describe what must be done to mark this Completable as done.
@@ -528,12 +735,20 @@ class AbstractActionItem(Note, CompletableMixin):
                                     on_delete=models.PROTECT)
     comments = models.TextField()
 
+    DISPLAY_RELATED_FIELDS = CompletableMixin.DISPLAY_RELATED_FIELDS + [
+        'instruction']
+
     def class_name(self):
         return self.__class__.__name__
 
     def short_name(self):
         return str(self.instruction)
 
+    @classmethod
+    def short_name_expression(cls):
+        # ActionInstruction's primary key is the instruction text itself
+        return models.F('instruction')
+
     def summary(self):
         return self.comments
 
@@ -577,18 +792,122 @@ class EncounterStatus(models.Model):
         return self.name
 
 
+def _load_encounter_statuses(key):
+    return {status.name: status for status in EncounterStatus.objects.all()}
+
+
+# EncounterStatus is a short table that nearly every patient list reads, so
+# each process memoizes all of it, reloading whenever a status changes (see
+# osler.core.signals).
+_encounter_statuses = VersionedProcessCache(
+    'osler.core.encounter_status_version', _load_encounter_statuses)
+
+
+def invalidate_encounter_status_cache():
+    """Forget the memoized encounter statuses, in this and all other
+    processes."""
+
+    _encounter_statuses.invalidate()
+
+
+def encounter_status(name):
+    """The EncounterStatus called name, from the process cache if it is
+    current and from the database otherwise."""
+
+    statuses = _encounter_statuses.get()
+    if name not in statuses:
+        # perhaps added since this process loaded them
+        _encounter_statuses.forget()
+        statuses = _encounter_statuses.get()
+
+    try:
+        return statuses[name]
+    except KeyError:
+        raise EncounterStatus.DoesNotExist(
+            "No EncounterStatus called %r." % name)
+
+
+def _default_status(setting):
+    name, is_active = setting
+    try:
+        return encounter_status(name)
+    except EncounterStatus.DoesNotExist:
+        status, created = EncounterStatus.objects.get_or_create(
+            name=name, is_active=is_active)
+        return status
+
+
 def default_active_status():
-    status, created = EncounterStatus.objects.get_or_create(
-        name=settings.OSLER_DEFAULT_ACTIVE_STATUS[0],
-        is_active=settings.OSLER_DEFAULT_ACTIVE_STATUS[1])
-    return status
+    return _default_status(settings.OSLER_DEFAULT_ACTIVE_STATUS)
 
 
 def default_inactive_status():
-    status, created = EncounterStatus.objects.get_or_create(
-        name=settings.OSLER_DEFAULT_INACTIVE_STATUS[0],
-        is_active=settings.OSLER_DEFAULT_INACTIVE_STATUS[1])
-    return status
+    return _default_status(settings.OSLER_DEFAULT_INACTIVE_STATUS)
+
+
+class EncounterQuerySet(models.QuerySet):
+
+    def close_out(self):
+        """Inactivate every active encounter in this queryset (e.g. all of
+        a clinic day's at the end of the night) with a single bulk_update.
+        Returns the number of encounters inactivated."""
+
+        inactive = default_inactive_status()
+        with transaction.atomic():
+            encounters = list(self.filter(status__is_active=True)
+                              .select_for_update(of=('self',))
+                              .only('pk', 'patient_id', 'status_id'))
+            for encounter in encounters:
+                encounter.status = inactive
+            self.model.objects.bulk_update(encounters, ['status'])
+
+            PatientSummary.objects.refresh_statuses(
+                {encounter.patient_id for encounter in encounters})
+
+        return len(encounters)
+
+    def check_in(self, patients, clinic_day):
+        """Give each of patients (Patients or pks) an active encounter on
+        clinic_day, in one transaction. Patients with no encounter that day
+        get a new one; those whose encounters that day are all inactive
+        have the latest of them activated. Returns the numbers of
+        encounters created and activated."""
+
+        active = default_active_status()
+        patient_pks = {getattr(patient, 'pk', patient) for patient in patients}
+
+        with transaction.atomic():
+            latest = {}
+            checked_in = set()
+            for encounter in self.model.objects \
+                    .filter(patient__in=patient_pks, clinic_day=clinic_day) \
+                    .select_for_update(of=('self',)) \
+                    .select_related('status') \
+                    .order_by('pk'):
+                latest[encounter.patient_id] = encounter
+                if encounter.status.is_active:
+                    checked_in.add(encounter.patient_id)
+
+            activated = [encounter for patient_pk, encounter in latest.items()
+                         if patient_pk not in checked_in]
+            for encounter in activated:
+                encounter.status = active
+            self.model.objects.bulk_update(activated, ['status'])
+
+            # bulk_create skips SortableMixin.save, which would put each new
+            # encounter at the end of the active patients list
+            max_order = self.model.objects.aggregate(
+                models.Max('order'))['order__max'] or 0
+            created = self.model.objects.bulk_create(
+                self.model(patient_id=patient_pk, clinic_day=clinic_day,
+                           status=active, order=max_order + i)
+                for i, patient_pk in enumerate(
+                    sorted(patient_pks - set(latest)), start=1))
+
+            PatientSummary.objects.refresh_statuses(
+                {encounter.patient_id for encounter in created + activated})
+
+        return len(created), len(activated)
 
 
 class Encounter(SortableMixin):
@@ -597,7 +916,12 @@ class Encounter(SortableMixin):
     Can reoder in admin panel for Active Patients page'''
     class Meta:
         ordering = ['order']
-    
+        indexes = [
+            models.Index(fields=['patient', 'clinic_day']),
+        ]
+
+    objects = EncounterQuerySet.as_manager()
+
     order = models.PositiveIntegerField(default=0, editable=False, db_index=True)
     patient = models.ForeignKey(Patient, on_delete=models.PROTECT)
     clinic_day = models.DateField()
@@ -609,3 +933,182 @@ class Encounter(SortableMixin):
 
     def __str__(self):
         return str(self.patient) + " on " + self.clinic_day.strftime('%A, %B %d, %Y')
+
+
+class PatientSummaryManager(models.Manager):
+    """Handles (re)building PatientSummary rows from the source tables."""
+
+    def refresh(self, patient):
+        """Recompute and store the summary for patient. Called by the
+        signal handlers in osler.core.signals whenever one of the models
+        feeding the summary is saved or deleted."""
+
+        # the action item fields come from the same annotation the patient
+        # lists can use, so the two can't disagree
+        if not hasattr(patient, 'ai_next_due_date'):
+            patient = Patient.objects.with_actionitem_status() \
+                .get(pk=getattr(patient, 'pk', patient))
+
+        latest_workup = patient.workup_set \
+            .order_by('-encounter__clinic_day', '-written_datetime') \
+            .first()
+
+        last_encounter = patient.last_encounter()
+
+        intake = patient.history.order_by('history_date').first()
+        intake_date = intake.history_date if intake else now()
+
+        summary, created = self.update_or_create(
+            patient=patient,
+            defaults={
+                'latest_workup': latest_workup,
+                'is_attested': (latest_workup is not None and
+                                latest_workup.signer_id is not None),
+                'next_due_date': patient.ai_next_due_date,
+                'next_due_name': patient.ai_next_due_name or '',
+                'any_done': patient.ai_done > 0,
+                'intake_date': intake_date,
+                'status': last_encounter.status if last_encounter else None,
+                'last_seen': (latest_workup.encounter.clinic_day
+                              if latest_workup else localdate(intake_date)),
+                'next_due': patient.ai_next_due_date or datetime.date.max,
+            })
+
+        return summary
+
+    def refresh_statuses(self, patient_pks):
+        """Update just the status of the summaries of the patients with pks
+        in patient_pks, in one query, after their encounters were changed
+        in bulk (without signals)."""
+
+        latest = Encounter.objects \
+            .filter(patient=models.OuterRef('patient')) \
+            .order_by('-clinic_day', '-pk')
+        return self.filter(patient__in=patient_pks).update(
+            status=models.Subquery(latest.values('status')[:1]))
+
+    def refresh_missing(self):
+        """Build summaries for any patients that don't have one yet (e.g.
+        patients entered before PatientSummary existed). Run by
+        rebuild_patient_summaries --missing, as a deploy step."""
+
+        missing = Patient.objects.filter(summary__isnull=True) \
+            .with_actionitem_status().iterator()
+        return [self.refresh(patient) for patient in missing]
+
+
+class PatientSummary(models.Model):
+    """Denormalized, per-patient digest of the data shown in patient lists.
+
+    Kept current by the signal handlers in osler.core.signals so that the
+    all patients and active patients lists can render from a single
+    query instead of walking each patient's workups, action items, and
+    history.
+    """
+
+    class Meta:
+        verbose_name_plural = "patient summaries"
+        indexes = [
+            models.Index(fields=['last_seen', 'patient']),
+            models.Index(fields=['next_due', 'patient']),
+        ]
+
+    objects = PatientSummaryManager()
+
+    patient = models.OneToOneField(
+        Patient, primary_key=True, related_name='summary',
+        on_delete=models.CASCADE)
+
+    latest_workup = models.ForeignKey(
+        'workup.Workup', null=True, blank=True, related_name='+',
+        on_delete=models.SET_NULL)
+    is_attested = models.BooleanField(default=False)
+
+    next_due_date = models.DateField(blank=True, null=True)
+    next_due_name = models.CharField(max_length=100, blank=True)
+    any_done = models.BooleanField(default=False)
+
+    intake_date = models.DateTimeField(default=now)
+
+    status = models.ForeignKey(
+        EncounterStatus, null=True, blank=True,
+        on_delete=models.SET_NULL)
+
+    # indexed sort keys for the patient search: the clinic day of the
+    # latest workup, or the day of intake if there isn't one, and the next
+    # due date, with patients who have nothing due last
+    last_seen = models.DateField(default=localdate)
+    next_due = models.DateField(default=datetime.date.max)
+
+    def actionitem_status(self):
+        return format_actionitem_status(
+            self.next_due_date, self.next_due_name, self.any_done)
+
+    def __str__(self):
+        return "Summary of %s" % self.patient_id
+
+
+class PatientNameKeyManager(models.Manager):
+    """Handles (re)building the name keys of patients."""
+
+    def rebuild(self, patient):
+        """Bring the stored keys of patient in line with its current
+        name. Called by the signal handlers in osler.core.signals whenever
+        a patient is saved; if the name hasn't changed, nothing is
+        written."""
+
+        wanted = utils.name_keys(patient.first_name, patient.last_name)
+        stored = {(field, kind, key): pk for pk, field, kind, key
+                  in self.filter(patient=patient).values_list(
+                      'pk', 'field', 'kind', 'key')}
+
+        stale = [pk for triple, pk in stored.items() if triple not in wanted]
+        if stale:
+            self.filter(pk__in=stale).delete()
+
+        return self.bulk_create(
+            self.model(patient=patient, field=field, kind=kind, key=key)
+            for field, kind, key in wanted - set(stored))
+
+
+class PatientNameKey(models.Model):
+    """A precomputed lookup key for a patient's first or last name.
+
+    Each patient is indexed under its normalized name, the name's
+    phonetic (Soundex) code, and the name's deletion neighbourhood (see
+    osler.core.utils.deletion_keys), so that duplicate detection at
+    intake is a handful of indexed equality lookups rather than a
+    comparison against every spelling variation of the entered name.
+    """
+
+    FIRST = 'f'
+    LAST = 'l'
+    FIELD_CHOICES = [(FIRST, 'first name'), (LAST, 'last name')]
+
+    EXACT = 'e'
+    DELETION = 'd'
+    PHONETIC = 'p'
+    KIND_CHOICES = [(EXACT, 'normalized name'), (DELETION, 'deletion'),
+                    (PHONETIC, 'phonetic code')]
+
+    class Meta:
+        indexes = [
+            # varchar_pattern_ops serves the prefix (LIKE 'abc%') lookups
+            # of abbreviated first names as well as the equality lookups
+            models.Index(fields=['field', 'kind', 'key'],
+                         name='core_patientnamekey_key_like',
+                         opclasses=['varchar_pattern_ops'] * 3),
+        ]
+
+    objects = PatientNameKeyManager()
+
+    patient = models.ForeignKey(
+        Patient, on_delete=models.CASCADE, related_name='name_keys')
+    field = models.CharField(max_length=1, choices=FIELD_CHOICES)
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    key = models.CharField(max_length=100)
+
+    def __str__(self):
+        return "%s (%s %s of %s)" % (
+            self.key, self.get_kind_display(), self.get_field_display(),
+            self.patient_id)
@@ -0,0 +1,62 @@
+"""Per-process memos of rarely changing tables, kept coherent across
+processes.
+
+Each process keeps its own copy of the memoized values, so they're tagged
+with a version token kept in the shared cache. invalidate() replaces the
+token, and every process then reloads on its next read. A missing token
+(evicted, or the cache unreachable) means no memo can be known to be
+current, so the values are reloaded until a token is in place again.
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class VersionedProcessCache:
+    """Values memoized per process by key, each loaded with load(key) when
+    this process has no copy of it under the current version."""
+
+    def __init__(self, version_key, load):
+        self.version_key = version_key
+        self.load = load
+        self._version = None
+        self._values = {}
+
+    def current_version(self):
+        """The shared version token, starting a new one if there is none.
+        None if the shared cache can't hold one."""
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid.uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def get(self, key=None):
+        version = self.current_version()
+        if version is None:
+            return self.load(key)
+
+        if version != self._version:
+            self._values = {}
+            self._version = version
+        if key not in self._values:
+            self._values[key] = self.load(key)
+        return self._values[key]
+
+    def forget(self):
+        """Drop this process's memo, leaving other processes' alone."""
+        self._version = None
+        self._values = {}
+
+    def _bump(self):
+        self.forget()
+        cache.set(self.version_key, uuid.uuid4().hex, None)
+
+    def invalidate(self):
+        """Make every process reload, now and again once the current
+        transaction commits. Otherwise, another process could reload the
+        old values before the commit and keep serving them, under the new
+        version, until the next change."""
+        self._bump()
+        transaction.on_commit(self._bump)
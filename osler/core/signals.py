@@ -0,0 +1,60 @@
+"""Signal handlers that keep core.PatientSummary, core.PatientNameKey, and
+the encounter status cache in step with the models they are derived from."""
+from django.apps import apps
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, post_migrate
+
+from osler.core.models import (
+    Patient, Encounter, EncounterStatus, PatientSummary, PatientNameKey,
+    invalidate_encounter_status_cache)
+
+
+def refresh_patient_summary(sender, instance, **kwargs):
+    """Rebuild the PatientSummary of the patient that instance belongs to.
+    """
+    patient_pk = instance.pk if sender is Patient else instance.patient_id
+
+    # on delete, the patient may be going away too
+    if Patient.objects.filter(pk=patient_pk).exists():
+        PatientSummary.objects.refresh(patient_pk)
+
+
+def summarized_models():
+    """The models whose rows feed into PatientSummary."""
+
+    sources = [Patient, Encounter, apps.get_model('workup', 'Workup')]
+    sources.extend(apps.get_model(app, model)
+                   for app, model in settings.OSLER_TODO_LIST_MANAGERS)
+    return sources
+
+
+for model in summarized_models():
+    post_save.connect(refresh_patient_summary, sender=model,
+                      dispatch_uid='patient_summary_save_%s' % model.__name__)
+    if model is not Patient:
+        post_delete.connect(
+            refresh_patient_summary, sender=model,
+            dispatch_uid='patient_summary_delete_%s' % model.__name__)
+
+
+def rebuild_patient_name_keys(sender, instance, **kwargs):
+    """Reindex the name of a patient that was just saved."""
+    PatientNameKey.objects.rebuild(instance)
+
+
+post_save.connect(rebuild_patient_name_keys, sender=Patient,
+                  dispatch_uid='patient_name_keys_save')
+
+
+def encounter_statuses_changed(sender, **kwargs):
+    invalidate_encounter_status_cache()
+
+
+post_save.connect(encounter_statuses_changed, sender=EncounterStatus,
+                  dispatch_uid='encounter_status_cache_save')
+post_delete.connect(encounter_statuses_changed, sender=EncounterStatus,
+                    dispatch_uid='encounter_status_cache_delete')
+# flush (e.g. between TransactionTestCases) empties the table without
+# deleting rows one by one, but is followed by post_migrate
+post_migrate.connect(encounter_statuses_changed,
+                     dispatch_uid='encounter_status_cache_migrate')
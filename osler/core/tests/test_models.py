@@ -0,0 +1,303 @@
+import datetime
+import os
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Max
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+
+from osler.core import models
+from osler.core.tests import factories
+from osler.core.tests.test_views import build_user, log_in_user
+from osler.users.tests import factories as user_factories
+from osler.vaccine.models import VaccineActionItem
+from osler.vaccine.tests.factories import VaccineSeriesFactory
+from osler.workup.tests.factories import WorkupFactory
+
+
+class PatientSummaryTest(TestCase):
+
+    def setUp(self):
+        self.user = build_user([user_factories.AttendingGroupFactory])
+        log_in_user(self.client, self.user)
+        self.pt = factories.PatientFactory()
+
+    def summary(self):
+        return models.PatientSummary.objects.get(patient=self.pt)
+
+    def make_ai(self, due_date, **kwargs):
+        return factories.ActionItemFactory(
+            due_date=due_date, author=self.user,
+            author_type=self.user.groups.first(), patient=self.pt, **kwargs)
+
+    def test_created_with_patient(self):
+        summary = self.summary()
+        assert summary.latest_workup is None
+        assert not summary.is_attested
+        assert summary.status is None
+        assert summary.actionitem_status() == "no pending actions"
+        assert summary.intake_date == self.pt.history.last().history_date
+
+    def test_tracks_action_items(self):
+        yesterday = now().date() - datetime.timedelta(days=1)
+        tomorrow = now().date() + datetime.timedelta(days=1)
+
+        ai = self.make_ai(tomorrow)
+        assert self.summary().actionitem_status() == \
+            self.pt.actionitem_status()
+        assert self.summary().next_due_date == tomorrow
+
+        self.make_ai(yesterday)
+        assert self.summary().next_due_date == yesterday
+        assert self.summary().actionitem_status() == \
+            self.pt.actionitem_status()
+
+        for completable in models.ActionItem.objects.filter(patient=self.pt):
+            completable.mark_done(self.user)
+            completable.save()
+        assert self.summary().actionitem_status() == "all actions complete"
+
+        ai.clear_done()
+        ai.save()
+        assert self.summary().next_due_date == tomorrow
+
+        models.ActionItem.objects.filter(patient=self.pt).delete()
+        assert self.summary().actionitem_status() == "no pending actions"
+
+    def test_tracks_workups_and_encounters(self):
+        encounter = factories.EncounterFactory(patient=self.pt)
+        assert self.summary().status == encounter.status
+
+        wu = WorkupFactory(
+            patient=self.pt, encounter=encounter, author=self.user,
+            author_type=self.user.groups.first())
+        assert self.summary().latest_workup == wu
+        assert not self.summary().is_attested
+
+        wu.sign(self.user, self.user.groups.first())
+        wu.save()
+        assert self.summary().is_attested
+
+        newer_wu = WorkupFactory(
+            patient=self.pt, author=self.user,
+            author_type=self.user.groups.first(),
+            encounter=factories.EncounterFactory(
+                patient=self.pt,
+                clinic_day=now().date() + datetime.timedelta(days=1)))
+        assert self.summary().latest_workup == newer_wu
+        assert not self.summary().is_attested
+
+    def test_last_seen_by_clinic_day(self):
+        """with_last_seen() picks the same workup as latest_workup(): the
+        one of the latest clinic day, not the last one written"""
+        for days in [1, -1]:
+            WorkupFactory(
+                patient=self.pt, author=self.user,
+                author_type=self.user.groups.first(),
+                encounter=factories.EncounterFactory(
+                    patient=self.pt,
+                    clinic_day=now().date() + datetime.timedelta(days=days)))
+
+        latest = self.pt.latest_workup()
+        assert latest.encounter.clinic_day > now().date()
+        annotated = models.Patient.objects.with_last_seen().get(pk=self.pt.pk)
+        assert annotated.last_seen() == latest.written_datetime
+        assert self.pt.last_seen() == latest.written_datetime
+
+    def test_refresh_missing(self):
+        models.PatientSummary.objects.all().delete()
+
+        # the list doesn't build missing summaries itself
+        response = self.client.get(reverse('core:all-patients'))
+        assert response.status_code == 200
+        assert not models.PatientSummary.objects.exists()
+
+        call_command('rebuild_patient_summaries', '--missing',
+                     stdout=open(os.devnull, 'w'))
+        assert models.PatientSummary.objects.filter(patient=self.pt).exists()
+
+    def add_seen_patients(self, n):
+        for i in range(n):
+            pt = factories.PatientFactory()
+            WorkupFactory(patient=pt, author=self.user,
+                          author_type=self.user.groups.first(),
+                          encounter=factories.EncounterFactory(patient=pt))
+
+    def count_all_patients_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('core:all-patients'))
+        assert response.status_code == 200
+        return len(queries), response
+
+    def test_all_patients_query_count(self):
+        self.add_seen_patients(2)
+        n_queries, response = self.count_all_patients_queries()
+        self.assertContains(response, 'Unattested', count=2)
+
+        # the list is rendered from a constant number of queries, no
+        # matter how many patients there are
+        self.add_seen_patients(5)
+        assert self.count_all_patients_queries()[0] == n_queries
+
+
+class ActionItemStatusAnnotationTest(TestCase):
+
+    def setUp(self):
+        self.user = build_user()
+        self.pt = factories.PatientFactory()
+
+    def annotated(self, pt=None):
+        return models.Patient.objects.with_actionitem_status() \
+            .get(pk=(pt or self.pt).pk)
+
+    def assert_matches_python(self, pt=None):
+        pt = pt or self.pt
+        annotated = self.annotated(pt)
+        python_status = models.Patient.objects.get(pk=pt.pk) \
+            .actionitem_status()
+        with self.assertNumQueries(0):
+            assert annotated.actionitem_status() == python_status
+
+    def test_no_completables(self):
+        pt = self.annotated()
+        assert (pt.ai_overdue, pt.ai_pending, pt.ai_done) == (0, 0, 0)
+        assert pt.ai_next_due_date is None
+        self.assert_matches_python()
+
+    def test_across_completable_types(self):
+        yesterday = now().date() - datetime.timedelta(days=1)
+        tomorrow = now().date() + datetime.timedelta(days=1)
+        next_week = now().date() + datetime.timedelta(days=7)
+
+        ai_kwargs = dict(author=self.user,
+                         author_type=self.user.groups.first(),
+                         patient=self.pt)
+
+        factories.ActionItemFactory(due_date=next_week, **ai_kwargs)
+        factories.ActionItemFactory(
+            due_date=yesterday, completion_date=now(),
+            completion_author=self.user, **ai_kwargs)
+        self.assert_matches_python()
+
+        series = VaccineSeriesFactory(patient=self.pt, **{
+            k: v for k, v in ai_kwargs.items() if k != 'patient'})
+        VaccineActionItem.objects.create(
+            vaccine=series, due_date=tomorrow,
+            instruction=factories.ActionInstructionFactory(),
+            comments="", **ai_kwargs)
+
+        pt = self.annotated()
+        assert (pt.ai_overdue, pt.ai_pending, pt.ai_done) == (0, 2, 1)
+        assert pt.ai_next_due_date == tomorrow
+        assert pt.ai_next_due_name == "Vaccine"
+        self.assert_matches_python()
+
+        other_pt = factories.PatientFactory()
+        factories.ActionItemFactory(
+            due_date=yesterday, author=self.user,
+            author_type=self.user.groups.first(), patient=other_pt)
+
+        pt = self.annotated(other_pt)
+        assert (pt.ai_overdue, pt.ai_pending, pt.ai_done) == (1, 0, 0)
+        assert pt.ai_next_due_date == yesterday
+        self.assert_matches_python(other_pt)
+
+
+class EncounterStatusTest(TestCase):
+
+    def test_default_statuses_cached(self):
+        # the first call creates the status, which resets the cache
+        models.default_active_status()
+        active = models.default_active_status()
+        with self.assertNumQueries(0):
+            self.assertEqual(models.default_active_status(), active)
+
+        # changing a status forgets the cached ones
+        active.is_active = False
+        active.save()
+        self.assertFalse(models.default_active_status().is_active)
+
+    def test_with_status(self):
+        old, new = factories.EncounterStatusFactory.create_batch(2)
+        pt = factories.PatientFactory()
+        factories.EncounterFactory(
+            patient=pt, status=old,
+            clinic_day=now().date() - datetime.timedelta(days=3))
+        latest = factories.EncounterFactory(patient=pt, status=new)
+        no_encounters = factories.PatientFactory()
+
+        patients = models.Patient.objects.with_status().in_bulk()
+        self.assertEqual(patients[pt.pk].latest_encounter_id, latest.pk)
+
+        inactive = models.default_inactive_status()
+        models.encounter_status(new.name)
+        with self.assertNumQueries(0):
+            self.assertEqual(patients[pt.pk].get_status(), new)
+            self.assertEqual(patients[no_encounters.pk].get_status(),
+                             inactive)
+        self.assertEqual(pt.get_status(), new)
+
+
+class EncounterBulkTest(TestCase):
+
+    def setUp(self):
+        self.today = now().date()
+        self.active = models.default_active_status()
+        self.inactive = models.default_inactive_status()
+
+    def test_close_out(self):
+        encounters = factories.EncounterFactory.create_batch(
+            3, status=self.active)
+        earlier = factories.EncounterFactory(
+            status=self.active,
+            clinic_day=self.today - datetime.timedelta(days=7))
+
+        n_closed = models.Encounter.objects \
+            .filter(clinic_day=self.today).close_out()
+
+        self.assertEqual(n_closed, 3)
+        for encounter in encounters:
+            encounter.refresh_from_db()
+            self.assertEqual(encounter.status, self.inactive)
+            self.assertEqual(models.PatientSummary.objects.get(
+                patient=encounter.patient).status, self.inactive)
+        earlier.refresh_from_db()
+        self.assertEqual(earlier.status, self.active)
+
+    def test_check_in(self):
+        new, inactive, active = factories.PatientFactory.create_batch(3)
+        closed = factories.EncounterFactory(
+            patient=inactive, status=self.inactive)
+        factories.EncounterFactory(patient=active, status=self.active)
+
+        with self.assertNumQueries(7):
+            n_created, n_activated = models.Encounter.objects.check_in(
+                [new, inactive.pk, active], self.today)
+
+        self.assertEqual((n_created, n_activated), (1, 1))
+        for patient in [new, inactive, active]:
+            self.assertEqual(patient.get_status(), self.active)
+            self.assertEqual(models.PatientSummary.objects.get(
+                patient=patient).status, self.active)
+        closed.refresh_from_db()
+        self.assertEqual(closed.status, self.active)
+
+        # new encounters go to the end of the active patients list
+        self.assertEqual(
+            models.Encounter.objects.get(patient=new).order,
+            models.Encounter.objects.aggregate(
+                Max('order'))['order__max'])
+
+    def test_commands(self):
+        patients = factories.PatientFactory.create_batch(2)
+        call_command('check_in_patients', *[str(p.pk) for p in patients],
+                     stdout=open(os.devnull, 'w'))
+        self.assertEqual(models.Encounter.objects.filter(
+            clinic_day=self.today, status=self.active).count(), 2)
+
+        call_command('close_clinic_day', stdout=open(os.devnull, 'w'))
+        self.assertFalse(models.Encounter.objects.filter(
+            status__is_active=True).exists())
@@ -1,83 +1,16 @@
 import datetime
+from unittest import mock
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
 from osler.core import utils
 from osler.core import models
+from osler.core.process_cache import VersionedProcessCache
 
 from osler.core.tests import factories
 
 
-class AllVariationsTests(TestCase):
-    """all_variations is a function that is used to help search for all
-    variations of a string that have either added, removed, or changed
-    1 letter. Function returns a list of all variations of the input string.
-    """
-
-    def test_empty_string(self):
-        """empty string should return empty list"""
-        name = ''
-        return_val = utils.all_variations(name)
-        assert return_val == []
-
-    def test_none(self):
-        """input = None should return empty list"""
-        name = None
-        return_val = utils.all_variations(name)
-        assert return_val == []
-
-    def test_singleton_string(self):
-        """string of length 1 should return a list consisting of just
-        itself"""
-        name = 'b'
-        return_val = utils.all_variations(name)
-        assert return_val == [name]
-
-    def test_first_letter_is_constant(self):
-        """Every value created should start with the first letter of the
-         search input (You are less likely to mess up the first letter
-         and not realize it"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        for val in return_val:
-            assert val[0] == name[0]
-
-    def test_last_letter_changed(self):
-        """Last letter can be deleted or changed"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        assert 'bek' in return_val
-        assert 'be' in return_val
-
-    def test_add_letter(self):
-        """Can add letter and still get proper values"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        assert 'bean' in return_val
-        assert 'baen' in return_val
-
-    def test_remove_letter(self):
-        """letter can be removed"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        assert 'bn' in return_val
-
-    def test_initial_name_present(self):
-        """initial name should be returned"""
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        assert name in return_val
-
-    def test_number_vals_returned(self):
-        """for each letter (other than the first letter) there should be
-        26 variations for changes in a letter, 26 for adding a letter,
-        and 1 for removing the letter, and also add the original input
-        giving a total of (len(input) - 1) * 53 + 1 changes """
-        name = 'ben'
-        return_val = utils.all_variations(name)
-        assert len(return_val), (len(name) - 1) * 53 + 1
-
-
 def create_pts():
     pt_prototype = {
         'phone': '+49 178 236 5288',
@@ -243,3 +176,103 @@ class return_duplicatesTests(TestCase):
         assert models.Patient.objects.count() == 5
         result = utils.return_duplicates("art", "meller")
         assert len(result) == 4
+
+    def test_ranked_best_match_first(self):
+        """An exact match should come before near matches."""
+        create_pts()
+        result = utils.return_duplicates("arthur", "meller")
+        self.assertEqual(result[0].first_name, "Arthur")
+
+    def test_ignores_case_and_punctuation(self):
+        """Capitalization, accents, and hyphens don't matter"""
+        create_pts()
+        result = utils.return_duplicates("BENJAMÍN", "Ka-tz")
+        self.assertEqual(len(result), 1)
+
+    def test_sounds_alike(self):
+        """Names with the same phonetic code are matched even if they are
+        more than one letter apart."""
+        create_pts()
+        result = utils.return_duplicates("benjamin", "kutse")
+        self.assertEqual(len(result), 1)
+
+    def test_rename_updates_keys(self):
+        """Matching uses the patient's current name, not an old one."""
+        create_pts()
+        pt = models.Patient.objects.get(first_name="Benjamin")
+        pt.last_name = "Smith"
+        pt.save()
+
+        self.assertEqual(len(utils.return_duplicates("benjamin", "katz")), 0)
+        self.assertEqual(
+            list(utils.return_duplicates("benjamin", "smyth")), [pt])
+
+    def test_query_count_independent_of_matches(self):
+        """Lookups take one query no matter how many patients match."""
+        create_pts()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(utils.return_duplicates("art", "meller")), 4)
+
+    def test_limit(self):
+        """Only the best matches are returned, ranked in the database."""
+        create_pts()
+        with override_settings(OSLER_DUPLICATE_PATIENT_LIMIT=2):
+            result = utils.return_duplicates("arthur", "meller")
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0].first_name, "Arthur")
+        assert result[0].name_match_rank > result[1].name_match_rank
+
+
+class NameKeyTests(TestCase):
+
+    def test_normalize_name(self):
+        assert utils.normalize_name("  O'Brien-Núñez ") == 'obriennunez'
+        assert utils.normalize_name(None) == ''
+
+    def test_soundex(self):
+        assert utils.soundex('robert') == 'r163'
+        assert utils.soundex('rupert') == 'r163'
+        assert utils.soundex('ashcraft') == 'a261'
+        assert utils.soundex('tymczak') == 't522'
+        assert utils.soundex('pfister') == 'p236'
+        assert utils.soundex('') == ''
+
+    def test_deletion_keys_keep_first_letter(self):
+        assert utils.deletion_keys('ben') == {'bn', 'be'}
+        assert utils.deletion_keys('b') == set()
+
+
+class VersionedProcessCacheTests(TestCase):
+
+    def setUp(self):
+        self.loads = []
+        self.memo = VersionedProcessCache(
+            'osler.core.tests.process_cache_version', self.load)
+        self.addCleanup(cache.delete, self.memo.version_key)
+
+    def load(self, key):
+        self.loads.append(key)
+        return len(self.loads)
+
+    def test_memoized_until_invalidated(self):
+        assert self.memo.get('a') == self.memo.get('a') == 1
+        assert self.memo.get('b') == 2
+
+        self.memo.invalidate()
+        assert self.memo.get('a') == 3
+
+    def test_evicted_version_is_restored(self):
+        self.memo.get('a')
+        cache.delete(self.memo.version_key)
+
+        assert self.memo.get('a') == 2
+        assert cache.get(self.memo.version_key) is not None
+        assert self.memo.get('a') == 2
+
+    def test_unreachable_cache_is_not_served(self):
+        """With no version to check a memo against, none is used"""
+        self.memo.get('a')
+        with mock.patch('osler.core.process_cache.cache') as unreachable:
+            unreachable.get.return_value = None
+            assert self.memo.get('a') == 2
+            assert self.memo.get('a') == 3
@@ -2,7 +2,9 @@ import datetime
 import json
 import os
 
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.timezone import now
 from django.core import mail
@@ -10,7 +12,7 @@ from django.core.management import call_command
 from django.contrib.auth import get_user_model
 from django.conf import settings
 
-from osler.core import models
+from osler.core import models, utils
 from osler.followup.models import ContactResult
 from osler.referral.models import Referral, FollowupRequest, PatientContact
 from osler.referral.forms import PatientContactForm
@@ -496,3 +498,243 @@ class PatientStatusTest(TestCase):
         assert models.Encounter.objects.get(patient=pt).status.is_active
         assert len(models.Encounter.objects.filter(patient=pt)) == 1
         
+
+
+class PatientSearchTest(TestCase):
+
+    def setUp(self):
+        self.coordinator = build_user([user_factories.CaseManagerGroupFactory])
+        log_in_user(self.client, self.coordinator)
+
+        self.patients = [
+            factories.PatientFactory(first_name=first, last_name=last)
+            for first, last in [('Juggie', 'Brodeltein'),
+                                ('Jigie', 'Brozeltein'),
+                                ('Asdf', 'Lkjh'),
+                                ('Artur', 'Meller'),
+                                ('Benjamin', 'Katz')]]
+        self.patients[2].case_managers.add(self.coordinator)
+
+    def search(self, **params):
+        response = self.client.get(reverse('core:patient-search'), params)
+        assert response.status_code == 200
+        return response
+
+    def all_pages(self, **params):
+        """Follow the next page links, returning all patients listed."""
+        listed = []
+        response = self.search(**params)
+        listed.extend(response.context['object_list'])
+        while response.context['next_cursor']:
+            response = self.search(after=response.context['next_cursor'],
+                                   **params)
+            listed.extend(response.context['object_list'])
+        return listed
+
+    def test_name_search(self):
+        response = self.search(q='bro')
+        assert set(response.context['object_list']) == \
+            set(self.patients[:2])
+
+        response = self.search(q='jig bro')
+        assert list(response.context['object_list']) == [self.patients[1]]
+
+        response = self.search(q='nobody')
+        assert list(response.context['object_list']) == []
+
+    def test_case_manager_search(self):
+        self.coordinator.last_name = 'Zyxwvut'
+        self.coordinator.save()
+
+        response = self.search(q='zyx')
+        assert list(response.context['object_list']) == [self.patients[2]]
+
+    @override_settings(OSLER_PATIENTS_PER_PAGE=2)
+    def test_keyset_pagination(self):
+        by_name = sorted(self.patients,
+                         key=lambda p: (p.last_name, p.first_name))
+        assert self.all_pages(sort='name') == by_name
+
+        # give patients action items due on different days
+        for i, pt in enumerate(reversed(self.patients[1:])):
+            factories.ActionItemFactory(
+                due_date=now().date() + datetime.timedelta(days=i),
+                author=self.coordinator,
+                author_type=self.coordinator.groups.first(),
+                patient=pt)
+        # patients without pending action items go last
+        assert self.all_pages(sort='next_due') == \
+            list(reversed(self.patients[1:])) + [self.patients[0]]
+
+        # seen most recently first, by latest workup else intake, and
+        # newest first among patients seen the same day
+        from osler.workup.tests.factories import WorkupFactory
+        for i, pt in enumerate(self.patients[:3]):
+            WorkupFactory(
+                patient=pt, author=self.coordinator,
+                author_type=self.coordinator.groups.first(),
+                encounter=factories.EncounterFactory(
+                    patient=pt,
+                    clinic_day=now().date() - datetime.timedelta(days=i + 1)))
+        assert self.all_pages(sort='last_seen') == \
+            [self.patients[4], self.patients[3]] + self.patients[:3]
+
+    @override_settings(OSLER_PATIENTS_PER_PAGE=2)
+    def test_bad_parameters(self):
+        response = self.search(sort='not-a-sort', after='garbage')
+        assert response.context['sort'] == 'name'
+        assert len(response.context['object_list']) == 2
+
+
+class PatientDetailQueryTest(TestCase):
+    """The patient chart should be rendered from a fixed number of queries,
+    no matter how much history the patient has."""
+
+    # includes session, auth, permission, and audit log queries
+    QUERY_BUDGET = 30
+
+    def setUp(self):
+        self.user = build_user([user_factories.CaseManagerGroupFactory])
+        log_in_user(self.client, self.user)
+        self.pt = factories.PatientFactory(
+            case_managers=[self.user],
+            ethnicities=[factories.EthnicityFactory()])
+
+    def add_chart_entries(self):
+        """Add one of everything that shows up on the patient chart."""
+        from osler.workup.tests.factories import WorkupFactory
+        from osler.workup.models import BasicNote, AttestableBasicNote
+        from osler.vaccine.tests.factories import (
+            VaccineDoseFactory, VaccineDoseTypeFactory, VaccineSeriesFactory)
+        from osler.vaccine.models import VaccineActionItem, VaccineFollowup
+        from osler.inventory.tests.factories import DispenseHistoryFactory
+        from osler.followup.models import ActionItemFollowup
+        from osler.appointment.models import Appointment
+
+        note = {'author': self.user, 'author_type': self.user.groups.first(),
+                'patient': self.pt}
+        encounter = factories.EncounterFactory(patient=self.pt)
+        contact = {'contact_method': factories.ContactMethodFactory(),
+                   'contact_resolution': ContactResult.objects.get_or_create(
+                       name='Reached', patient_reached=True)[0]}
+
+        WorkupFactory(encounter=encounter, is_pending=False, **note)
+        WorkupFactory(encounter=encounter, is_pending=True, **note)
+        factories.DocumentFactory(**note)
+        BasicNote.objects.create(
+            title='note', text='text', encounter=encounter, **note)
+        AttestableBasicNote.objects.create(
+            title='note', text='text', encounter=encounter, **note)
+        DispenseHistoryFactory(encounter=encounter, **note)
+
+        series = VaccineSeriesFactory(**note)
+        dose = VaccineDoseFactory(
+            series=series, encounter=encounter,
+            which_dose=VaccineDoseTypeFactory(
+                kind=series.kind, time_from_first=datetime.timedelta(0)),
+            **note)
+        vai = VaccineActionItem.objects.create(
+            vaccine=dose.series, instruction=factories.ActionInstructionFactory(),
+            due_date=now().date(), **note)
+        VaccineFollowup.objects.create(
+            action_item=vai, subsq_dose=False, **contact, **note)
+
+        ai = factories.ActionItemFactory(
+            due_date=now().date() + datetime.timedelta(days=2), **note)
+        ActionItemFollowup.objects.create(action_item=ai, **contact, **note)
+
+        referral = Referral.objects.create(
+            kind=models.ReferralType.objects.get_or_create(
+                name='FQHC', is_fqhc=True)[0], **note)
+        fu_request = FollowupRequest.objects.create(
+            referral=referral, contact_instructions='call',
+            due_date=now().date(), **note)
+        PatientContact.objects.create(
+            followup_request=fu_request, referral=referral,
+            contact_method=contact['contact_method'],
+            contact_status=contact['contact_resolution'], **note)
+
+        for days in [-7, 7]:
+            Appointment.objects.create(
+                clindate=now().date() + datetime.timedelta(days=days),
+                clintime=datetime.time(9, 0), comment='', **note)
+
+    def count_detail_queries(self):
+        url = reverse('core:patient-detail', args=(self.pt.id,))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        assert response.status_code == 200
+        return len(queries)
+
+    def test_query_count_independent_of_history(self):
+        self.add_chart_entries()
+        self.count_detail_queries()  # warm up process-level caches
+        n_queries = self.count_detail_queries()
+        self.assertLessEqual(n_queries, self.QUERY_BUDGET)
+
+        for i in range(3):
+            self.add_chart_entries()
+
+        self.assertEqual(self.count_detail_queries(), n_queries)
+
+
+class PatientTimelineTest(TestCase):
+
+    def setUp(self):
+        from osler.workup.tests.factories import WorkupFactory
+        from osler.inventory.tests.factories import DispenseHistoryFactory
+
+        self.user = build_user()
+        log_in_user(self.client, self.user)
+        self.pt = factories.PatientFactory()
+
+        note = {'author': self.user, 'author_type': self.user.groups.first(),
+                'patient': self.pt}
+        encounter = factories.EncounterFactory(patient=self.pt)
+
+        start = now() - datetime.timedelta(days=30)
+        notes = []
+        for i in range(5):
+            notes.append(WorkupFactory(encounter=encounter, **note))
+        for i in range(4):
+            notes.append(factories.DocumentFactory(**note))
+        for i in range(3):
+            notes.append(DispenseHistoryFactory(encounter=encounter, **note))
+
+        # interleave the types, with some notes written at the same instant
+        for i, n in enumerate(notes):
+            type(n).objects.filter(pk=n.pk).update(
+                written_datetime=start + datetime.timedelta(days=i % 7))
+
+        self.url = reverse('api:patient-timeline', args=(self.pt.pk,))
+
+    def expected_timeline(self):
+        notes = sorted(self.pt.notes(), key=models.Patient.timeline_key,
+                       reverse=True)
+        return [(n._meta.model_name, n.pk) for n in notes]
+
+    def test_pages_cover_timeline_in_order(self):
+        url = self.url + '?page_size=5'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            assert response.status_code == 200
+            assert len(response.data['results']) <= 5
+            seen.extend((n['type'], n['pk']) for n in response.data['results'])
+            url = response.data['next']
+
+        assert seen == self.expected_timeline()
+        assert len(seen) == 12
+
+    def test_single_page(self):
+        response = self.client.get(self.url)
+        assert response.data['next'] is None
+        assert len(response.data['results']) == 12
+        assert response.data['results'][0]['summary']
+
+    def test_invalid_cursor(self):
+        """A malformed cursor is the client's error"""
+        for cursor in ['garbage', utils.encode_cursor(['not a date', 'x', 1])]:
+            response = self.client.get(self.url, {'cursor': cursor})
+            assert response.status_code == 400
+            assert response.json() == {'cursor': 'Invalid cursor'}
@@ -14,6 +14,10 @@ unwrapped_urlpatterns = [
         r'^all/$',
         views.all_patients,
         name="all-patients"),
+    re_path(
+        r'^search/$',
+        views.patient_search,
+        name="patient-search"),
     re_path(
         r'^preintake-select/$',
         views.PreIntakeSelect.as_view(),
@@ -1,8 +1,14 @@
 import os
 import uuid
+import json
+import base64
+import functools
+import operator
 import string
+import unicodedata
 
-from django.db.models import Q
+from django.db.models import (Case, F, IntegerField, Max, OuterRef, Q,
+                              Subquery, Value, When)
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 
@@ -34,55 +40,159 @@ def make_filepath(instance, filename):
     return path
 
 
-def all_variations(name):
-    """all_variations is a function that is used to help search for all
-    variations of a string that have either added, removed, or changed
-    1 letter. Function returns a list of all variations of the input string.
+def normalize_name(name):
+    """Reduce a name to the form it is indexed under: lowercase ASCII
+    letters only, so that accents, capitalization, hyphens, apostrophes,
+    and spaces don't defeat duplicate detection."""
+    if not name:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ''.join(c for c in decomposed.lower()
+                   if c in string.ascii_lowercase)
+
+
+SOUNDEX_CODES = dict(
+    [(c, '1') for c in 'bfpv'] + [(c, '2') for c in 'cgjkqsxz'] +
+    [(c, '3') for c in 'dt'] + [('l', '4')] + [(c, '5') for c in 'mn'] +
+    [('r', '6')])
+
+
+def soundex(name):
+    """American Soundex code of an already-normalized name (e.g. 'r163'
+    for 'robert' and 'rupert'), or '' for the empty string."""
+    if not name:
+        return ''
+
+    code = [name[0]]
+    previous = SOUNDEX_CODES.get(name[0])
+    for c in name[1:]:
+        digit = SOUNDEX_CODES.get(c)
+        if digit is not None and digit != previous:
+            code.append(digit)
+        # h and w don't separate letters with the same code; vowels do
+        if c not in 'hw':
+            previous = digit
+
+    return (''.join(code) + '000')[:4]
+
+
+def deletion_keys(name):
+    """The deletion neighbourhood of an already-normalized name: every
+    string made by removing one letter other than the first.
+
+    Two names that differ by a single added, removed, or changed letter
+    (other than the first) always share a key from their name plus its
+    deletion neighbourhood, so a near match becomes an indexed equality
+    lookup instead of a scan over all spelling variations.
     """
-    all_vars = []
-    if name is None or len(name) == 0:
-        return all_vars
-    if len(name) == 1:
-        all_vars.append(name)
-        return all_vars
-    else:
-        # try all variations of switching letters, other than first letter
-        for i in range(1, len(name)):
-            # remove letter
-            all_vars.append(name[:i] + name[i + 1:])
-            # change letter and add letter
-            for j in string.ascii_lowercase:
-                all_vars.append(name[:i] + j + name[i + 1:])
-                all_vars.append(name[:i] + j + name[i:])
-
-        all_vars.append(name)
-        return all_vars
+    return set(name[:i] + name[i + 1:] for i in range(1, len(name)))
+
+
+def name_keys(first_name, last_name):
+    """All (field, kind, key) triples under which a patient with the
+    given name is indexed in PatientNameKey."""
+
+    keys = set()
+    for field, name in [(models.PatientNameKey.FIRST, first_name),
+                        (models.PatientNameKey.LAST, last_name)]:
+        name = normalize_name(name)
+        if not name:
+            continue
+        keys.add((field, models.PatientNameKey.EXACT, name))
+        keys.add((field, models.PatientNameKey.PHONETIC, soundex(name)))
+        keys.update((field, models.PatientNameKey.DELETION, key)
+                    for key in deletion_keys(name))
+
+    return keys
+
+
+# Scores for how closely each half of a name matches. A candidate's rank
+# is the sum of the scores of its first and last name.
+NAME_MATCH_SCORES = {
+    'exact': 3,
+    'near': 2,
+    'prefix': 2,
+    'phonetic': 1,
+}
+
+
+def _name_key_lookup(field, name, allow_prefix=False):
+    """The Q selecting the PatientNameKeys of field that match name, and an
+    expression for a selected key's score in NAME_MATCH_SCORES (0 for keys
+    of the other field).
+
+    Each arm of the Q is an equality (or prefix) match on the (field,
+    kind, key) index, so the database only reads the keys that match.
+    """
+    name = normalize_name(name)
+    near_keys = deletion_keys(name) | {name}
+    code = soundex(name)
+
+    EXACT = models.PatientNameKey.EXACT
+    DELETION = models.PatientNameKey.DELETION
+    PHONETIC = models.PatientNameKey.PHONETIC
+
+    exact = Q(kind=EXACT, key=name)
+    near = Q(kind__in=[EXACT, DELETION], key__in=near_keys)
+    prefix = Q(kind=EXACT, key__startswith=name)
+    phonetic = Q(kind=PHONETIC, key=code)
+
+    arms = [(exact, 'exact'), (near, 'near')]
+    if allow_prefix:
+        arms.append((prefix, 'prefix'))
+    arms.append((phonetic, 'phonetic'))
+
+    lookup = Q(field=field) & functools.reduce(
+        operator.or_, [arm for arm, _ in arms])
+    score = Case(
+        *[When(Q(field=field) & arm, then=Value(NAME_MATCH_SCORES[kind]))
+          for arm, kind in arms],
+        default=Value(0), output_field=IntegerField())
+    return lookup, score
 
 
 def return_duplicates(first_name_str, last_name_str):
     """search database for all variations of first and last name off by 1
     letter (except for first letter must be correct) and return matching
     results.  First name may also be abbreviated (to cover cases like
-    ben and benjamin)
+    ben and benjamin), and names that sound alike are also returned.
+
+    Candidates are found, scored, and ranked in the database from the
+    precomputed keys in PatientNameKey, and the best
+    OSLER_DUPLICATE_PATIENT_LIMIT are returned, best match first,
+    annotated with their name_match_rank.
     """
-    first_name_var = all_variations(first_name_str.capitalize())
-    last_name_var = all_variations(last_name_str.capitalize())
-    if len(first_name_var) == 0 or len(last_name_var) == 0:
+    if not normalize_name(first_name_str) or \
+            not normalize_name(last_name_str):
         return
 
-    return models.Patient.objects.filter(
-        (Q(first_name__in=first_name_var) |
-         Q(first_name__istartswith=first_name_str.capitalize())) &
-        Q(last_name__in=last_name_var))
+    first_lookup, first_score = _name_key_lookup(
+        models.PatientNameKey.FIRST, first_name_str, allow_prefix=True)
+    last_lookup, last_score = _name_key_lookup(
+        models.PatientNameKey.LAST, last_name_str)
+
+    # one row per patient, with the best score of each half of their name;
+    # both halves have to match
+    scored = models.PatientNameKey.objects \
+        .filter(first_lookup | last_lookup) \
+        .values('patient') \
+        .annotate(first_score=Max(first_score), last_score=Max(last_score)) \
+        .filter(first_score__gt=0, last_score__gt=0) \
+        .annotate(rank=F('first_score') + F('last_score')) \
+        .order_by()
+    best = scored.order_by('-rank', 'patient_id') \
+        [:settings.OSLER_DUPLICATE_PATIENT_LIMIT]
+
+    return models.Patient.objects \
+        .filter(pk__in=best.values('patient')) \
+        .annotate(name_match_rank=Subquery(
+            scored.filter(patient=OuterRef('pk')).values('rank'))) \
+        .order_by('-name_match_rank', 'last_name', 'first_name', 'pk')
 
 
 def get_clindates(encounters):
     '''For a qs of encounters, returns a list of unique clinic days'''
-    clindates = []
-    for encounter in encounters:
-        if encounter.clinic_day not in clindates:
-            clindates = clindates + [encounter.clinic_day]
-    return clindates
+    return list(dict.fromkeys(encounter.clinic_day for encounter in encounters))
 
 
 def get_names_from_url_query_dict(request):
@@ -104,3 +214,42 @@ def get_due_date_from_url_query_dict(request):
                if param in request.GET}
 
     return qs_dict
+
+
+def encode_cursor(values):
+    """Encode a list of (JSON-serializable) keyset values as an opaque,
+    URL-safe string for use as a pagination cursor."""
+
+    return base64.urlsafe_b64encode(
+        json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Returns None if the cursor is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+
+    return values if isinstance(values, list) else None
+
+
+def keyset_filter(ordering, values):
+    """Build a Q selecting the rows that come strictly after the row whose
+    ordering fields have the given values.
+
+    ordering is a list of field names as passed to order_by (i.e. a
+    leading '-' means descending), and must end in a unique field so
+    that the ordering is total.
+    """
+    after = None
+    equal_so_far = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = equal_so_far & Q(**{'%s__%s' % (name, lookup): value})
+        after = step if after is None else after | step
+        equal_so_far &= Q(**{name: value})
+
+    return after
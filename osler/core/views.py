@@ -1,6 +1,5 @@
 from builtins import zip
 import collections
-import datetime
 
 from django.conf import settings
 from django.apps import apps
@@ -10,7 +9,7 @@ from django.views.generic.edit import FormView, UpdateView
 from django.views.generic.list import ListView
 from django.urls import reverse
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models import Prefetch
+from django.db.models import F, Prefetch, Q
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.utils.timezone import now
 
@@ -171,7 +170,9 @@ class PreIntakeSelect(ListView):
             return []
         possible_duplicates = utils.return_duplicates(initial.get(
             'first_name', None), initial.get('last_name', None))
-        return possible_duplicates
+        if possible_duplicates is None:
+            return []
+        return possible_duplicates.with_status()
 
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
@@ -207,7 +208,7 @@ class PreIntake(FormView):
 
         querystr = '%s=%s&%s=%s' % ("first_name", first_name_str,
                                     "last_name", last_name_str)
-        if len(matching_patients) > 0:
+        if matching_patients is not None and matching_patients.exists():
             intake_url = "%s?%s" % (reverse("core:preintake-select"), querystr)
             return HttpResponseRedirect(intake_url)
 
@@ -305,9 +306,66 @@ def home_page(request):
     return HttpResponseRedirect(reverse(settings.OSLER_DEFAULT_DASHBOARD))
 
 
+def completable_accessor(model):
+    """The name of the reverse accessor from Patient to completable model
+    (e.g. 'actionitem_set')."""
+    return model._meta.get_field('patient').remote_field.get_accessor_name()
+
+
+def patient_detail_prefetches():
+    """Everything the patient chart displays, as a list of prefetches.
+
+    Each related set is loaded exactly once, with whatever it needs to be
+    displayed select_related, so that rendering the chart takes the same
+    number of queries no matter how long the patient's history is. The
+    template and Patient methods like notes() and actionitem_status()
+    then read from the prefetch cache via .all().
+    """
+    def notes(model, *related):
+        return model.objects.select_related('author', 'author_type', *related)
+
+    prefetches = [
+        'languages',
+        'ethnicities',
+        'case_managers',
+        Prefetch('workup_set', queryset=notes(workupmodels.Workup)),
+        Prefetch('basicnote_set', queryset=notes(workupmodels.BasicNote)),
+        Prefetch('attestablebasicnote_set',
+                 queryset=notes(workupmodels.AttestableBasicNote)),
+        Prefetch('document_set',
+                 queryset=notes(core_models.Document, 'document_type')),
+        Prefetch('actionitemfollowup_set',
+                 queryset=notes(apps.get_model('followup',
+                                               'ActionItemFollowup'))),
+        Prefetch('vaccinedose_set', queryset=notes(
+            apps.get_model('vaccine', 'VaccineDose'), 'which_dose__kind')),
+        Prefetch('vaccinefollowup_set', queryset=notes(VaccineFollowup)),
+        Prefetch('patientcontact_set', queryset=notes(
+            PatientContact, 'contact_status').prefetch_related(
+                'appointment_location')),
+        Prefetch('dispensehistory_set', queryset=notes(
+            apps.get_model('inventory', 'DispenseHistory'), 'drug__unit')),
+        Prefetch('appointment_set', queryset=Appointment.objects.order_by(
+            'clindate', 'clintime')),
+    ]
+
+    for app, model in settings.OSLER_TODO_LIST_MANAGERS:
+        ai = apps.get_model(app, model)
+        prefetches.append(Prefetch(
+            completable_accessor(ai),
+            queryset=ai.objects.select_related(*ai.DISPLAY_RELATED_FIELDS)
+                .order_by('completion_date')))
+
+    return prefetches
+
+
 def patient_detail(request, pk):
 
-    pt = get_object_or_404(core_models.Patient, pk=pk)
+    pt = get_object_or_404(
+        core_models.Patient.objects
+            .select_related('gender', 'demographics')
+            .prefetch_related(*patient_detail_prefetches()),
+        pk=pk)
 
     #   Special zipped list of action item types so they can be looped over.
     #   List 1: Labels for the panel objects of the action items
@@ -322,13 +380,19 @@ def patient_detail(request, pk):
 
     # Add action items for apps that are turned on in Osler's base settings
     # OSLER_TODO_LIST_MANAGERS contains app names like referral which contain
-    # tasks for clinical teams to carry out (e.g., followup with patient)
+    # tasks for clinical teams to carry out (e.g., followup with patient).
+    # These are the same partitions as CompletableManager's get_active,
+    # get_inactive, and get_completed, taken from the prefetched items.
+    today = now().date()
     for app, model in settings.OSLER_TODO_LIST_MANAGERS:
         ai = apps.get_model(app, model)
-
-        active_ais.extend(ai.objects.get_active(patient=pt))
-        inactive_ais.extend(ai.objects.get_inactive(patient=pt))
-        done_ais.extend(ai.objects.get_completed(patient=pt))
+        for item in getattr(pt, completable_accessor(ai)).all():
+            if item.completion_author_id is not None:
+                done_ais.append(item)
+            elif item.due_date <= today:
+                active_ais.append(item)
+            else:
+                inactive_ais.append(item)
 
     # Calculate the total number of action items for this patient,
     # This total includes all apps that that have associated
@@ -346,7 +410,7 @@ def patient_detail(request, pk):
     referrals = Referral.objects.filter(
         patient=pt,
         followuprequest__in=FollowupRequest.objects.all()
-    )
+    ).select_related('kind').prefetch_related('location')
 
     # Add FQHC referral status
     # Note it is possible for a patient to have been referred multiple times
@@ -357,39 +421,30 @@ def patient_detail(request, pk):
     referral_status_output = Referral.aggregate_referral_status(fqhc_referrals)
 
     # Pass referral follow up set to page
-    referral_followups = PatientContact.objects.filter(patient=pt)
+    referral_followups = pt.patientcontact_set.all()
     #Pass vaccine follow up set to page
-    vaccine_followups = VaccineFollowup.objects.filter(patient=pt)
-    total_followups = referral_followups.count() + len(pt.followup_set()) + vaccine_followups.count()
-
-    appointments = Appointment.objects \
-        .filter(patient=pt) \
-        .order_by('clindate', 'clintime')
-    # d = collections.OrderedDict()
-    # for a in appointments:
-    #     if a.clindate in d:
-    #         d[a.clindate].append(a)
-    #     else:
-    #         d[a.clindate] = [a]
-
-    future_date_appointments = appointments.filter(
-        clindate__gte=datetime.date.today()).order_by('clindate', 'clintime')
-    previous_date_appointments = appointments.filter(
-        clindate__lt=datetime.date.today()).order_by('-clindate', 'clintime')
+    vaccine_followups = pt.vaccinefollowup_set.all()
+    total_followups = (len(referral_followups) + len(pt.followup_set()) +
+                       len(vaccine_followups))
+
+    workups = pt.workup_set.all()
+    pending_workups = [wu for wu in workups if wu.is_pending]
+    completed_workups = [wu for wu in workups if not wu.is_pending]
+
+    appointments = pt.appointment_set.all()
+    future_date_appointments = [a for a in appointments
+                                if a.clindate >= today]
+    previous_date_appointments = sorted(
+        (a for a in appointments if a.clindate < today),
+        key=lambda a: a.clindate, reverse=True)
 
     future_apt = collections.OrderedDict()
     for a in future_date_appointments:
-        if a.clindate in future_apt:
-            future_apt[a.clindate].append(a)
-        else:
-            future_apt[a.clindate] = [a]
+        future_apt.setdefault(a.clindate, []).append(a)
 
     previous_apt = collections.OrderedDict()
     for a in previous_date_appointments:
-        if a.clindate in previous_apt:
-            previous_apt[a.clindate].append(a)
-        else:
-            previous_apt[a.clindate] = [a]
+        previous_apt.setdefault(a.clindate, []).append(a)
 
     zipped_apt_list = list(zip(
         ['collapse11', 'collapse12'],
@@ -403,6 +458,8 @@ def patient_detail(request, pk):
     can_activate = pt.group_can_activate(active_role)
     can_case_manage = group_has_perm(active_role, 'core.case_manage_Patient')
     can_export_pdf = group_has_perm(active_role, 'workup.export_pdf_Workup')
+    can_view_access_log = group_has_perm(active_role,
+                                         'audit.view_pageviewrecord')
 
     context = {
         'zipped_ai_list': zipped_ai_list,
@@ -413,11 +470,14 @@ def patient_detail(request, pk):
         'vaccine_followups': vaccine_followups,
         'total_followups': total_followups,
         'patient': pt,
+        'pending_workups': pending_workups,
+        'completed_workups': completed_workups,
         'appointments_by_date': future_apt,
         'zipped_apt_list': zipped_apt_list,
         'can_activate': can_activate,
         'can_case_manage': can_case_manage,
-        'can_export_pdf': can_export_pdf
+        'can_export_pdf': can_export_pdf,
+        'can_view_access_log': can_view_access_log
     }
 
     return render(request,
@@ -429,6 +489,9 @@ def all_patients(request, title='All Patients', active=False):
     """
     Query is written to minimize hits to the database; number of db hits can be
         see on the django debug toolbar.
+
+    Everything in the table except case managers comes from the patient's
+    PatientSummary, so the list renders from one joined query.
     """
     patient_list = core_models.Patient.objects.all()
     if active:
@@ -440,13 +503,9 @@ def all_patients(request, title='All Patients', active=False):
     
     patient_list = patient_list \
         .select_related('gender') \
-        .prefetch_related('case_managers') \
-        .prefetch_related('workup_set') \
-        .prefetch_related('actionitem_set')
-
-    # Don't know how to prefetch history
-    # https://stackoverflow.com/questions/45713517/use-prefetch-related-in-django-simple-history
-    # Source code is https://github.com/treyhunner/django-simple-history/blob/master/simple_history/models.py if we want to try to figure out
+        .select_related('summary__latest_workup__encounter') \
+        .select_related('summary__latest_workup__signer') \
+        .prefetch_related('case_managers')
 
     return render(request,
                   'core/all_patients.html',
@@ -456,6 +515,84 @@ def all_patients(request, title='All Patients', active=False):
                   })
     
 
+# Sort options for patient_search. Each maps to an ordering that ends in
+# 'pk' so that it's total, which keyset pagination requires.
+PATIENT_SEARCH_SORTS = collections.OrderedDict([
+    ('name', ('Name', ['last_name', 'first_name', 'pk'])),
+    ('last_seen', ('Last seen', ['-last_seen', '-pk'])),
+    ('next_due', ('Next AI due', ['next_due', 'pk'])),
+])
+
+
+def patient_search(request):
+    """Server-side filtered, sorted, and paginated list of all patients.
+
+    Filters by patient (and, if they're displayed, case manager) names,
+    using one prefix match per word typed. Pages are selected by keyset
+    (the sort values of the last row shown) rather than offset, so every
+    page costs the same no matter how many patients the clinic has.
+    """
+    query = request.GET.get('q', '').strip()
+    sort = request.GET.get('sort', 'name')
+    if sort not in PATIENT_SEARCH_SORTS:
+        sort = 'name'
+    ordering = PATIENT_SEARCH_SORTS[sort][1]
+
+    # sorted by the indexed sort keys of PatientSummary, so that a page is
+    # read off an index instead of sorting all patients. Patients entered
+    # before summaries existed have none until rebuild_patient_summaries
+    # --missing is run.
+    patient_list = core_models.Patient.objects \
+        .filter(summary__isnull=False) \
+        .annotate(last_seen=F('summary__last_seen'),
+                  next_due=F('summary__next_due'))
+
+    for word in query.split():
+        matches = (Q(first_name__istartswith=word) |
+                   Q(last_name__istartswith=word))
+        if settings.OSLER_DISPLAY_CASE_MANAGERS:
+            managed = core_models.Patient.case_managers.through.objects \
+                .filter(Q(user__first_name__istartswith=word) |
+                        Q(user__last_name__istartswith=word) |
+                        Q(user__name__istartswith=word) |
+                        Q(user__username__istartswith=word)) \
+                .values('patient')
+            matches |= Q(pk__in=managed)
+        patient_list = patient_list.filter(matches)
+
+    cursor = utils.decode_cursor(request.GET.get('after', ''))
+    if cursor is not None and len(cursor) == len(ordering):
+        patient_list = patient_list.filter(
+            utils.keyset_filter(ordering, cursor))
+
+    page_size = settings.OSLER_PATIENTS_PER_PAGE
+    patients = list(patient_list
+        .order_by(*ordering)
+        .select_related('gender')
+        .select_related('summary__latest_workup__encounter')
+        .select_related('summary__latest_workup__signer')
+        .prefetch_related('case_managers')[:page_size + 1])
+
+    next_cursor = None
+    if len(patients) > page_size:
+        patients = patients[:page_size]
+        last = patients[-1]
+        next_cursor = utils.encode_cursor(
+            [str(getattr(last, field.lstrip('-'))) for field in ordering])
+
+    return render(request,
+                  'core/patient_search.html',
+                  {
+                    'object_list': patients,
+                    'query': query,
+                    'sort': sort,
+                    'sorts': [(key, label) for key, (label, _) in
+                              PATIENT_SEARCH_SORTS.items()],
+                    'next_cursor': next_cursor,
+                    'is_first_page': cursor is None,
+                  })
+
+
 def patient_activate_detail(request, pk, home=False):
     '''Toggle status to default active/inactive'''
     pt = get_object_or_404(core_models.Patient, pk=pk)
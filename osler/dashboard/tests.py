@@ -5,7 +5,9 @@ from builtins import range
 import datetime
 from django.utils.timezone import now
 
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.conf import settings
 
@@ -139,6 +141,35 @@ class TestAttendingDashboard(TestCase):
         # ONE of which are marked as unattested
         self.assertContains(response, '<tr  class="warning" >', count=1)
 
+    def test_dashboard_queries(self):
+        """The dashboard costs the same queries however many workups are
+        on the page"""
+        def make_workups(n):
+            for i in range(n):
+                pt = core_factories.PatientFactory()
+                Workup.objects.create(
+                    attending=self.attending,
+                    encounter=Encounter.objects.create(
+                        patient=pt, clinic_day=datetime.date(2001, 1, i + 1),
+                        status=EncounterStatus.objects.first()),
+                    author=self.clinical_student,
+                    author_type=self.clinical_student.groups.first(),
+                    patient=pt, **self.wu_info)
+
+        make_workups(2)
+        self.client.get(reverse('dashboard-attending'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard-attending'))
+        n_queries = len(queries)
+        assert list(response.context['clinic_list']) == [
+            datetime.date(2001, 1, 1), datetime.date(2001, 1, 2)]
+
+        make_workups(6)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard-attending'))
+        assert len(queries) == n_queries
+        assert len(response.context['clinic_list']) == 6
+
     @override_settings(OSLER_CLINIC_DAYS_PER_PAGE=3)
     def test_dashboard_pagination(self):
         response = self.client.get(reverse('dashboard-attending'))
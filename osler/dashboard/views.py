@@ -5,12 +5,13 @@ from django.shortcuts import render, redirect
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.conf import settings
 
-from osler.workup.models import Encounter
-from osler.core.models import Patient
+from django.db.models import OuterRef
+
+from osler.workup.models import Workup
+from osler.core.models import Patient, last_seen_subquery
 from osler.core.views import all_patients
 
-from osler.users.utils import get_active_role
-from osler.core.utils import get_clindates
+from osler.users.utils import get_active_role, group_has_perm
 
 
 def dashboard_dispatch(request):
@@ -36,11 +37,13 @@ def dashboard_active(request):
 
 
 def dashboard_attending(request):
-    
-    encounter_list = Encounter.objects.filter(workup__attending=request.user).order_by('clinic_day')
-    clinic_list = get_clindates(encounter_list)
+    """The attending's workups, a page at a time, under their clinic days,
+    and the active patients without notes."""
+
+    workup_list = Workup.objects.filter(attending=request.user) \
+        .order_by('encounter__clinic_day', 'pk')
 
-    paginator = Paginator(encounter_list, settings.OSLER_CLINIC_DAYS_PER_PAGE,
+    paginator = Paginator(workup_list, settings.OSLER_CLINIC_DAYS_PER_PAGE,
                           allow_empty_first_page=True)
 
     page = request.GET.get('page')
@@ -53,11 +56,33 @@ def dashboard_attending(request):
         # If page is out of range (e.g. 9999), deliver last page of results.
         clinics = paginator.page(paginator.num_pages)
 
-    no_note_patients = Patient.objects.filter(workup=None, encounter__status__is_active=True).order_by('-pk')[:20]
+    clinics.object_list = list(clinics.object_list
+        .select_related('patient', 'encounter', 'attending', 'author',
+                        'signer')
+        .annotate(patient_last_seen=last_seen_subquery(OuterRef('patient'))))
+    for wu in clinics.object_list:
+        wu.patient.last_seen_datetime = wu.patient_last_seen
+
+    # the clinic days of this page, in order
+    clinic_list = []
+    if clinics.object_list:
+        clinic_list = workup_list \
+            .filter(encounter__clinic_day__range=(
+                clinics.object_list[0].encounter.clinic_day,
+                clinics.object_list[-1].encounter.clinic_day)) \
+            .order_by('encounter__clinic_day') \
+            .values_list('encounter__clinic_day', flat=True) \
+            .distinct()
+
+    no_note_patients = Patient.objects \
+        .filter(workup=None, encounter__status__is_active=True) \
+        .with_last_seen().order_by('-pk')[:20]
 
     return render(request,
                   'dashboard/dashboard-attending.html',
                   {'clinics': clinics,
-                  'clinic_list':clinic_list,
-                   'no_note_patients': no_note_patients
+                   'clinic_list': clinic_list,
+                   'no_note_patients': no_note_patients,
+                   'can_export_pdf': group_has_perm(
+                       get_active_role(request), 'workup.export_pdf_Workup'),
                    })
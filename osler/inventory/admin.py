@@ -11,3 +11,21 @@ for model in [models.DrugCategory, models.MeasuringUnit, models.Manufacturer]:
 admin.site.register(models.Drug, SimpleHistoryAdmin)
 
 admin.site.register(models.DispenseHistory, NoteAdmin)
+
+
+@admin.register(models.StockEntry, models.StockSnapshot)
+class StockLedgerAdmin(admin.ModelAdmin):
+    """The stock ledger is written by Drug.save() and the snapshot_stock
+    command only, so it can be browsed here but not edited."""
+    list_display = ['drug', 'datetime', '__str__']
+    list_filter = ['datetime']
+    raw_id_fields = ['drug']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
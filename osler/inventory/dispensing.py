@@ -0,0 +1,126 @@
+"""Dispensing drugs from inventory.
+
+dispense() posts a whole prescription, i.e. any number of (drug, quantity)
+lines for one patient encounter, in a single transaction: either every
+line is dispensed or none is. The drugs are locked with SELECT ... FOR
+UPDATE before their stock is checked, so two volunteers dispensing the
+same lot at once can neither oversell it nor lose each other's update.
+
+dispense_fefo() does the same for lines of (name, dose, unit, quantity),
+picking the lots to dispense from first expiry, first out.
+"""
+from collections import OrderedDict
+
+from django.db import transaction
+
+from osler.inventory import models
+
+
+class DispenseError(Exception):
+    """Raised with a list of messages when a prescription can't be
+    dispensed in full."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def dispense(lines, encounter, author, author_type):
+    """Dispense lines, an iterable of (drug or drug pk, quantity), to the
+    patient of encounter. Returns the new DispenseHistory entries, in the
+    order of the lines.
+
+    Quantities of the same drug on different lines are dispensed together.
+    """
+    quantities = OrderedDict()
+    errors = []
+    for drug, quantity in lines:
+        drug_pk = getattr(drug, 'pk', drug)
+        if quantity < 1:
+            errors.append("Quantities to dispense must be at least 1.")
+            continue
+        quantities[drug_pk] = quantities.get(drug_pk, 0) + quantity
+    if errors:
+        raise DispenseError(errors)
+
+    with transaction.atomic():
+        # lock in primary key order, so that two prescriptions sharing
+        # drugs can't deadlock
+        drugs = models.Drug.objects.select_for_update() \
+            .filter(pk__in=quantities).order_by('pk').in_bulk()
+
+        for drug_pk, quantity in quantities.items():
+            drug = drugs.get(drug_pk)
+            if drug is None:
+                errors.append("There is no drug with id %s." % drug_pk)
+            elif not drug.can_dispense(quantity):
+                errors.append("Cannot dispense %s of %s (lot %s), only %s in stock." % (
+                    quantity, drug, drug.lot_number, drug.stock))
+        if errors:
+            raise DispenseError(errors)
+
+        for drug_pk, quantity in quantities.items():
+            drugs[drug_pk].dispense(quantity)
+
+        return models.DispenseHistory.objects.bulk_create(
+            models.DispenseHistory(drug=drugs[drug_pk],
+                                   dispense=quantity,
+                                   author=author,
+                                   author_type=author_type,
+                                   patient=encounter.patient,
+                                   encounter=encounter)
+            for drug_pk, quantity in quantities.items())
+
+
+def allocate(lots, quantity):
+    """Split quantity across lots, the locked lots of one drug in the
+    order to take from them. Returns (lot, quantity) lines for dispense(),
+    or None if the lots don't hold enough."""
+    lines = []
+    for lot in lots:
+        if quantity <= 0:
+            break
+        take = min(quantity, lot.stock)
+        lines.append((lot, take))
+        quantity -= take
+
+    return lines if quantity <= 0 else None
+
+
+def dispense_fefo(products, encounter, author, author_type):
+    """Dispense products, an iterable of (name, dose, unit, quantity), to
+    the patient of encounter, each from its first expiring lots. Returns
+    the new DispenseHistory entries."""
+    quantities = OrderedDict()
+    errors = []
+    for name, dose, unit, quantity in products:
+        product = (name, dose, getattr(unit, 'pk', unit))
+        if quantity < 1:
+            errors.append("Quantities to dispense must be at least 1.")
+            continue
+        quantities[product] = quantities.get(product, 0) + quantity
+    if errors:
+        raise DispenseError(errors)
+
+    with transaction.atomic():
+        # lock every candidate lot up front, in primary key order like
+        # dispense() does, then order each drug's lots first expiring first
+        lots = OrderedDict((product, []) for product in quantities)
+        for lot in sorted(models.Drug.objects.select_for_update()
+                          .unexpired_lots(quantities).order_by('pk'),
+                          key=lambda lot: (lot.expiration_date, lot.pk)):
+            lots[(lot.name, lot.dose, lot.unit_id)].append(lot)
+
+        lines = []
+        for (name, dose, unit), quantity in quantities.items():
+            product_lines = allocate(lots[(name, dose, unit)], quantity)
+            if product_lines is None:
+                errors.append("Cannot dispense %s of %s %s %s, more than is "
+                              "in unexpired stock." % (
+                                  quantity, name, dose, unit))
+            else:
+                lines.extend(product_lines)
+        if errors:
+            raise DispenseError(errors)
+
+        return dispense(lines, encounter, author, author_type)
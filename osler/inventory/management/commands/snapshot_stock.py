@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import localdate, now
+
+from osler.inventory import models
+
+
+class Command(BaseCommand):
+    help = """Records the stock of every drug, and the total it has
+    dispensed, as of now, so that stock at a point in time only has to
+    add up the ledger entries since. Optionally writes off the stock of
+    expired lots first. Meant to be run periodically, e.g. nightly from
+    cron."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--expire', action='store_true',
+            help="Write off the remaining stock of expired lots first.")
+
+    def handle(self, *args, **options):
+        if options['expire']:
+            expired = models.Drug.objects.filter(
+                expiration_date__lt=localdate()).exclude(stock=0)
+            with transaction.atomic():
+                n_expired = 0
+                for drug in expired.select_for_update().order_by('pk'):
+                    drug.expire()
+                    n_expired += 1
+            self.stdout.write("Wrote off %s expired lots." % n_expired)
+
+        with transaction.atomic():
+            # Stock only changes in Drug.save(), which updates the drug's row
+            # before adding its ledger entry. Holding every drug's row lock
+            # while taking the time waits out saves already under way, and
+            # holds off new ones until the snapshot commits, so an entry
+            # timestamped before the snapshot can't commit after it (and be
+            # left out of the snapshot and of every later sum). Locked in
+            # primary key order, as dispensing does, so as not to deadlock.
+            list(models.Drug.objects.select_for_update().order_by('pk')
+                 .values_list('pk', flat=True))
+            when = now()
+            drugs = models.Drug.objects.order_by().with_ledger(when) \
+                .values_list('pk', 'ledger_stock', 'ledger_dispensed')
+            snapshots = models.StockSnapshot.objects.bulk_create(
+                models.StockSnapshot(drug_id=pk, datetime=when, stock=stock,
+                                     dispensed=dispensed)
+                for pk, stock, dispensed in drugs.iterator())
+        self.stdout.write("Recorded the stock of %s drugs." % len(snapshots))
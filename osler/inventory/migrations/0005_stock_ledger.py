@@ -0,0 +1,61 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def open_ledger(apps, schema_editor):
+    """Start the ledger of each existing drug with its current stock."""
+    Drug = apps.get_model('inventory', 'Drug')
+    StockEntry = apps.get_model('inventory', 'StockEntry')
+
+    StockEntry.objects.bulk_create(
+        StockEntry(drug_id=pk, kind='A', quantity=stock)
+        for pk, stock in Drug.objects.exclude(stock=0).values_list('pk', 'stock'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_auto_20201209_2006'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField()),
+                ('stock', models.IntegerField()),
+                ('dispensed', models.PositiveIntegerField()),
+                ('drug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.drug')),
+            ],
+            options={
+                'ordering': ['datetime'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('R', 'Receipt'), ('D', 'Dispense'), ('A', 'Adjustment'), ('E', 'Expiration')], max_length=1)),
+                ('quantity', models.IntegerField()),
+                ('datetime', models.DateTimeField(default=django.utils.timezone.now)),
+                ('drug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.drug')),
+            ],
+            options={
+                'verbose_name_plural': 'stock entries',
+                'ordering': ['datetime', 'pk'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stocksnapshot',
+            index=models.Index(fields=['drug', '-datetime'], name='inventory_s_drug_id_0d84ea_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['drug', 'datetime'], name='inventory_s_drug_id_7314ed_idx'),
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
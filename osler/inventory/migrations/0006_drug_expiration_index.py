@@ -0,0 +1,17 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['name', 'dose', 'expiration_date'], name='inventory_d_name_b987bb_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.2 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_drug_expiration_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='drug',
+            name='inventory_d_name_b987bb_idx',
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['name', 'dose', 'unit', 'expiration_date'], name='inventory_d_name_a763af_idx'),
+        ),
+    ]
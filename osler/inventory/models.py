@@ -1,7 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from osler.core.validators import validate_name
 from osler.core.models import Note, Encounter
 import datetime
+import functools
+import operator
 from django.utils import timezone
 from simple_history.models import HistoricalRecords
 
@@ -39,13 +43,84 @@ class Manufacturer(models.Model):
     def __str__(self):
         return self.name
 
+# lots expiring within this many days are flagged as expiring soon
+EXPIRING_SOON_DAYS = 60
+
+
+class DrugQuerySet(models.QuerySet):
+
+    def with_expiry_status(self):
+        """Annotate each lot with expiry_status: 'expired', 'expiring' (within
+        EXPIRING_SOON_DAYS) or ''."""
+        today = timezone.localdate()
+        return self.annotate(expiry_status=Case(
+            When(expiration_date__lt=today, then=Value('expired')),
+            When(expiration_date__lte=today + datetime.timedelta(days=EXPIRING_SOON_DAYS),
+                 then=Value('expiring')),
+            default=Value(''), output_field=models.CharField()))
+
+    def expiring_soon(self, days=EXPIRING_SOON_DAYS):
+        """Lots with stock left that have expired or will within days,
+        soonest first."""
+        today = timezone.localdate()
+        return self.filter(stock__gt=0,
+                           expiration_date__lte=today + datetime.timedelta(days=days)) \
+            .order_by('expiration_date', 'name', 'dose')
+
+    def unexpired_lots(self, products):
+        """Lots of any of products, an iterable of (name, dose, unit), that
+        have stock left and haven't expired, first expiring first."""
+        matches = [models.Q(name=name, dose=dose, unit=unit)
+                   for name, dose, unit in products]
+        if not matches:
+            return self.none()
+        return self.filter(functools.reduce(operator.or_, matches),
+                           stock__gt=0,
+                           expiration_date__gte=timezone.localdate()) \
+            .order_by('expiration_date', 'pk')
+
+    def with_ledger(self, when, stock='ledger_stock', dispensed='ledger_dispensed'):
+        """Annotate each drug with its stock and the total it had ever
+        dispensed as of when, per the stock ledger: the latest snapshot at
+        or before when, plus the ledger entries since that snapshot. Pass
+        None for either name to leave that annotation out."""
+        snapshots = StockSnapshot.objects \
+            .filter(drug=OuterRef('pk'), datetime__lte=when) \
+            .order_by('-datetime')
+        snapshot_datetime = StockSnapshot.objects \
+            .filter(drug=OuterRef(OuterRef('pk')), datetime__lte=when) \
+            .order_by('-datetime').values('datetime')[:1]
+        entries = StockEntry.objects \
+            .filter(drug=OuterRef('pk'), datetime__lte=when,
+                    datetime__gt=Coalesce(Subquery(snapshot_datetime),
+                                          Value(LEDGER_EPOCH))) \
+            .order_by().values('drug')
+
+        def total(subquery):
+            return Coalesce(Subquery(subquery), Value(0))
+
+        def summed(queryset):
+            return queryset.annotate(total=Sum('quantity')).values('total')
+
+        annotations = {}
+        if stock is not None:
+            annotations[stock] = total(snapshots.values('stock')[:1]) + \
+                total(summed(entries))
+        if dispensed is not None:
+            annotations[dispensed] = total(snapshots.values('dispensed')[:1]) - \
+                total(summed(entries.filter(kind=StockEntry.DISPENSE)))
+        return self.annotate(**annotations)
+
+
 class Drug(models.Model):
+    objects = DrugQuerySet.as_manager()
 
     class Meta:
         ordering = ['name',]
         permissions = [
             ('export_csv', "Can export drug inventory")
         ]
+        indexes = [models.Index(fields=['name', 'dose', 'unit', 'expiration_date'])]
 
     name = models.CharField(max_length=100, blank=False, validators=[validate_name])
 
@@ -67,7 +142,7 @@ class Drug(models.Model):
 
     def pre_expire(self):
         today = timezone.now().date()
-        two_month = today + datetime.timedelta(days=60)
+        two_month = today + datetime.timedelta(days=EXPIRING_SOON_DAYS)
         return self.expiration_date >= today and self.expiration_date <= two_month
 
     def expired(self):
@@ -78,7 +153,39 @@ class Drug(models.Model):
 
     def dispense(self, num):
         self.stock -= num
-        self.save()
+        self.save(stock_entry_kind=StockEntry.DISPENSE)
+
+    def expire(self):
+        """Write off the remaining stock of this (expired) lot."""
+        self.stock = 0
+        self.save(stock_entry_kind=StockEntry.EXPIRATION)
+
+    # stock as of the last load or save, for save() to log changes against
+    _saved_stock = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        drug = super().from_db(db, field_names, values)
+        drug._saved_stock = drug.__dict__.get('stock')
+        return drug
+
+    def save(self, *args, stock_entry_kind=None, **kwargs):
+        """Save the drug, and log any change to its stock to the stock
+        ledger, as a receipt for a new drug and as stock_entry_kind
+        (by default an adjustment) otherwise."""
+        if self._state.adding:
+            change, kind = self.stock, StockEntry.RECEIPT
+        elif self._saved_stock is not None:
+            change = self.stock - self._saved_stock
+            kind = stock_entry_kind or StockEntry.ADJUSTMENT
+        else:
+            change = 0
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if change:
+                StockEntry.objects.create(drug=self, kind=kind, quantity=change)
+        self._saved_stock = self.stock
 
     def __str__(self):
         return self.name
@@ -96,3 +203,61 @@ class DispenseHistory(Note):
 
     def __str__(self):
         return self.drug.lot_number
+
+
+# before any stock ledger entry, for drugs that have no snapshot yet
+LEDGER_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class StockEntry(models.Model):
+    """One change to the stock of a drug. Entries are only ever added, so
+    the stock of a drug at any time is the sum of its entries up to then,
+    and Drug.save() adds one whenever the stock changes."""
+
+    class Meta:
+        verbose_name_plural = "stock entries"
+        ordering = ['datetime', 'pk']
+        indexes = [models.Index(fields=['drug', 'datetime'])]
+
+    RECEIPT = 'R'
+    DISPENSE = 'D'
+    ADJUSTMENT = 'A'
+    EXPIRATION = 'E'
+    KIND_CHOICES = (
+        (RECEIPT, 'Receipt'),
+        (DISPENSE, 'Dispense'),
+        (ADJUSTMENT, 'Adjustment'),
+        (EXPIRATION, 'Expiration'),
+    )
+
+    drug = models.ForeignKey(Drug, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    # positive for stock coming in, negative for stock going out
+    quantity = models.IntegerField()
+    datetime = models.DateTimeField(default=timezone.now)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock entries can't be changed once made.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return '%s %s: %+d' % (self.get_kind_display(), self.drug, self.quantity)
+
+
+class StockSnapshot(models.Model):
+    """The stock of a drug, and the total it had ever dispensed, at some
+    time, so that the stock ledger only has to be summed from the latest
+    snapshot on. Written periodically by the snapshot_stock command."""
+
+    class Meta:
+        ordering = ['datetime']
+        indexes = [models.Index(fields=['drug', '-datetime'])]
+
+    drug = models.ForeignKey(Drug, on_delete=models.CASCADE)
+    datetime = models.DateTimeField()
+    stock = models.IntegerField()
+    dispensed = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '%s at %s: %s' % (self.drug, self.datetime, self.stock)
@@ -1,4 +1,10 @@
+import csv
+import datetime
+import io
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, resolve
 from osler.inventory.models import DrugCategory, MeasuringUnit, Manufacturer, Drug, DispenseHistory
 from osler.inventory import views
@@ -87,9 +93,46 @@ class TestDrugList(TestCase):
         drug_final = Drug.objects.get(pk=self.drug.pk)
 
         self.assertEqual(drug_initial.stock, drug_final.stock)
-        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, 'only %s in stock' % drug_initial.stock,
+                            status_code=400)
         assert DispenseHistory.objects.count() == 0
 
+    def test_drug_dispense_malformed(self):
+        url = reverse('inventory:drug-dispense')
+        valid = {'pk': self.drug.pk, 'num': '1', 'patient_pk': self.pt.pk,
+                 'encounter': self.encounter.pk}
+        no_encounter = core_factories.PatientFactory()
+        for changes in [{'num': 'x'}, {'pk': 'x'}, {'num': ['1', '1']},
+                        {'patient_pk': ''}, {'encounter': 'x'},
+                        {'encounter': 0}, {'pk': 0, 'fefo': '1'},
+                        {'patient_pk': no_encounter.pk, 'encounter': ''}]:
+            response = self.client.post(url, dict(valid, **changes))
+            assert response.status_code == 400, changes
+
+        data = dict(valid)
+        del data['patient_pk']
+        assert self.client.post(url, data).status_code == 400
+        assert Drug.objects.get(pk=self.drug.pk).stock == self.drug.stock
+        assert not DispenseHistory.objects.exists()
+
+    def test_drug_dispense_prescription(self):
+        other_drug = factories.DrugFactory(stock=4)
+        url = reverse('inventory:drug-dispense')
+        data = {'pk': [self.drug.pk, other_drug.pk], 'num': ['2', '5'],
+                'patient_pk': self.pt.pk, 'encounter': self.encounter.pk}
+
+        response = self.client.post(url, data)
+        assert response.status_code == 400
+        assert not DispenseHistory.objects.exists()
+
+        data['num'] = ['2', '4']
+        response = self.client.post(url, data)
+        assert response.status_code == 302
+        assert Drug.objects.get(pk=self.drug.pk).stock == self.drug.stock - 2
+        assert Drug.objects.get(pk=other_drug.pk).stock == 0
+        assert set(DispenseHistory.objects.values_list('encounter', flat=True)) == {self.encounter.pk}
+
 class TestDrugAdd(TestCase):
 
     fixtures = ['core']
@@ -197,3 +240,29 @@ class TestDrugExport(TestCase):
                                  f"attachment; filename=drug-dispensing-history-through-09/28/20.csv")
             else:
                  assert response.status_code == 403
+
+    def test_export_contents(self):
+        user = user_factories.UserFactory(groups=[
+            user_factories.PermGroupFactory(permissions=['inventory.export_csv'])])
+        log_in_user(self.client, user)
+        category = factories.DrugCategoryFactory()
+        drugs = [factories.DrugFactory(name=name, category=category)
+                 for name in ['Amoxicillin', 'Metformin', 'Zinc']]
+        for drug, n in [(drugs[0], 2), (drugs[0], 3), (drugs[1], 4)]:
+            factories.DispenseHistoryFactory(drug=drug, dispense=n, author=user,
+                                             author_type=user.groups.first())
+        DispenseHistory.objects.filter(dispense=4).update(
+            written_datetime=timezone.now() - datetime.timedelta(days=30))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('inventory:export-csv'))
+            rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        assert len([q for q in queries if 'inventory_drug' in q['sql']]) == 1
+        assert [(row[0], row[-1]) for row in rows[1:]] == \
+            [('Amoxicillin', '5'), ('Metformin', ''), ('Zinc', '')]
+
+        today = timezone.now().date()
+        response = self.client.post(reverse('inventory:export-dispensing-history'), {
+            'start_date': str(today - datetime.timedelta(days=60)), 'end_date': str(today)})
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        assert [row[:2] for row in rows[1:]] == [['Amoxicillin', '5'], ['Metformin', '4']]
@@ -1,9 +1,18 @@
+import datetime
+import io
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, resolve
-from osler.inventory.models import DrugCategory, MeasuringUnit, Manufacturer, Drug, DispenseHistory
-from osler.inventory import views, forms
+from django.utils import timezone
+from osler.inventory.models import DrugCategory, MeasuringUnit, Manufacturer, Drug, DispenseHistory, StockEntry, StockSnapshot
+from osler.inventory import views, forms, dispensing
 from osler.inventory.tests import factories
-from osler.core.tests.test_views import build_user
+from osler.core.tests import factories as core_factories
+from osler.core.tests.test_views import build_user, log_in_user
+from osler.users.tests import factories as user_factories
 # Create your tests here.
 
 class TestUrls(TestCase):
@@ -126,3 +135,212 @@ class TestForms(TestCase):
                 }
         form = forms.DuplicateDrugForm(data=data)
         self.assertTrue(form.is_valid())
+
+
+class TestDispensing(TestCase):
+
+    def setUp(self):
+        self.user = build_user()
+        self.encounter = core_factories.EncounterFactory()
+        self.drugs = [factories.DrugFactory(stock=10) for _ in range(3)]
+
+    def dispense(self, lines):
+        return dispensing.dispense(lines, self.encounter, author=self.user,
+                                   author_type=self.user.groups.first())
+
+    def test_dispense_prescription(self):
+        histories = self.dispense([(self.drugs[0], 3), (self.drugs[1].pk, 10),
+                                   (self.drugs[0], 2)])
+
+        assert [(h.drug, h.dispense) for h in histories] == \
+            [(self.drugs[0], 5), (self.drugs[1], 10)]
+        assert [Drug.objects.get(pk=d.pk).stock for d in self.drugs] == [5, 0, 10]
+        assert DispenseHistory.objects.filter(
+            encounter=self.encounter, patient=self.encounter.patient).count() == 2
+
+    def test_all_or_nothing(self):
+        with self.assertRaises(dispensing.DispenseError) as raised:
+            self.dispense([(self.drugs[0], 3), (self.drugs[1], 11), (0, 1)])
+
+        assert len(raised.exception.errors) == 2
+        assert [Drug.objects.get(pk=d.pk).stock for d in self.drugs] == [10] * 3
+        assert not DispenseHistory.objects.exists()
+
+    def test_stale_stock(self):
+        """Stock is checked and decremented as it is in the database, not
+        as it was when the drug was loaded"""
+        stale = Drug.objects.get(pk=self.drugs[0].pk)
+        self.dispense([(self.drugs[0], 8)])
+
+        with self.assertRaises(dispensing.DispenseError):
+            self.dispense([(stale, 8)])
+        self.dispense([(stale, 2)])
+        assert Drug.objects.get(pk=stale.pk).stock == 0
+
+
+class TestStockLedger(TestCase):
+
+    def setUp(self):
+        self.user = build_user()
+        self.encounter = core_factories.EncounterFactory()
+
+    def dispense(self, drug, n):
+        dispensing.dispense([(drug, n)], self.encounter, author=self.user,
+                            author_type=self.user.groups.first())
+
+    def ledger(self, when):
+        return {drug.pk: (drug.ledger_stock, drug.ledger_dispensed)
+                for drug in Drug.objects.with_ledger(when)}
+
+    def test_entries(self):
+        drug = factories.DrugFactory(stock=10)
+        self.dispense(drug, 3)
+        drug = Drug.objects.get(pk=drug.pk)
+        drug.stock = 12
+        drug.save()
+        drug.expire()
+
+        assert list(StockEntry.objects.values_list('kind', 'quantity')) == [
+            (StockEntry.RECEIPT, 10), (StockEntry.DISPENSE, -3),
+            (StockEntry.ADJUSTMENT, 5), (StockEntry.EXPIRATION, -12)]
+        assert self.ledger(timezone.now()) == {drug.pk: (0, 3)}
+
+        entry = StockEntry.objects.first()
+        entry.quantity = 100
+        with self.assertRaises(ValueError):
+            entry.save()
+
+    def test_point_in_time(self):
+        drug = factories.DrugFactory(stock=10)
+        self.dispense(drug, 2)
+        StockEntry.objects.update(datetime=timezone.now() - datetime.timedelta(days=10))
+        call_command('snapshot_stock', stdout=io.StringIO())
+        StockSnapshot.objects.update(datetime=timezone.now() - datetime.timedelta(days=5))
+        self.dispense(drug, 4)
+
+        assert self.ledger(timezone.now() - datetime.timedelta(days=20)) == {drug.pk: (0, 0)}
+        assert self.ledger(timezone.now() - datetime.timedelta(days=7)) == {drug.pk: (8, 2)}
+        assert self.ledger(timezone.now() - datetime.timedelta(days=3)) == {drug.pk: (8, 2)}
+        assert self.ledger(timezone.now()) == {drug.pk: (4, 6)}
+
+        # ledger entries before the snapshot aren't summed again
+        StockEntry.objects.filter(kind=StockEntry.RECEIPT).delete()
+        assert self.ledger(timezone.now()) == {drug.pk: (4, 6)}
+
+    def test_expire_command(self):
+        expired = factories.DrugFactory(stock=10)
+        fresh = factories.DrugFactory(
+            stock=5, expiration_date=timezone.now().date() + datetime.timedelta(days=10))
+        call_command('snapshot_stock', '--expire', stdout=io.StringIO())
+
+        assert Drug.objects.get(pk=expired.pk).stock == 0
+        assert dict(StockSnapshot.objects.values_list('drug', 'stock')) == \
+            {expired.pk: 0, fresh.pk: 5}
+
+    def test_stock_report(self):
+        unit = factories.MeasuringUnitFactory()
+        lots = [factories.DrugFactory(name='Metformin', stock=30, unit=unit)
+                for _ in range(2)]
+        factories.DrugFactory(name='Zinc', stock=5, unit=unit)
+        self.dispense(lots[0], 20)
+        self.dispense(lots[1], 10)
+
+        url = reverse('inventory:stock-report')
+        client = self.client
+        log_in_user(client, build_user([user_factories.NoPermGroupFactory]))
+        assert client.get(url).status_code == 403
+
+        user = user_factories.UserFactory(groups=[
+            user_factories.PermGroupFactory(permissions=['inventory.export_csv'])])
+        log_in_user(client, user)
+        response = client.get(url, {'days': 10})
+        rows = response.context['rows']
+        assert [(r['name'], r['stock'], r['consumed'], r['reorder']) for r in rows] == \
+            [('Metformin', 30, 30, True), ('Zinc', 5, 0, False)]
+        assert rows[0]['days_left'] == 10
+
+
+class TestFefo(TestCase):
+
+    def setUp(self):
+        self.user = build_user()
+        self.encounter = core_factories.EncounterFactory()
+        today = timezone.localdate()
+        self.unit = factories.MeasuringUnitFactory()
+        self.expired, self.soon, self.later = [
+            factories.DrugFactory(name='Metformin', dose=500, stock=5, unit=self.unit,
+                                  expiration_date=today + datetime.timedelta(days=days))
+            for days in [-1, 10, 100]]
+        self.other_dose = factories.DrugFactory(
+            name='Metformin', dose=850, stock=5, unit=self.unit,
+            expiration_date=today + datetime.timedelta(days=1))
+
+    def dispense(self, products):
+        return dispensing.dispense_fefo(products, self.encounter, author=self.user,
+                                        author_type=self.user.groups.first())
+
+    def stock(self):
+        return [Drug.objects.get(pk=d.pk).stock for d in
+                [self.expired, self.soon, self.later, self.other_dose]]
+
+    def test_first_expiry_first_out(self):
+        histories = self.dispense([('Metformin', 500, self.unit, 3),
+                                   ('Metformin', 500, self.unit.pk, 4)])
+        assert [(h.drug, h.dispense) for h in histories] == \
+            [(self.soon, 5), (self.later, 2)]
+        assert self.stock() == [5, 0, 3, 5]
+
+    def test_not_enough_unexpired(self):
+        with self.assertRaises(dispensing.DispenseError):
+            self.dispense([('Metformin', 500, self.unit, 11)])
+        assert self.stock() == [5, 5, 5, 5]
+
+    def test_matches_unit(self):
+        """Lots of the same name and dose in another unit aren't used"""
+        syrup = factories.DrugFactory(
+            name='Metformin', dose=500, stock=50,
+            unit=factories.MeasuringUnitFactory(),
+            category=self.soon.category, manufacturer=self.soon.manufacturer,
+            expiration_date=timezone.localdate() + datetime.timedelta(days=1))
+        self.dispense([('Metformin', 500, self.unit, 7)])
+        assert self.stock() == [5, 0, 3, 5]
+        assert Drug.objects.get(pk=syrup.pk).stock == 50
+
+        with self.assertRaises(dispensing.DispenseError):
+            self.dispense([('Metformin', 500, self.unit, 4)])
+
+    def test_nonpositive_quantity(self):
+        for quantity in [0, -2]:
+            with self.assertRaises(dispensing.DispenseError):
+                self.dispense([('Metformin', 500, self.unit, quantity)])
+        assert self.stock() == [5, 5, 5, 5]
+
+    def test_locks_in_pk_order(self):
+        """All candidate lots are locked by one query in pk order, whatever
+        order the products are listed in"""
+        with CaptureQueriesContext(connection) as queries:
+            self.dispense([('Metformin', 850, self.unit, 1),
+                           ('Metformin', 500, self.unit, 1)])
+        lot_queries = [q['sql'] for q in queries.captured_queries
+                       if '"expiration_date" >=' in q['sql']]
+        assert len(lot_queries) == 1
+        assert lot_queries[0].endswith('ORDER BY "inventory_drug"."id" ASC')
+
+    def test_expiring_report(self):
+        assert list(Drug.objects.expiring_soon(30)) == \
+            [self.expired, self.other_dose, self.soon]
+        assert dict(Drug.objects.with_expiry_status().values_list('pk', 'expiry_status')) == {
+            self.expired.pk: 'expired', self.soon.pk: 'expiring',
+            self.later.pk: '', self.other_dose.pk: 'expiring'}
+
+        log_in_user(self.client, self.user)
+        response = self.client.get(reverse('inventory:expiring-report'), {'days': 30})
+        assert list(response.context['lots']) == [self.expired, self.other_dose, self.soon]
+
+    def test_dispense_view(self):
+        log_in_user(self.client, self.user)
+        response = self.client.post(reverse('inventory:drug-dispense'), {
+            'pk': self.later.pk, 'num': 7, 'fefo': '1',
+            'patient_pk': self.encounter.patient.pk, 'encounter': self.encounter.pk})
+        assert response.status_code == 302
+        assert self.stock() == [5, 0, 3, 5]
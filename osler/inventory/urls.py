@@ -38,6 +38,14 @@ unwrapped_urlconf = [
         r'^export-dispense-history/$',
         views.export_dispensing_history,
         name='export-dispensing-history'),
+    re_path(
+        r'^stock-report/$',
+        views.stock_report,
+        name='stock-report'),
+    re_path(
+        r'^expiring-report/$',
+        views.expiring_report,
+        name='expiring-report'),
 ]
 
 wrap_config = {}
@@ -1,3 +1,8 @@
+import csv
+
+from django.http import StreamingHttpResponse
+
+
 
 
 def get_name_and_lot_from_url_query_dict(request):
@@ -7,3 +12,23 @@ def get_name_and_lot_from_url_query_dict(request):
                if param in request.GET}
 
     return qs_dict
+
+
+class Echo:
+    """File-like object whose write() hands back what it was given, so
+    that csv.writer can format rows one at a time for a streaming
+    response."""
+
+    def write(self, value):
+        return value
+
+
+def streaming_csv_response(rows, filename):
+    """A StreamingHttpResponse that downloads the iterable of rows as a
+    .csv file, without ever holding more than one row in memory."""
+
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in rows), content_type='application/csv')
+    response["Content-Disposition"] = "attachment; filename=%s" % (filename,)
+    return response
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.shortcuts import redirect
+from django.conf import settings
+from django.shortcuts import redirect, render
 from django.views.generic.edit import FormView, UpdateView
 from django.views.generic.list import ListView
 from django.urls import reverse
-from django.http import HttpResponseRedirect, HttpResponseNotFound, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseBadRequest
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.html import format_html_join
 import urllib
 from osler.users.decorators import active_permission_required
 from osler.users.utils import get_active_role, group_has_perm
@@ -14,13 +17,14 @@ from osler.core.views import NoteFormView
 from osler.core.models import Patient
 from osler.users.utils import get_active_role
 
+from . import dispensing
 from . import models
 from . import forms
 from . import utils
 
-from tempfile import NamedTemporaryFile
-import csv
 import datetime
+import itertools
+from django.db.models import Q, Sum
 from django.utils import timezone
 
 class DrugListView(ListView):
@@ -31,6 +35,7 @@ class DrugListView(ListView):
                     select_related('category').\
                     select_related('manufacturer').\
                     order_by('category', 'name', 'dose', 'expiration_date').\
+                    with_expiry_status().\
                     exclude(stock=0).all()
         return druglist
 
@@ -129,115 +134,182 @@ class DrugUpdate(UpdateView):
 
 
 def drug_dispense(request):
-    pk = request.POST['pk']
-    num = request.POST['num']
-    patient_pk = request.POST['patient_pk']
-    drug = models.Drug.objects.get(pk=pk)
-    patient = Patient.objects.get(pk=patient_pk)
-    can_dispense = drug.can_dispense(int(num))
-
-    if can_dispense:
-        models.DispenseHistory.objects.create(drug=drug,
-                                              dispense=num,
-                                              author=request.user,
-                                              author_type=get_active_role(request),
-                                              patient=patient,
-                                              encounter=patient.last_encounter())
-        drug.dispense(int(num))
-    else:
-        return HttpResponseNotFound('<h1>Cannot dispense more drugs than in stock!</h1>')
+    '''Dispenses one or more drugs to a patient. The drug and quantity of
+    each line are posted as pk and num, repeated for a prescription of
+    several drugs, and all lines are dispensed or none. With fefo set,
+    each line is taken from the first expiring lots of the drug instead
+    of the given lot.'''
+    pks, nums = request.POST.getlist('pk'), request.POST.getlist('num')
+    if not pks or len(pks) != len(nums):
+        return HttpResponseBadRequest("Each drug needs a quantity.")
+    try:
+        lines = [(int(pk), int(num)) for pk, num in zip(pks, nums)]
+        patient = Patient.objects.get(pk=int(request.POST['patient_pk']))
+        if request.POST.get('encounter'):
+            encounter = patient.encounter_set.get(
+                pk=int(request.POST['encounter']))
+        else:
+            encounter = patient.last_encounter()
+    except (KeyError, ValueError, ObjectDoesNotExist):
+        return HttpResponseBadRequest("Invalid patient, encounter or drugs.")
+    if encounter is None:
+        return HttpResponseBadRequest("This patient has no encounter.")
+
+    try:
+        if request.POST.get('fefo'):
+            # dispense the same drug, but from whichever lots expire first
+            lots = models.Drug.objects.in_bulk([pk for pk, _ in lines])
+            missing = [pk for pk, _ in lines if pk not in lots]
+            if missing:
+                raise dispensing.DispenseError(
+                    ["There is no drug with id %s." % pk for pk in missing])
+            dispensing.dispense_fefo(
+                [(lots[pk].name, lots[pk].dose, lots[pk].unit_id, num)
+                 for pk, num in lines],
+                encounter, author=request.user,
+                author_type=get_active_role(request))
+        else:
+            dispensing.dispense(lines, encounter, author=request.user,
+                                author_type=get_active_role(request))
+    except dispensing.DispenseError as e:
+        return HttpResponseBadRequest(format_html_join(
+            '\n', '<p>{}</p>', ((error,) for error in e.errors)))
     return redirect('inventory:drug-list')
 
 
+@active_permission_required('inventory.view_drug', raise_exception=True)
+def expiring_report(request):
+    '''Lots with stock left that have expired or will expire soon'''
+    try:
+        n_days = max(0, int(request.GET['days']))
+    except (KeyError, ValueError):
+        n_days = models.EXPIRING_SOON_DAYS
+
+    lots = models.Drug.objects.expiring_soon(n_days).\
+        select_related('unit', 'manufacturer').\
+        with_expiry_status()
+
+    return render(request, 'inventory/expiring_report.html', {
+        'lots': lots,
+        'n_days': n_days,
+    })
+
+@active_permission_required('inventory.export_csv', raise_exception=True)
+def stock_report(request):
+    '''Stock of each drug (name, dose and unit, over all lots) at a point in
+    time, with how fast it was dispensed over the days before and how long
+    the stock would last at that rate, from the stock ledger'''
+    try:
+        day = datetime.datetime.strptime(request.GET['date'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        day = timezone.localdate()
+    try:
+        n_days = max(1, int(request.GET['days']))
+    except (KeyError, ValueError):
+        n_days = settings.OSLER_INVENTORY_CONSUMPTION_DAYS
+
+    end = timezone.make_aware(datetime.datetime.combine(
+        day + datetime.timedelta(days=1), datetime.time.min))
+    start = end - datetime.timedelta(days=n_days)
+    lots = models.Drug.objects.order_by('name', 'dose', 'unit').\
+        with_ledger(end, stock='stock_then', dispensed='dispensed_then').\
+        with_ledger(start, stock=None, dispensed='dispensed_before').\
+        values_list('name', 'dose', 'unit', 'stock_then', 'dispensed_then',
+                    'dispensed_before')
+
+    rows = []
+    for (name, dose, unit), group in itertools.groupby(
+            lots.iterator(), key=lambda lot: lot[:3]):
+        stock = consumed = 0
+        for *_, stock_then, dispensed_then, dispensed_before in group:
+            stock += stock_then
+            consumed += dispensed_then - dispensed_before
+        per_day = consumed / n_days
+        days_left = stock / per_day if per_day else None
+        rows.append({
+            'name': name, 'dose': dose, 'unit': unit, 'stock': stock,
+            'consumed': consumed, 'per_day': per_day, 'days_left': days_left,
+            'reorder': days_left is not None and
+                days_left < settings.OSLER_INVENTORY_REORDER_DAYS,
+        })
+
+    return render(request, 'inventory/stock_report.html', {
+        'rows': rows,
+        'day': day,
+        'n_days': n_days,
+        'reorder_days': settings.OSLER_INVENTORY_REORDER_DAYS,
+    })
+
 @active_permission_required('inventory.export_csv', raise_exception=True)
 def export_csv(request):
-    '''Writes drug models to a new .csv file saved the project root-level folder'''
+    '''Streams all drugs as a .csv file, with the doses of each dispensed
+    over the last week'''
+    day_interval = timezone.make_aware(timezone.datetime.today() - datetime.timedelta(days=6))
+
+    # one grouped query for the whole formulary, rather than one per drug
     drugs = models.Drug.objects.\
         select_related('unit').\
         select_related('category').\
         select_related('manufacturer').\
+        annotate(dispensed_sum=Sum('dispensehistory__dispense',
+                 filter=Q(dispensehistory__written_datetime__gte=day_interval))).\
         order_by('category', 'name', 'dose', 'expiration_date')
 
-    day_interval = timezone.make_aware(timezone.datetime.today() - datetime.timedelta(days=6))
-    recently_dispensed = models.DispenseHistory.objects.filter(written_datetime__gte=day_interval)
-
-    with NamedTemporaryFile(mode='a+') as file:
-        writer = csv.writer(file)
-        header = ['Drug Name', 'Dosage', 'Unit', 'Category', 'Stock Remaining', 'Lot Number',
+    def rows():
+        yield ['Drug Name', 'Dosage', 'Unit', 'Category', 'Stock Remaining', 'Lot Number',
         'Expiration Date', 'Manufacturer', f"Doses Dispensed Since {format_date(str(day_interval.date()))}"]
-        writer.writerow(header)
-        for drug in drugs:
-            dispensed_list = list(recently_dispensed.filter(drug=drug.id).values_list('dispense', flat=True))
-            dispensed_sum = sum(dispensed_list)
-            if dispensed_sum == 0:
-                dispensed_sum = ""
-            writer.writerow(
-                [drug.name,
-                 drug.dose,
-                 drug.unit,
-                 drug.category,
-                 drug.stock,
-                 drug.lot_number,
-                 drug.expiration_date,                 
-                 drug.manufacturer,
-                 dispensed_sum
-                 ])
-        file.seek(0)
-        csvfileread = file.read()
+        for drug in drugs.iterator():
+            yield [drug.name,
+                   drug.dose,
+                   drug.unit,
+                   drug.category,
+                   drug.stock,
+                   drug.lot_number,
+                   drug.expiration_date,
+                   drug.manufacturer,
+                   drug.dispensed_sum or ""
+                   ]
 
     csv_filename = f"drug-inventory-{format_date(str(timezone.now().date()))}.csv"
-
-    response = HttpResponse(csvfileread, 'application/csv')
-    response["Content-Disposition"] = (
-        "attachment; filename=%s" % (csv_filename,))
-
-    return response
+    return utils.streaming_csv_response(rows(), csv_filename)
 
 @active_permission_required('inventory.export_csv', raise_exception=True)
 def export_dispensing_history(request):
+    '''Streams the drugs dispensed between start_date and end_date as a .csv
+    file, with the doses of each dispensed in that time'''
     start_date = request.POST.get('start_date')
     end_date = request.POST.get('end_date')
     tz_aware_start_date = timezone.make_aware(datetime.datetime.strptime(start_date, '%Y-%m-%d'))
     tz_aware_end_date = timezone.make_aware(datetime.datetime.strptime(end_date, '%Y-%m-%d'))
     tz_aware_end_date_plus_one = timezone.make_aware(datetime.datetime.strptime(end_date, '%Y-%m-%d') + datetime.timedelta(days=1))
 
-    recent_dispense_histories = models.DispenseHistory.objects.exclude(
-        written_datetime__gt=tz_aware_end_date_plus_one).filter(written_datetime__gte=tz_aware_start_date)
-
-    recently_dispensed_drugs = models.Drug.objects.filter(pk__in=list(recent_dispense_histories.values_list('drug', flat=True)))
-    recently_dispensed_drugs.select_related('unit').\
+    in_range = Q(dispensehistory__written_datetime__gte=tz_aware_start_date,
+                 dispensehistory__written_datetime__lte=tz_aware_end_date_plus_one)
+    recently_dispensed_drugs = models.Drug.objects.\
+        select_related('unit').\
         select_related('category').\
         select_related('manufacturer').\
+        annotate(dispensed_sum=Sum('dispensehistory__dispense', filter=in_range)).\
+        filter(dispensed_sum__isnull=False).\
         order_by('category', 'name', 'dose', 'expiration_date')
 
-    with NamedTemporaryFile(mode='a+') as file:
-        writer = csv.writer(file)
-        header = ['Drug Name', f"Doses Dispensed From: {format_date(str(tz_aware_start_date.date()))} - {format_date(str(tz_aware_end_date.date()))}", 
-                  'Stock Remaining ', 'Dosage', 'Unit', 'Category', 'Lot Number', 'Expiration Date', 'Manufacturer']
-        writer.writerow(header)
-        for drug in recently_dispensed_drugs:
-            dispensed_list = list(recent_dispense_histories.filter(drug=drug.id).values_list('dispense', flat=True))
-            dispensed_sum = sum(dispensed_list)
-            writer.writerow(
-                [drug.name,
-                dispensed_sum,
-                drug.stock,
-                drug.dose,
-                drug.unit,
-                drug.category,
-                drug.lot_number,
-                drug.expiration_date,                
-                drug.manufacturer
-                ])
-        file.seek(0)
-        csvfileread = file.read()
+    def rows():
+        yield ['Drug Name', f"Doses Dispensed From: {format_date(str(tz_aware_start_date.date()))} - {format_date(str(tz_aware_end_date.date()))}",
+               'Stock Remaining ', 'Dosage', 'Unit', 'Category', 'Lot Number', 'Expiration Date', 'Manufacturer']
+        for drug in recently_dispensed_drugs.iterator():
+            yield [drug.name,
+                   drug.dispensed_sum,
+                   drug.stock,
+                   drug.dose,
+                   drug.unit,
+                   drug.category,
+                   drug.lot_number,
+                   drug.expiration_date,
+                   drug.manufacturer
+                   ]
 
     csv_filename = f"drug-dispensing-history-through-{format_date(str(tz_aware_end_date.date()))}.csv"
-    response = HttpResponse(csvfileread, 'application/csv')
-    response["Content-Disposition"] = (
-        "attachment; filename=%s" % (csv_filename,))
-    redirect('inventory:drug-list')
-    return response
+    return utils.streaming_csv_response(rows(), csv_filename)
 
 def format_date(date):
     date_list = date.split("-")
@@ -0,0 +1,146 @@
+import datetime
+from itertools import groupby
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
+
+from osler.core.models import Patient
+from osler.labs.models import ContinuousMeasurement, ContinuousMeasurementType
+from osler.labs.utils import PERIOD_STARTS, aggregate_by_period, lttb
+
+
+def panic_flags(measurement_type, low, high):
+    """The (panic, panic_low) flags of values ranging from low to high,
+    as ContinuousMeasurement.panic() and panic_low() would give them."""
+    panic_low = (measurement_type.panic_lower is not None and
+                 low < measurement_type.panic_lower)
+    panic_high = (measurement_type.panic_upper is not None and
+                  high > measurement_type.panic_upper)
+    return panic_low or panic_high, panic_low
+
+
+def optional_float(value):
+    return float(value) if value is not None else None
+
+
+class LabSeriesViewSet(GenericViewSet):
+    """Time series of a patient's continuous lab measurements, for trend
+    graphs. The pk is that of the patient."""
+
+    queryset = Patient.objects.all()
+
+    def retrieve(self, request, pk=None):
+        """The patient's measurements of each requested type, oldest first.
+
+        Query parameters:
+            type: long name of a ContinuousMeasurementType; repeat it to
+                get several series at once, or leave it out to get every
+                type the patient has been measured for.
+            start, end: optional YYYY-MM-DD bounds on the lab day.
+            period: summarize each day, week, month, or year as count,
+                mean, min, and max instead of listing every measurement.
+            points: downsample each series to at most this many
+                measurements (at least 3) by largest-triangle-three-buckets.
+        """
+        patient = self.get_object()
+        params = request.query_params
+
+        names = params.getlist('type')
+        types = ContinuousMeasurementType.objects.all()
+        if names:
+            types = types.filter(pk__in=names)
+        types = {t.pk: t for t in types}
+        unknown = set(names) - set(types)
+        if unknown:
+            raise NotFound('Unknown measurement type: %s' %
+                           ', '.join(sorted(unknown)))
+
+        measurements = ContinuousMeasurement.objects \
+            .filter(lab__patient=patient, measurement_type__in=list(types)) \
+            .order_by('measurement_type_id', 'lab__lab_time', 'pk') \
+            .values_list('measurement_type', 'lab__lab_time', 'value')
+        for bound, lookup in [('start', 'gte'), ('end', 'lt')]:
+            if params.get(bound):
+                day = parse_date(params[bound])
+                if day is None:
+                    raise ValidationError({bound: 'Expected YYYY-MM-DD.'})
+                if bound == 'end':
+                    day += datetime.timedelta(days=1)
+                measurements = measurements.filter(**{
+                    'lab__lab_time__%s' % lookup: timezone.make_aware(
+                        datetime.datetime.combine(day, datetime.time.min))})
+
+        period = params.get('period')
+        if period is not None and period not in PERIOD_STARTS:
+            raise ValidationError(
+                {'period': 'Expected one of %s.' % ', '.join(PERIOD_STARTS)})
+
+        n_points = None
+        if params.get('points'):
+            try:
+                n_points = int(params['points'])
+            except ValueError:
+                raise ValidationError({'points': 'Expected an integer.'})
+            n_points = max(3, min(n_points, settings.OSLER_LAB_SERIES_MAX_POINTS))
+
+        series = []
+        found = set()
+        for name, rows in groupby(measurements, key=lambda row: row[0]):
+            found.add(name)
+            series.append(self.series(
+                types[name], [(time, value) for _, time, value in rows],
+                period, n_points))
+        # requested types without measurements still get an (empty) series
+        series.extend(self.series(types[name], [], period, n_points)
+                      for name in names if name not in found)
+
+        return Response(status=status.HTTP_200_OK, data={
+            'patient': patient.pk,
+            'series': series,
+        })
+
+    def series(self, measurement_type, rows, period, n_points):
+        """One measurement type's entry in the response, from its
+        (lab time, value) rows in time order."""
+
+        n_measurements = len(rows)
+        if period is not None:
+            to_tz = timezone.get_default_timezone()
+            aggregates = aggregate_by_period(
+                [(time.astimezone(to_tz).date(), value)
+                 for time, value in rows], period)
+            points = []
+            for start, count, mean, low, high in aggregates:
+                panic, panic_low = panic_flags(measurement_type, low, high)
+                points.append({
+                    'time': start.isoformat(), 'count': count,
+                    'mean': float(mean), 'min': float(low),
+                    'max': float(high), 'panic': panic,
+                    'panic_low': panic_low})
+        else:
+            if n_points is not None:
+                kept = lttb([(time.timestamp(), float(value))
+                             for time, value in rows], n_points)
+                rows = [rows[i] for i in kept]
+            points = []
+            for time, value in rows:
+                panic, panic_low = panic_flags(measurement_type, value, value)
+                points.append({
+                    'time': time.isoformat(), 'value': float(value),
+                    'panic': panic, 'panic_low': panic_low})
+
+        return {
+            'type': measurement_type.long_name,
+            'short_name': measurement_type.short_name,
+            'unit': measurement_type.get_unit(),
+            'panic_lower': optional_float(measurement_type.panic_lower),
+            'panic_upper': optional_float(measurement_type.panic_upper),
+            'count': n_measurements,
+            'points': points,
+        }
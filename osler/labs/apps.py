@@ -5,3 +5,6 @@ from django.utils.translation import gettext_lazy as _
 class LabsConfig(AppConfig):
     name = "osler.labs"
     verbose_name = _("Labs")
+
+    def ready(self):
+        import osler.labs.signals  # noqa F401
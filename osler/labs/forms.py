@@ -1,4 +1,4 @@
-from django.forms import (fields, ModelForm, Form, ModelChoiceField)
+from django.forms import (fields, ModelForm, Form, ModelChoiceField, FileField)
 from django.forms.models import model_to_dict, fields_for_model
 
 from django.forms.widgets import SplitDateTimeWidget
@@ -37,6 +37,32 @@ class LabCreationForm(ModelForm):
             Submit('choose-lab', 'Choose Lab', css_class='btn btn-success')
         )
 
+# Upload a CSV file of lab results (see osler.labs.imports)
+class LabImportForm(Form):
+    csv_file = FileField(label='CSV file',
+        help_text='One measurement per row, with columns patient, lab_type, '
+                  'lab_time, measurement, value, and optionally encounter.')
+
+    def __init__(self, *args, **kwargs):
+        super(LabImportForm, self).__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_method = 'post'
+        self.helper.add_input(Submit('import', 'Import', css_class='btn btn-success'))
+
+class DiscreteResultField(fields.ChoiceField):
+    """Choice of one of the DiscreteResultTypes allowed for a measurement
+    type, taken from the lab catalog rather than queried per field."""
+
+    def __init__(self, results, *args, **kwargs):
+        self.results = results
+        choices = [('', '---------')] + [(name, name) for name in sorted(results)]
+        super(DiscreteResultField, self).__init__(*args, choices=choices, **kwargs)
+
+    def clean(self, value):
+        name = super(DiscreteResultField, self).clean(value)
+        return self.results.get(name)
+
+
 # Fill in corresponding measurements in a lab object
 class MeasurementsCreationForm(Form):
 
@@ -50,6 +76,7 @@ class MeasurementsCreationForm(Form):
         super(MeasurementsCreationForm, self).__init__(*args, **kwargs)
 
         STYLE = 'width:400px;'
+        catalog = utils.get_lab_catalog()
 
         pt_info = Row(
                 HTML('<p>Patient name: <b>%s</b> </p>' %self.pt.name()),
@@ -59,21 +86,28 @@ class MeasurementsCreationForm(Form):
         self.fields['encounter'].queryset = Encounter.objects\
             .filter(patient=self.pt).order_by('clinic_day')
         self.fields['encounter'] = fields_for_model(models.Lab)['encounter']
+        self.fields['encounter'].queryset = Encounter.objects.select_related('patient')
         self.fields['encounter'].widget.attrs['style'] = 'width: 600px'
         self.fields_display.append(Field('encounter'))
 
         self.fields['lab_time'] = fields_for_model(models.Lab)['lab_time']
         self.fields['lab_time'].widget.attrs['style'] = STYLE
         self.fields_display.append(Field('lab_time'))
-        if self.lab_pk is not None:
-            self.fields['lab_time'].initial = models.Lab.objects.get(pk=self.lab_pk).lab_time
-            self.fields['encounter'].initial = models.Lab.objects.get(pk=self.lab_pk).encounter
 
-        self.measurements_list = []
+        # existing measurements, by (value type, measurement type pk)
+        self.lab = None
+        self.measurements = {}
         if self.lab_pk is not None:
-            self.measurements_list = utils.get_measurements_from_lab(self.lab_pk)
+            self.lab = get_object_or_404(models.Lab, pk=self.lab_pk)
+            self.fields['lab_time'].initial = self.lab.lab_time
+            self.fields['encounter'].initial = self.lab.encounter_id
+            for model, value_type in [(models.ContinuousMeasurement, 'Continuous'),
+                                      (models.DiscreteMeasurement, 'Discrete')]:
+                for measurement in model.objects.filter(lab=self.lab):
+                    self.measurements[(value_type, measurement.measurement_type_id)] = measurement
+        self.measurements_list = list(self.measurements.values())
 
-        self.measurementtypes_list = utils.get_measurementtypes_from_labtype(self.new_lab_type.id)
+        self.measurementtypes_list = catalog.measurement_types[self.new_lab_type.pk]
 
         for measurement_type in self.measurementtypes_list:
             str_name = measurement_type.short_name
@@ -84,16 +118,14 @@ class MeasurementsCreationForm(Form):
             if value_type=='Continuous': 
                 new_field = fields_for_model(models.ContinuousMeasurement)['value']
             elif value_type=='Discrete': 
-                new_field = fields_for_model(models.DiscreteMeasurement)['value']
-                new_field.queryset = models.DiscreteResultType.objects.filter(measurement_type=measurement_type)
+                new_field = DiscreteResultField(
+                    catalog.discrete_results[measurement_type.pk])
             new_field.label = str_name
             new_field.widget.attrs['style'] = STYLE
-            if self.lab_pk is not None:
-                try:
-                    #new_field.initial = self.measurements_list.get(measurement_type=measurement_type).value
-                    new_field.initial = next((mt.value for mt in self.measurements_list if mt.measurement_type == measurement_type), None)
-                except:
-                    pass
+            existing = self.measurements.get((value_type, measurement_type.pk))
+            if existing is not None:
+                new_field.initial = (existing.value if value_type == 'Continuous'
+                                     else existing.value_id)
 
             self.fields[str_name] = new_field
 
@@ -115,37 +147,66 @@ class MeasurementsCreationForm(Form):
 
         # Creating a new lab
         if self.lab_pk is None:
-            self.new_lab = models.Lab.objects.create(
-                patient = self.pt,
-                lab_type = self.new_lab_type,
-                lab_time = self.cleaned_data['lab_time'],
-                encounter = self.cleaned_data['encounter']
-                )
-
+            continuous, discrete = [], []
             for mt in self.measurementtypes_list:
                 if mt.get_value_type()=='Continuous':
-                    models.ContinuousMeasurement.objects.create(
+                    continuous.append(models.ContinuousMeasurement(
                         measurement_type = mt,
-                        lab = self.new_lab,
                         value = self.cleaned_data[mt.short_name]
-                    )
+                    ))
                 elif mt.get_value_type()=='Discrete':
-                    models.DiscreteMeasurement.objects.create(
+                    discrete.append(models.DiscreteMeasurement(
                         measurement_type = mt,
-                        lab = self.new_lab,
                         value = self.cleaned_data[mt.short_name]
-                    )
+                    ))
+            # bulk_create skips save(), so flag the measurements here
+            for measure in continuous + discrete:
+                measure.set_abnormal()
+
+            self.new_lab = models.Lab.objects.create(
+                patient = self.pt,
+                lab_type = self.new_lab_type,
+                lab_time = self.cleaned_data['lab_time'],
+                encounter = self.cleaned_data['encounter'],
+                has_abnormal = any(m.abnormal for m in continuous + discrete)
+                )
+            for measure in continuous + discrete:
+                measure.lab = self.new_lab
+            models.ContinuousMeasurement.objects.bulk_create(continuous)
+            models.DiscreteMeasurement.objects.bulk_create(discrete)
 
         # Updating an existing lab
         else:
-            self.new_lab = get_object_or_404(models.Lab, pk=self.lab_pk)
-            if self.cleaned_data['lab_time']!=self.new_lab.lab_time:
+            if self.lab is None or self.lab.pk != int(self.lab_pk):
+                self.lab = get_object_or_404(models.Lab, pk=self.lab_pk)
+            self.new_lab = self.lab
+
+            changed = {'Continuous': [], 'Discrete': []}
+            for mt in self.measurementtypes_list:
+                value_type = mt.get_value_type()
+                measure = self.measurements.get((value_type, mt.pk))
+                if measure is None:
+                    continue
+                value = self.cleaned_data[mt.short_name]
+                if value_type=='Continuous' and value!=measure.value:
+                    measure.value = value
+                    changed[value_type].append(measure)
+                elif value_type=='Discrete' and value.pk!=measure.value_id:
+                    measure.value = value
+                    changed[value_type].append(measure)
+                else:
+                    continue
+                measure.measurement_type = mt
+                measure.set_abnormal()
+            models.ContinuousMeasurement.objects.bulk_update(changed['Continuous'], ['value', 'abnormal'])
+            models.DiscreteMeasurement.objects.bulk_update(changed['Discrete'], ['value', 'abnormal'])
+
+            # every measurement of the lab is in self.measurements, so the
+            # lab's flag can be worked out without asking the database
+            has_abnormal = any(m.abnormal for m in self.measurements.values())
+            if (self.cleaned_data['lab_time']!=self.new_lab.lab_time or
+                    has_abnormal!=self.new_lab.has_abnormal):
                 self.new_lab.lab_time = self.cleaned_data['lab_time']
+                self.new_lab.has_abnormal = has_abnormal
                 self.new_lab.save()
-            measurement_list = self.measurements_list
-            for measure in measurement_list:
-                field_name = measure.measurement_type.short_name
-                if self.cleaned_data[field_name]!=measure.value:
-                    measure.value = self.cleaned_data[field_name]
-                    measure.save()
         return self.new_lab
@@ -0,0 +1,183 @@
+"""
+Bulk import of lab results from CSV files, e.g. as sent by an outside reference lab.
+
+Each row of a file is one measurement, with the columns
+
+	patient, lab_type, lab_time, measurement, value
+
+and optionally encounter. patient and encounter are pks, lab_type is the name of a LabType,
+measurement is the long or short name of one of its measurement types, and value is a number
+or the name of an allowed DiscreteResultType. Rows with the same patient, lab type, and lab
+time make up one lab, which is filed under the given encounter or else the patient's latest
+encounter on or before the lab day.
+"""
+import csv
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from osler.core.models import Encounter, Patient
+
+from . import models
+from .utils import get_lab_catalog
+
+COLUMNS = ['patient', 'lab_type', 'lab_time', 'measurement', 'value']
+
+
+class LabImportError(Exception):
+	"""
+	Raised with every problem found in a file, none of which has been saved
+	"""
+
+	def __init__(self, errors):
+		super(LabImportError, self).__init__('\n'.join(errors))
+		self.errors = errors
+
+
+def parse_pk(value):
+	try:
+		return int(value)
+	except (TypeError, ValueError):
+		return None
+
+
+def import_labs(lines, catalog=None):
+	"""
+	Validates every row of a CSV file (given as an iterable of lines of text), then saves
+	all of its labs and measurements with bulk_create in one transaction.
+	Returns the numbers of labs and measurements created; raises LabImportError if any row is invalid.
+	"""
+	if catalog is None:
+		catalog = get_lab_catalog()
+
+	reader = csv.DictReader(lines)
+	missing = [column for column in COLUMNS if column not in (reader.fieldnames or [])]
+	if missing:
+		raise LabImportError(['Missing columns: %s' % ', '.join(missing)])
+
+	value_field = models.ContinuousMeasurement._meta.get_field('value')
+	errors = []
+	rows = []
+	for line, row in enumerate(reader, start=2):
+		row = {column: (value or '').strip() for column, value in row.items() if column}
+
+		def error(message):
+			errors.append((line, message))
+
+		patient = parse_pk(row['patient'])
+		if patient is None:
+			error('patient must be a patient id, not "%s".' % row['patient'])
+
+		encounter = None
+		if row.get('encounter'):
+			encounter = parse_pk(row['encounter'])
+			if encounter is None:
+				error('encounter must be an encounter id, not "%s".' % row['encounter'])
+
+		lab_time = parse_datetime(row['lab_time'])
+		if lab_time is None:
+			error('lab_time "%s" is not a date and time.' % row['lab_time'])
+		elif timezone.is_naive(lab_time):
+			lab_time = timezone.make_aware(lab_time)
+
+		lab_type = catalog.lab_types_by_name.get(row['lab_type'])
+		if lab_type is None:
+			error('Unknown lab type "%s".' % row['lab_type'])
+			continue
+
+		measurement_type = catalog.measurement_type(lab_type, row['measurement'])
+		if measurement_type is None:
+			error('%s has no measurement "%s".' % (lab_type, row['measurement']))
+			continue
+
+		if measurement_type.get_value_type() == 'Continuous':
+			try:
+				value = value_field.clean(row['value'], None)
+			except ValidationError as e:
+				error('%s: %s' % (measurement_type, ' '.join(e.messages)))
+				continue
+		else:
+			value = catalog.discrete_results[measurement_type.pk].get(row['value'])
+			if value is None:
+				error('"%s" is not a result of %s.' % (row['value'], measurement_type))
+				continue
+
+		if errors and errors[-1][0] == line:
+			continue
+		rows.append((line, patient, encounter, lab_type, lab_time, measurement_type, value))
+
+	if not rows and not errors:
+		raise LabImportError(['The file has no measurements.'])
+
+	patients = {patient for _, patient, _, _, _, _, _ in rows}
+	known_patients = set(Patient.objects.filter(pk__in=patients).values_list('pk', flat=True))
+	# patient pk -> [(clinic day, encounter pk)], latest first
+	encounters = {}
+	for pk, patient, clinic_day in Encounter.objects.filter(patient__in=known_patients) \
+			.order_by('-clinic_day', '-pk').values_list('pk', 'patient', 'clinic_day'):
+		encounters.setdefault(patient, []).append((clinic_day, pk))
+	encounter_patients = dict((pk, patient) for patient, days in encounters.items() for _, pk in days)
+
+	labs = OrderedDict()
+	to_tz = timezone.get_default_timezone()
+	for line, patient, encounter, lab_type, lab_time, measurement_type, value in rows:
+		if patient not in known_patients:
+			errors.append((line, 'No patient with id %s.' % patient))
+			continue
+
+		if encounter is None:
+			day = lab_time.astimezone(to_tz).date()
+			encounter = next((pk for clinic_day, pk in encounters.get(patient, [])
+				if clinic_day <= day), None)
+			if encounter is None:
+				errors.append((line, 'Patient %s has no encounter on or before %s.' % (patient, day)))
+				continue
+		elif encounter_patients.get(encounter) != patient:
+			errors.append((line, 'Patient %s has no encounter with id %s.' % (patient, encounter)))
+			continue
+
+		lab, measurements = labs.setdefault((patient, lab_type.pk, lab_time), (
+			models.Lab(patient_id=patient, lab_type=lab_type, lab_time=lab_time, encounter_id=encounter),
+			OrderedDict()))
+		if measurement_type in measurements:
+			errors.append((line, '%s is given twice for this lab.' % measurement_type))
+			continue
+		measurements[measurement_type] = value
+
+	if errors:
+		raise LabImportError(['Line %s: %s' % error for error in sorted(errors)])
+
+	with transaction.atomic():
+		continuous, discrete = [], []
+		for lab, measurements in labs.values():
+			for measurement_type, value in measurements.items():
+				if measurement_type.get_value_type() == 'Continuous':
+					measurement = models.ContinuousMeasurement(
+						lab=lab, measurement_type=measurement_type, value=value)
+					continuous.append(measurement)
+				else:
+					measurement = models.DiscreteMeasurement(
+						lab=lab, measurement_type=measurement_type, value=value)
+					discrete.append(measurement)
+				# bulk_create skips save(), which would set the flag
+				measurement.set_abnormal()
+				lab.has_abnormal = lab.has_abnormal or bool(measurement.abnormal)
+
+		new_labs = [lab for lab, _ in labs.values()]
+		if connection.features.can_return_rows_from_bulk_insert:
+			models.Lab.objects.bulk_create(new_labs)
+		else:
+			# without primary keys back from bulk_create, there would be nothing to hang the measurements on
+			for lab in new_labs:
+				lab.save()
+
+		# the measurements were built before their labs had primary keys
+		for measurement in continuous + discrete:
+			measurement.lab_id = measurement.lab.pk
+		models.ContinuousMeasurement.objects.bulk_create(continuous)
+		models.DiscreteMeasurement.objects.bulk_create(discrete)
+
+	return len(new_labs), len(continuous) + len(discrete)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from osler.labs import models
+
+
+class Command(BaseCommand):
+    help = """Sets the abnormal flags of all measurements from their types'
+    current reference ranges, then the has_abnormal flags of all labs. New
+    and edited labs are flagged as they are saved, so this is only needed
+    once for labs from before the flags existed."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Update at most this many labs per transaction.")
+
+    def handle(self, *args, **options):
+        # one UPDATE per measurement type or result, however many
+        # measurements there are
+        for measurement_type in models.ContinuousMeasurementType.objects.all():
+            with transaction.atomic():
+                models.ContinuousMeasurement.objects.recompute_abnormal(
+                    measurement_type)
+        for result_type in models.DiscreteResultType.objects.all():
+            with transaction.atomic():
+                models.DiscreteMeasurement.objects.recompute_abnormal(
+                    result_type)
+
+        lab_pks = list(models.Lab.objects.order_by('pk')
+                       .values_list('pk', flat=True))
+        for i in range(0, len(lab_pks), options['batch_size']):
+            with transaction.atomic():
+                models.Lab.objects.filter(
+                    pk__in=lab_pks[i:i + options['batch_size']]
+                ).refresh_abnormal()
+
+        self.stdout.write("Flagged %s abnormal labs of %s." % (
+            models.Lab.objects.filter(has_abnormal=True).count(),
+            len(lab_pks)))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from osler.labs.imports import LabImportError, import_labs
+from osler.labs.utils import get_lab_catalog
+
+
+class Command(BaseCommand):
+    help = """Imports lab results from CSV files (see osler.labs.imports for
+    the format). Each file is validated in full and saved in its own
+    transaction, so a file with any bad row is skipped entirely."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help="CSV files to import.")
+
+    def handle(self, *args, **options):
+        catalog = get_lab_catalog()
+
+        failed = []
+        for path in options['files']:
+            try:
+                with open(path, newline='', encoding='utf-8-sig') as f:
+                    n_labs, n_measurements = import_labs(f, catalog)
+            except LabImportError as e:
+                failed.append(path)
+                self.stderr.write("%s was not imported:" % path)
+                for error in e.errors:
+                    self.stderr.write("  %s" % error)
+            else:
+                self.stdout.write("%s: imported %s labs with %s measurements." % (
+                    path, n_labs, n_measurements))
+
+        if failed:
+            raise CommandError("%s of %s files were not imported." % (
+                len(failed), len(options['files'])))
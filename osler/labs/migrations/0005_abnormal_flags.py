@@ -0,0 +1,45 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('labs', '0004_auto_20201209_2013'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='continuousmeasurement',
+            name='abnormal',
+            field=models.CharField(blank=True, choices=[('', 'Normal'), ('H', 'High'), ('L', 'Low'), ('A', 'Abnormal')], db_index=True, default='', editable=False, max_length=1),
+        ),
+        migrations.AddField(
+            model_name='discretemeasurement',
+            name='abnormal',
+            field=models.CharField(blank=True, choices=[('', 'Normal'), ('H', 'High'), ('L', 'Low'), ('A', 'Abnormal')], db_index=True, default='', editable=False, max_length=1),
+        ),
+        migrations.AddField(
+            model_name='lab',
+            name='has_abnormal',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='lab',
+            name='reviewed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reviewed_labs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='lab',
+            name='reviewed_datetime',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='lab',
+            index=models.Index(condition=models.Q(('has_abnormal', True), ('reviewed_datetime__isnull', True)), fields=['-lab_time', '-id'], name='labs_unreviewed_abnormal'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 import datetime
 
+from django.conf import settings
 from django.db import models
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
 from django.utils import timezone
 from django.core.validators import MaxValueValidator, MinValueValidator
 from osler.core.models import Patient, Encounter
@@ -21,8 +23,31 @@ class LabType(models.Model):
 		return self.name
 
 
+class LabQuerySet(models.QuerySet):
+
+	def refresh_abnormal(self):
+		"""
+		Recompute has_abnormal of these labs from the flags of their measurements, in one UPDATE
+		"""
+		def any_abnormal(model):
+			return Exists(model.objects.filter(lab=OuterRef('pk')).exclude(abnormal=''))
+
+		return self.update(has_abnormal=Case(
+			When(any_abnormal(ContinuousMeasurement), then=Value(True)),
+			When(any_abnormal(DiscreteMeasurement), then=Value(True)),
+			default=Value(False), output_field=models.BooleanField()))
+
+	def unreviewed_abnormal(self):
+		"""
+		Labs with an abnormal measurement that no one has marked reviewed, as served by the partial index on Lab
+		"""
+		return self.filter(has_abnormal=True, reviewed_datetime__isnull=True)
+
+
 class Lab(models.Model):
 	"""object of a lab panel"""
+	objects = LabQuerySet.as_manager()
+
 	patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
 
 	lab_time = models.DateTimeField(default=timezone.now)
@@ -31,8 +56,21 @@ class Lab(models.Model):
 
 	encounter = models.ForeignKey(Encounter, on_delete=models.CASCADE)
 
+	# whether any measurement is flagged abnormal; kept current by osler.labs.signals, by the bulk
+	# writers (MeasurementsCreationForm.save and import_labs), which set it from the flags
+	# set_abnormal() gives the measurements they write, and by the backfill_abnormal_labs command
+	has_abnormal = models.BooleanField(default=False, editable=False)
+
+	reviewed_by = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True,
+		on_delete=models.SET_NULL, related_name='reviewed_labs')
+	reviewed_datetime = models.DateTimeField(blank=True, null=True)
+
 	class Meta:
 		ordering = ['-lab_time']
+		indexes = [
+			models.Index(fields=['-lab_time', '-id'], name='labs_unreviewed_abnormal',
+				condition=Q(has_abnormal=True, reviewed_datetime__isnull=True)),
+		]
 
 	def __str__(self):
 		to_tz = timezone.get_default_timezone()
@@ -127,13 +165,64 @@ class Measurement(models.Model):
 	class Meta:
 		abstract = True
 
+	HIGH = 'H'
+	LOW = 'L'
+	ABNORMAL = 'A'
+	ABNORMAL_CHOICES = (
+		('', 'Normal'),
+		(HIGH, 'High'),
+		(LOW, 'Low'),
+		(ABNORMAL, 'Abnormal'),
+	)
+
 	lab = models.ForeignKey(Lab, on_delete=models.CASCADE)
 
+	# panic() as of the last save (or reference range change), so abnormal results can be found by query
+	abnormal = models.CharField(max_length=1, choices=ABNORMAL_CHOICES, blank=True, default='',
+		db_index=True, editable=False)
+
+	def set_abnormal(self):
+		"""
+		Set the abnormal flag from the value; bulk writers must call this themselves
+		"""
+		if self.panic_low():
+			self.abnormal = self.LOW
+		elif self.panic():
+			self.abnormal = self.panic_flag
+		else:
+			self.abnormal = ''
+
+	def save(self, *args, **kwargs):
+		self.set_abnormal()
+		super(Measurement, self).save(*args, **kwargs)
+
+
+class ContinuousMeasurementQuerySet(models.QuerySet):
+
+	def recompute_abnormal(self, measurement_type):
+		"""
+		Re-flag these measurements of measurement_type against its current reference range, in one UPDATE
+		"""
+		high_or_low = []
+		if measurement_type.panic_lower is not None:
+			high_or_low.append(When(value__lt=measurement_type.panic_lower, then=Value(Measurement.LOW)))
+		if measurement_type.panic_upper is not None:
+			high_or_low.append(When(value__gt=measurement_type.panic_upper, then=Value(Measurement.HIGH)))
+
+		measurements = self.filter(measurement_type=measurement_type)
+		if not high_or_low:
+			return measurements.update(abnormal='')
+		return measurements.update(abnormal=Case(*high_or_low, default=Value(''),
+			output_field=models.CharField()))
+
 
 class ContinuousMeasurement(Measurement):
 	"""
 	object of a continuous measurement
 	"""
+	objects = ContinuousMeasurementQuerySet.as_manager()
+	panic_flag = Measurement.HIGH
+
 	measurement_type = models.ForeignKey(ContinuousMeasurementType, on_delete=models.PROTECT)
 	value = models.DecimalField(max_digits=7, decimal_places=3)
 
@@ -184,10 +273,23 @@ class DiscreteResultType(models.Model):
 		return self.name
 
 
+class DiscreteMeasurementQuerySet(models.QuerySet):
+
+	def recompute_abnormal(self, result_type):
+		"""
+		Re-flag these measurements with the result result_type according to its is_panic, in one UPDATE
+		"""
+		return self.filter(value=result_type).update(
+			abnormal=Measurement.ABNORMAL if result_type.is_panic == 'T' else '')
+
+
 class DiscreteMeasurement(Measurement):
 	"""
 	object of a discrete measurement
 	"""
+	objects = DiscreteMeasurementQuerySet.as_manager()
+	panic_flag = Measurement.ABNORMAL
+
 	measurement_type = models.ForeignKey(DiscreteMeasurementType, on_delete=models.PROTECT)
 	value = models.ForeignKey(DiscreteResultType, on_delete=models.PROTECT)
 
@@ -0,0 +1,55 @@
+"""Signal handlers that keep the lab catalog in osler.labs.utils and the
+abnormal flags on measurements and labs current."""
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from osler.labs import models
+from osler.labs.utils import invalidate_lab_catalog
+
+
+def catalog_changed(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_lab_catalog()
+
+
+m2m_changed.connect(catalog_changed,
+                    sender=models.DiscreteResultType.measurement_type.through,
+                    dispatch_uid='lab_catalog_results_changed')
+for model in [models.LabType, models.ContinuousMeasurementType,
+              models.DiscreteMeasurementType, models.DiscreteResultType]:
+    post_save.connect(catalog_changed, sender=model,
+                      dispatch_uid='lab_catalog_save_%s' % model.__name__)
+    post_delete.connect(catalog_changed, sender=model,
+                        dispatch_uid='lab_catalog_delete_%s' % model.__name__)
+
+
+def reference_range_changed(sender, instance, created, **kwargs):
+    """Re-flag the measurements a changed reference range (or abnormal
+    result) applies to, and the labs they belong to."""
+    if created:
+        return
+
+    if sender is models.ContinuousMeasurementType:
+        models.ContinuousMeasurement.objects.recompute_abnormal(instance)
+        labs = models.Lab.objects.filter(
+            continuousmeasurement__measurement_type=instance)
+    else:
+        models.DiscreteMeasurement.objects.recompute_abnormal(instance)
+        labs = models.Lab.objects.filter(discretemeasurement__value=instance)
+    labs.refresh_abnormal()
+
+post_save.connect(reference_range_changed,
+                  sender=models.ContinuousMeasurementType,
+                  dispatch_uid='abnormal_flags_range_changed')
+post_save.connect(reference_range_changed, sender=models.DiscreteResultType,
+                  dispatch_uid='abnormal_flags_result_changed')
+
+
+def measurement_changed(sender, instance, **kwargs):
+    models.Lab.objects.filter(pk=instance.lab_id).refresh_abnormal()
+
+
+for model in [models.ContinuousMeasurement, models.DiscreteMeasurement]:
+    post_save.connect(measurement_changed, sender=model,
+                      dispatch_uid='abnormal_flags_save_%s' % model.__name__)
+    post_delete.connect(measurement_changed, sender=model,
+                        dispatch_uid='abnormal_flags_delete_%s' % model.__name__)
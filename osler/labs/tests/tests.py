@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import io
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, resolve
 from django.shortcuts import redirect
 from osler.labs.models import Lab, LabType, ContinuousMeasurement, DiscreteMeasurement, DiscreteResultType, ContinuousMeasurementType, DiscreteMeasurementType
@@ -11,8 +18,9 @@ from osler.core.tests import factories as core_factories
 from osler.users.tests import factories as user_factories
 from osler.labs.tests import factories
 
-from osler.labs import views, forms
-from django.utils.timezone import now
+from osler.labs import views, forms, utils
+from osler.labs.imports import LabImportError, import_labs
+from django.utils.timezone import localtime, now
 
 from django.shortcuts import get_object_or_404
 
@@ -244,6 +252,47 @@ class TestMeasurementsCreationForm(TestCase):
         assert new_pH.value, new_pH_value
 
 
+    def test_save_queries(self):
+        """Saving costs the same few queries however many measurements the
+        lab type has"""
+        for i in range(20):
+            factories.ContinuousMeasurementTypeFactory(
+                short_name='analyte%s' % i, lab_type=self.ua)
+            self.form_data['analyte%s' % i] = i
+
+        form = forms.MeasurementsCreationForm(new_lab_type=self.ua,
+            pt=self.pt, data=self.form_data)
+        assert form.is_valid()
+        with CaptureQueriesContext(connection) as queries:
+            lab = form.save()
+        assert len(queries) <= 4
+        assert ContinuousMeasurement.objects.filter(lab=lab).count() == 22
+
+        self.form_data['analyte3'] = 30
+        self.form_data['blood'] = self.disc_result_pos
+        edit = forms.MeasurementsCreationForm(new_lab_type=self.ua,
+            pt=self.pt, lab_pk=lab.pk, data=self.form_data)
+        assert edit.is_valid()
+        with CaptureQueriesContext(connection) as queries:
+            edit.save(lab_pk=lab.pk)
+        assert len(queries) <= 4
+        assert lab.continuousmeasurement_set.get(
+            measurement_type__short_name='analyte3').value == 30
+        assert lab.discretemeasurement_set.get().value == self.disc_result_pos
+
+    def test_catalog_invalidated(self):
+        """Changes to lab types show up in the next form"""
+        forms.MeasurementsCreationForm(new_lab_type=self.ua, pt=self.pt)
+        factories.ContinuousMeasurementTypeFactory(
+            short_name='nitrite', lab_type=self.ua)
+        form = forms.MeasurementsCreationForm(new_lab_type=self.ua, pt=self.pt)
+        assert 'nitrite' in form.fields
+
+        self.disc_result_pos.measurement_type.clear()
+        form = forms.MeasurementsCreationForm(new_lab_type=self.ua, pt=self.pt)
+        assert [c for c, _ in form.fields['blood'].choices] == ['', 'neg']
+
+
 class TestLabView(TestCase):
     """
     Test all views in lab
@@ -306,6 +355,54 @@ class TestLabView(TestCase):
         assert response.status_code == 200
 
 
+    def add_lab(self, lab_time, ph):
+        lab = factories.LabFactory(patient=self.pt, lab_type=self.ua,
+                                   lab_time=lab_time,
+                                   encounter=self.lab.encounter)
+        factories.ContinuousMeasurementFactory(
+            measurement_type=self.ua_pH, lab=lab, value=ph)
+        return lab
+
+    def get_table(self):
+        url = reverse('labs:all-labs-table', kwargs={'pt_id':self.pt.id})
+        return self.client.get(url).context
+
+    def test_lab_table_content(self):
+        """Labs are pivoted into one column per day, showing the latest
+        value when several labs fall on the same day"""
+        # at noon, so that labs minutes apart share a day
+        self.lab.lab_time = localtime().replace(hour=12, minute=0)
+        self.lab.save()
+        self.add_lab(self.lab.lab_time - timedelta(days=3), 6)
+        self.add_lab(self.lab.lab_time + timedelta(minutes=5), 7)
+
+        context = self.get_table()
+        [section] = context['table_content']
+        header, ph_row, glucose_row, blood_row = section
+
+        today, earlier = self.lab.get_day(), self.lab.get_day() - timedelta(days=3)
+        assert header == ['Lab Category: Urinalysis', 'Reference',
+                          str(today) + '*', str(earlier)]
+        assert context['dup_lab_bool']
+        assert ph_row[0] == self.ua_pH
+        assert [m.value for m in ph_row[2:]] == [7, 6]
+        assert glucose_row[3] == ''
+        assert blood_row[2].lab == self.lab
+        assert not context['no_lab_bool']
+
+    def test_lab_table_queries(self):
+        """The number of queries doesn't depend on the number of labs"""
+        self.get_table()
+        with CaptureQueriesContext(connection) as one_lab:
+            self.get_table()
+
+        for days_ago in range(1, 6):
+            self.add_lab(self.lab.lab_time - timedelta(days=days_ago), 6)
+        with CaptureQueriesContext(connection) as many_labs:
+            self.get_table()
+
+        assert len(many_labs) == len(one_lab)
+
     def test_lab_detail_view(self):
         """Any user able to view all lab table view"""
         lab = self.lab
@@ -389,4 +486,279 @@ class TestLabView(TestCase):
         lab = self.lab
         url = reverse('labs:lab-edit', kwargs={'pk':lab.id})
         response = self.client.get(url, follow=True)
-        assert response.status_code == 403
\ No newline at end of file
+        assert response.status_code == 403
+
+class TestLabSeries(TestCase):
+
+    def setUp(self):
+        self.bmp = factories.LabTypeFactory(name='BMP')
+        self.creatinine = factories.ContinuousMeasurementTypeFactory(
+            long_name='Creatinine', short_name='Cr', lab_type=self.bmp,
+            unit='mg/dL', panic_lower=0.5, panic_upper=1.2)
+        self.potassium = factories.ContinuousMeasurementTypeFactory(
+            long_name='Potassium', short_name='K', lab_type=self.bmp)
+
+        self.pt = core_factories.PatientFactory()
+        encounter = core_factories.EncounterFactory(patient=self.pt)
+        start = now() - timedelta(days=400)
+        self.values = [0.4, 0.9, 1.0, 1.5, 1.1, 0.8]
+        for i, value in enumerate(self.values):
+            lab = factories.LabFactory(
+                patient=self.pt, lab_type=self.bmp, encounter=encounter,
+                lab_time=start + timedelta(days=60 * i))
+            factories.ContinuousMeasurementFactory(
+                lab=lab, measurement_type=self.creatinine, value=value)
+            factories.ContinuousMeasurementFactory(
+                lab=lab, measurement_type=self.potassium, value=4)
+
+        log_in_user(self.client, build_user())
+        self.url = reverse('api:lab-series-detail', args=(self.pt.pk,))
+
+    def test_series(self):
+        response = self.client.get(self.url, {'type': 'Creatinine'})
+        assert response.status_code == 200
+
+        [series] = response.data['series']
+        assert series['type'] == 'Creatinine'
+        assert series['unit'] == 'mg/dL'
+        assert series['count'] == 6
+        assert [p['value'] for p in series['points']] == self.values
+        assert [p['panic'] for p in series['points']] == \
+            [True, False, False, True, False, False]
+        assert series['points'][0]['panic_low']
+
+    def test_batch(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        # one query for the types and one for all their measurements
+        assert len([q for q in queries if 'labs_' in q['sql']]) == 2
+        assert sorted(s['type'] for s in response.data['series']) == \
+            ['Creatinine', 'Potassium']
+
+        response = self.client.get(
+            self.url + '?type=Creatinine&type=Potassium&type=Nope')
+        assert response.status_code == 404
+
+    def test_downsampling(self):
+        response = self.client.get(
+            self.url, {'type': 'Creatinine', 'points': 4})
+        [series] = response.data['series']
+        values = [p['value'] for p in series['points']]
+        assert len(values) == 4
+        assert values[0] == 0.4 and values[-1] == 0.8
+        # the peak survives
+        assert 1.5 in values
+
+        response = self.client.get(
+            self.url, {'type': 'Creatinine', 'period': 'year'})
+        points = response.data['series'][0]['points']
+        assert sum(p['count'] for p in points) == 6
+        assert any(p['max'] == 1.5 and p['panic'] for p in points)
+
+        response = self.client.get(self.url, {'period': 'decade'})
+        assert response.status_code == 400
+
+    def test_lttb(self):
+        points = [(x, 0) for x in range(100)]
+        points[37] = (37, 10)
+        kept = utils.lttb(points, 10)
+        assert len(kept) == 10
+        assert kept[0] == 0 and kept[-1] == 99
+        assert 37 in kept
+        assert utils.lttb(points[:5], 10) == list(range(5))
+
+
+class TestLabImport(TestCase):
+
+    def setUp(self):
+        self.ua = factories.LabTypeFactory(name='Urinalysis')
+        self.ph = factories.ContinuousMeasurementTypeFactory(
+            long_name='Urine pH', short_name='pH', lab_type=self.ua)
+        self.blood = factories.DiscreteMeasurementTypeFactory(
+            long_name='Urine blood', short_name='blood', lab_type=self.ua)
+        self.neg = factories.DiscreteResultTypeFactory(name='neg')
+        self.neg.measurement_type.set([self.blood])
+
+        self.pt = core_factories.PatientFactory()
+        self.encounter = core_factories.EncounterFactory(
+            patient=self.pt, clinic_day=now().date() - timedelta(days=10))
+
+        day = (now() - timedelta(days=5)).strftime('%Y-%m-%d')
+        self.rows = [
+            'patient,lab_type,lab_time,measurement,value',
+            '%s,Urinalysis,%s 09:00,Urine pH,6.5' % (self.pt.pk, day),
+            '%s,Urinalysis,%s 09:00,blood,neg' % (self.pt.pk, day),
+            '%s,Urinalysis,%s 10:00,pH,7' % (self.pt.pk, day),
+        ]
+
+    def test_import(self):
+        n_labs, n_measurements = import_labs(self.rows)
+
+        assert (n_labs, n_measurements) == (2, 3)
+        labs = Lab.objects.filter(patient=self.pt).order_by('lab_time')
+        assert [lab.encounter for lab in labs] == [self.encounter] * 2
+        assert labs[0].continuousmeasurement_set.get().value == 6.5
+        assert labs[0].discretemeasurement_set.get().value == self.neg
+
+    def test_invalid_rows_import_nothing(self):
+        rows = self.rows + [
+            '%s,Urinalysis,yesterday,pH,7' % self.pt.pk,
+            '%s,Urinalysis,2020-01-01 09:00,blood,purple' % self.pt.pk,
+            '%s,CBC,2020-01-01 09:00,WBC,5' % self.pt.pk,
+            '0,Urinalysis,2020-01-01 09:00,pH,5',
+        ]
+        with self.assertRaises(LabImportError) as raised:
+            import_labs(rows)
+
+        assert [e.split(':')[0] for e in raised.exception.errors] == \
+            ['Line 5', 'Line 6', 'Line 7', 'Line 8']
+        assert not Lab.objects.exists()
+
+    def test_upload_view(self):
+        url = reverse('labs:lab-import')
+        log_in_user(self.client, build_user([user_factories.NoPermGroupFactory]))
+        assert self.client.get(url).status_code == 403
+
+        log_in_user(self.client, build_user([user_factories.CaseManagerGroupFactory]))
+        upload = SimpleUploadedFile(
+            'labs.csv', '\n'.join(self.rows).encode('utf-8'))
+        response = self.client.post(url, {'csv_file': upload})
+        assert response.status_code == 200
+        assert response.context['n_measurements'] == 3
+
+        upload = SimpleUploadedFile('labs.csv', b'patient,value\n1,2')
+        response = self.client.post(url, {'csv_file': upload})
+        assert response.context['form'].errors
+        assert Lab.objects.count() == 2
+
+
+class TestAbnormalFlags(TestCase):
+
+    def setUp(self):
+        self.ua = factories.LabTypeFactory(name='Urinalysis')
+        self.ph = factories.ContinuousMeasurementTypeFactory(
+            long_name='Urine pH', short_name='pH', lab_type=self.ua,
+            panic_lower=5, panic_upper=8)
+        self.blood = factories.DiscreteMeasurementTypeFactory(
+            long_name='Urine blood', short_name='blood', lab_type=self.ua)
+        self.neg = factories.DiscreteResultTypeFactory(name='neg', is_panic='F')
+        self.pos = factories.DiscreteResultTypeFactory(name='pos', is_panic='T')
+        for result in [self.neg, self.pos]:
+            result.measurement_type.set([self.blood])
+
+        self.pt = core_factories.PatientFactory()
+
+    def make_lab(self, ph, blood, **kwargs):
+        lab = factories.LabFactory(patient=self.pt, lab_type=self.ua, **kwargs)
+        factories.ContinuousMeasurementFactory(
+            lab=lab, measurement_type=self.ph, value=ph)
+        factories.DiscreteMeasurementFactory(
+            lab=lab, measurement_type=self.blood, value=blood)
+        lab.refresh_from_db()
+        return lab
+
+    def test_flags_on_save(self):
+        lab = self.make_lab(4, self.neg)
+        assert lab.has_abnormal
+        assert lab.continuousmeasurement_set.get().abnormal == 'L'
+        assert lab.discretemeasurement_set.get().abnormal == ''
+
+        measurement = lab.continuousmeasurement_set.get()
+        measurement.value = 9
+        measurement.save()
+        assert measurement.abnormal == 'H'
+
+        measurement.value = 7
+        measurement.save()
+        lab.refresh_from_db()
+        assert not lab.has_abnormal
+
+        discrete = lab.discretemeasurement_set.get()
+        discrete.value = self.pos
+        discrete.save()
+        lab.refresh_from_db()
+        assert discrete.abnormal == 'A'
+        assert lab.has_abnormal
+
+        discrete.delete()
+        lab.refresh_from_db()
+        assert not lab.has_abnormal
+
+    def test_reference_range_change(self):
+        lab = self.make_lab(7, self.neg)
+        assert not lab.has_abnormal
+
+        self.ph.panic_upper = 6.5
+        self.ph.save()
+        lab.refresh_from_db()
+        assert lab.has_abnormal
+        assert lab.continuousmeasurement_set.get().abnormal == 'H'
+
+        self.ph.panic_upper = None
+        self.ph.save()
+        self.neg.is_panic = 'T'
+        self.neg.save()
+        lab.refresh_from_db()
+        assert lab.has_abnormal
+        assert lab.continuousmeasurement_set.get().abnormal == ''
+        assert lab.discretemeasurement_set.get().abnormal == 'A'
+
+    def test_form_and_import_flag(self):
+        form = forms.MeasurementsCreationForm(new_lab_type=self.ua, pt=self.pt,
+            data={'lab_time': now(),
+                  'encounter': core_factories.EncounterFactory(patient=self.pt).pk,
+                  'pH': 9, 'blood': self.neg})
+        assert form.is_valid()
+        lab = form.save()
+        assert lab.has_abnormal
+        assert lab.continuousmeasurement_set.get().abnormal == 'H'
+
+        day = (now() - timedelta(days=5)).strftime('%Y-%m-%d')
+        import_labs([
+            'patient,lab_type,lab_time,measurement,value,encounter',
+            '%s,Urinalysis,%s 09:00,pH,6,%s' % (self.pt.pk, day, lab.encounter_id),
+            '%s,Urinalysis,%s 09:00,blood,pos,%s' % (self.pt.pk, day, lab.encounter_id),
+        ])
+        imported = Lab.objects.exclude(pk=lab.pk).get()
+        assert imported.has_abnormal
+        assert imported.discretemeasurement_set.get().abnormal == 'A'
+
+    def test_backfill(self):
+        lab = self.make_lab(9, self.neg)
+        ContinuousMeasurement.objects.update(abnormal='')
+        Lab.objects.update(has_abnormal=False)
+
+        call_command('backfill_abnormal_labs', stdout=io.StringIO())
+        lab.refresh_from_db()
+        assert lab.has_abnormal
+        assert lab.continuousmeasurement_set.get().abnormal == 'H'
+
+    def test_worklist(self):
+        normal = self.make_lab(7, self.neg)
+        abnormal = [self.make_lab(9, self.neg, lab_time=now() - timedelta(hours=i))
+                    for i in range(3)]
+
+        url = reverse('labs:abnormal-worklist')
+        log_in_user(self.client, build_user([user_factories.NoPermGroupFactory]))
+        assert self.client.get(url).status_code == 403
+
+        log_in_user(self.client, build_user([user_factories.CaseManagerGroupFactory]))
+        with self.settings(OSLER_LAB_WORKLIST_PAGE_SIZE=2):
+            response = self.client.get(url)
+            assert response.context['labs'] == abnormal[:2]
+            assert normal not in response.context['labs']
+            assert [m.abnormal for m in response.context['labs'][0].abnormal_continuous] == ['H']
+
+            response = self.client.get(url, {'after': response.context['next_cursor']})
+            assert response.context['labs'] == abnormal[2:]
+            assert response.context['next_cursor'] is None
+
+        response = self.client.post(reverse('labs:lab-reviewed', args=(abnormal[0].pk,)))
+        assert response.status_code == 302
+        abnormal[0].refresh_from_db()
+        assert abnormal[0].reviewed_datetime is not None
+        assert list(Lab.objects.unreviewed_abnormal()) == abnormal[1:]
+
+        log_in_user(self.client, build_user([user_factories.NoPermGroupFactory]))
+        response = self.client.post(reverse('labs:lab-reviewed', args=(abnormal[1].pk,)))
+        assert response.status_code == 403
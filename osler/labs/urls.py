@@ -29,4 +29,13 @@ urlpatterns = [
     re_path(r'^edit/(?P<pk>[0-9]+)/$',
         views.MeasurementsEdit.as_view(),
         name='lab-edit'),
+    re_path(r'^import/$',
+        views.LabImport.as_view(),
+        name='lab-import'),
+    re_path(r'^abnormal/$',
+        views.abnormal_worklist,
+        name='abnormal-worklist'),
+    re_path(r'^(?P<pk>[0-9]+)/reviewed/$',
+        views.mark_reviewed,
+        name='lab-reviewed'),
 ]
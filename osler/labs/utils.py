@@ -1,9 +1,13 @@
 from . import models
 
+import datetime
+from collections import defaultdict
 from itertools import chain
 from operator import attrgetter
 from django.shortcuts import get_object_or_404
 
+from osler.core.process_cache import VersionedProcessCache
+
 
 def get_measurements_from_lab(lab_id):
 	"""
@@ -24,4 +28,183 @@ def get_measurementtypes_from_labtype(labtype_id):
 	cont_list = models.ContinuousMeasurementType.objects.filter(lab_type=labtype)
 	disc_list = models.DiscreteMeasurementType.objects.filter(lab_type=labtype)
 	measurementtype_list = sorted(chain(cont_list,disc_list), key=attrgetter('order_index'))
-	return measurementtype_list
\ No newline at end of file
+	return measurementtype_list
+
+
+def measurement_key(measurement_type):
+	"""
+	Identifies a measurement type of either kind; continuous and discrete types can share a long_name
+	"""
+	return (measurement_type.get_value_type(), measurement_type.pk)
+
+
+def build_lab_table(pt_id, since):
+	"""
+	Pivots all measurements from the patient's labs after since into the table shown by view_all_as_table.
+	Returns (table_content, has_duplicates, has_labs), where table_content is a list of sections, one per lab type,
+	each a header row ['Lab Category: <type>', 'Reference', <day>, ...] followed by a row
+	[<measurement type>, <reference>, <measurement or ''>, ...] per measurement type.
+	Where several labs share a day, the latest value is shown and the day is starred in the section header.
+
+	Measurements of each kind are fetched in one joined query, and cells are placed through dicts keyed
+	by (measurement type, day), so the cost is linear in the number of measurements however many labs there are.
+	"""
+	measurements = []
+	for model, related in [(models.ContinuousMeasurement, ['lab', 'measurement_type']),
+			(models.DiscreteMeasurement, ['lab', 'measurement_type', 'value'])]:
+		measurements.extend(model.objects
+			.filter(lab__patient=pt_id, lab__lab_time__gt=since)
+			.select_related(*related))
+	# oldest first, so that the latest value on a day ends up in its cell
+	measurements.sort(key=lambda m: (m.lab.lab_time, m.lab.pk))
+
+	lab_days = {}
+	cells = {}
+	duplicated = set()
+	for m in measurements:
+		if m.lab_id not in lab_days:
+			lab_days[m.lab_id] = m.lab.get_day()
+		day = lab_days[m.lab_id]
+		key = (measurement_key(m.measurement_type), day)
+		previous = cells.get(key)
+		if previous is not None and previous.lab_id != m.lab_id:
+			duplicated.add((m.measurement_type.lab_type_id, day))
+		cells[key] = m
+
+	days = sorted(set(lab_days.values()), reverse=True)
+
+	types_by_lab_type = defaultdict(list)
+	for measurement_type in chain(models.ContinuousMeasurementType.objects.all(),
+			models.DiscreteMeasurementType.objects.all()):
+		types_by_lab_type[measurement_type.lab_type_id].append(measurement_type)
+
+	table_content = []
+	for lab_type in models.LabType.objects.all():
+		header = ['Lab Category: ' + str(lab_type), 'Reference']
+		header += [str(day) + ('*' if (lab_type.pk, day) in duplicated else '') for day in days]
+		section = [header]
+		for measurement_type in sorted(types_by_lab_type[lab_type.pk], key=attrgetter('order_index')):
+			key = measurement_key(measurement_type)
+			section.append([measurement_type, measurement_type.get_ref()] +
+				[cells.get((key, day), '') for day in days])
+		table_content.append(section)
+
+	return table_content, len(duplicated) > 0, len(lab_days) > 0
+
+
+def lttb(points, n_out):
+	"""
+	Downsamples points, a list of (x, y) number pairs sorted by x, to n_out of them (at least 3) with the
+	Largest-Triangle-Three-Buckets algorithm, which keeps the shape of the series, peaks included.
+	Returns the indexes of the points kept, in order.
+	"""
+	n = len(points)
+	if n <= n_out:
+		return list(range(n))
+
+	# the first and last points are always kept; the rest are split into n_out - 2 buckets,
+	# from each of which we keep the point making the largest triangle with the point kept
+	# from the previous bucket and the average of the next one
+	every = (n - 2) / (n_out - 2)
+	kept = [0]
+	for i in range(n_out - 2):
+		next_start = int((i + 1) * every) + 1
+		next_end = min(int((i + 2) * every) + 1, n)
+		next_bucket = points[next_start:next_end]
+		avg_x = sum(x for x, y in next_bucket) / len(next_bucket)
+		avg_y = sum(y for x, y in next_bucket) / len(next_bucket)
+
+		a_x, a_y = points[kept[-1]]
+		best, best_area = None, -1
+		for j in range(int(i * every) + 1, next_start):
+			x, y = points[j]
+			area = abs((a_x - avg_x) * (y - a_y) - (a_x - x) * (avg_y - a_y))
+			if area > best_area:
+				best, best_area = j, area
+		kept.append(best)
+	kept.append(n - 1)
+
+	return kept
+
+
+# functions from a day to the first day of the period containing it
+PERIOD_STARTS = {
+	'day': lambda day: day,
+	'week': lambda day: day - datetime.timedelta(days=day.weekday()),
+	'month': lambda day: day.replace(day=1),
+	'year': lambda day: day.replace(month=1, day=1),
+}
+
+
+def aggregate_by_period(points, period):
+	"""
+	Summarizes points, a list of (day, value) pairs sorted by day, per period (a key of PERIOD_STARTS).
+	Returns a list of (period start, count, mean, min, max) tuples.
+	"""
+	period_start = PERIOD_STARTS[period]
+	aggregates = []
+	for day, value in points:
+		start = period_start(day)
+		if aggregates and aggregates[-1][0] == start:
+			start, count, total, low, high = aggregates[-1]
+			aggregates[-1] = (start, count + 1, total + value, min(low, value), max(high, value))
+		else:
+			aggregates.append((start, 1, value, value, value))
+
+	return [(start, count, total / count, low, high) for start, count, total, low, high in aggregates]
+
+
+class LabCatalog(object):
+	"""
+	Every lab type, measurement type, and allowed discrete result, loaded in four queries
+	"""
+
+	def __init__(self):
+		self.lab_types = {lab_type.pk: lab_type for lab_type in models.LabType.objects.all()}
+		self.lab_types_by_name = {lab_type.name: lab_type for lab_type in self.lab_types.values()}
+
+		# lab type pk -> its measurement types in display order, as get_measurementtypes_from_labtype gives them
+		self.measurement_types = defaultdict(list)
+		for measurement_type in chain(models.ContinuousMeasurementType.objects.all(),
+				models.DiscreteMeasurementType.objects.all()):
+			measurement_type.lab_type = self.lab_types[measurement_type.lab_type_id]
+			self.measurement_types[measurement_type.lab_type_id].append(measurement_type)
+		for types in self.measurement_types.values():
+			types.sort(key=attrgetter('order_index'))
+
+		# discrete measurement type pk -> {result name: DiscreteResultType}
+		self.discrete_results = defaultdict(dict)
+		allowed = models.DiscreteResultType.measurement_type.through.objects \
+			.select_related('discreteresulttype')
+		for row in allowed:
+			result = row.discreteresulttype
+			self.discrete_results[row.discretemeasurementtype_id][result.name] = result
+
+	def measurement_type(self, lab_type, name):
+		"""
+		The measurement type of lab_type with the given long or short name, or None
+		"""
+		for measurement_type in self.measurement_types[lab_type.pk]:
+			if name in (measurement_type.long_name, measurement_type.short_name):
+				return measurement_type
+		return None
+
+
+# The catalog changes only through the admin, so each process keeps one, reloading it whenever part
+# of the catalog changes (see osler.labs.signals).
+_catalog = VersionedProcessCache('osler.labs.catalog_version', lambda key: LabCatalog())
+
+
+def invalidate_lab_catalog():
+	"""
+	Forget the loaded lab catalog, in this and all other processes
+	"""
+	_catalog.invalidate()
+
+
+def get_lab_catalog():
+	"""
+	The current LabCatalog, loaded from the database only if it changed since this process last loaded it.
+	The catalog is shared, so its objects must not be modified.
+	"""
+	return _catalog.get()
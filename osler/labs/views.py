@@ -1,13 +1,19 @@
-from functools import reduce
 from osler.core.models import (Patient, Encounter)
+from osler.core import utils as core_utils
 
+from django.conf import settings
+from django.db.models import Prefetch
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView
 from django.views.generic.edit import FormView
-from .models import Lab, LabType  
-from .forms import LabCreationForm, MeasurementsCreationForm
-from .utils import get_measurements_from_lab,get_measurementtypes_from_labtype
+from .models import Lab, LabType, ContinuousMeasurement, DiscreteMeasurement
+from .forms import LabCreationForm, LabImportForm, MeasurementsCreationForm
+from .imports import LabImportError, import_labs
+from .utils import get_measurements_from_lab, build_lab_table
+
+import io
 
 from django.utils import timezone
 from datetime import datetime, timedelta
@@ -144,6 +150,28 @@ class MeasurementsEdit(FormView):
         return redirect(reverse("labs:lab-detail", args=(lab_id,)))
 
 
+@method_decorator(active_permission_required('labs.add_lab', raise_exception=True), name='dispatch')
+class LabImport(FormView):
+    """
+    Bulk import of lab results from an uploaded CSV file
+    """
+    template_name = 'labs/lab_import.html'
+    form_class = LabImportForm
+
+    def form_valid(self, form):
+        lines = io.TextIOWrapper(form.cleaned_data['csv_file'], encoding='utf-8-sig', newline='')
+        try:
+            n_labs, n_measurements = import_labs(lines)
+        except (LabImportError, UnicodeDecodeError) as e:
+            errors = getattr(e, 'errors', ['The file is not UTF-8 text.'])
+            for error in errors:
+                form.add_error('csv_file', error)
+            return self.form_invalid(form)
+
+        return self.render_to_response(self.get_context_data(
+            form=self.form_class(), n_labs=n_labs, n_measurements=n_measurements))
+
+
 def view_all_as_table(request,pt_id,month_range=6):
     """
     Lab table view with recent labs
@@ -155,60 +183,73 @@ def view_all_as_table(request,pt_id,month_range=6):
 
     # Get qs for the patient
     pt = get_object_or_404(Patient, id=pt_id)
-    lab_types = list(LabType.objects.all())
 
     to_tz = timezone.get_default_timezone()
     time_threshold = datetime.now(to_tz) - timedelta(days=month_range*31)
-    lab_qs = Lab.objects.filter(patient=pt_id, lab_time__gt=time_threshold)
-    lab_days = sorted([lab.get_day() for lab in lab_qs], reverse=True)
-    unique_lab_days=reduce(lambda l, x: l if x in l else l+[x], lab_days, [])
-
-    listed_lab_days = unique_lab_days[:]
-    n_days = len(listed_lab_days)
-
-    # Initiate empty table
-    # width = # of labs
-    # height = # of measurement types
-
-    table_header = ['','Reference']
-    col_header_len = len(table_header)
-    table_header += [ str(x) for x in listed_lab_days ]
-    table_content = []
-    sorted_measure_types = []
-    dup_lab_bool = False
-
-    for t_lab_type in lab_types:
-        m_types = get_measurementtypes_from_labtype(t_lab_type.id)
-        table_content.append([table_header[:]])
-        table_content[-1][0][0] = ('Lab Category: '+str(t_lab_type))
-        sorted_measure_types.append([])
-        for mt in m_types:
-            table_content[-1].append(([mt, mt.get_ref()] + ['']*n_days))
-            sorted_measure_types[-1].append(mt)
-
-
-    # Fill in entries
-    for t_lab in lab_qs.reverse():
-        if (not (t_lab.get_day() in listed_lab_days)):
-            continue
-        measurements = get_measurements_from_lab(t_lab.id)
-        col_index = listed_lab_days.index(t_lab.get_day()) + col_header_len
-        for m in measurements:
-            section_index = lab_types.index(t_lab.lab_type)
-            m_type = m.measurement_type
-            row_index = (sorted_measure_types[section_index]).index(m_type)
-            current_value = table_content[section_index][row_index+1][col_index]
-            if current_value=='':
-                table_content[section_index][row_index+1][col_index] = m
-            else:
-                table_content[section_index][row_index+1][col_index] = m
-                table_content[section_index][0][col_index] += '*'
-                dup_lab_bool = True
+    table_content, dup_lab_bool, has_labs = build_lab_table(pt.id, time_threshold)
 
     qs = {'patient':pt, 
           'table_content': table_content,
           'add_lab': group_has_perm(get_active_role(request), 'labs.add_lab'),
-          'no_lab_bool':len(lab_qs)==0,
+          'no_lab_bool': not has_labs,
           'dup_lab_bool': dup_lab_bool}
 
-    return render(request, 'labs/lab_all_table.html', qs)
\ No newline at end of file
+    return render(request, 'labs/lab_all_table.html', qs)
+
+
+@active_permission_required('labs.view_lab', raise_exception=True)
+def abnormal_worklist(request):
+    """
+    Labs with abnormal results that no one has reviewed yet, newest first
+
+    Pages by keyset on the partial index over these labs, so a page costs
+    the same however many labs there are.
+    """
+    ordering = ['-lab_time', '-pk']
+    labs = Lab.objects.unreviewed_abnormal()
+
+    cursor = core_utils.decode_cursor(request.GET.get('after', ''))
+    if cursor is not None and len(cursor) == len(ordering):
+        labs = labs.filter(core_utils.keyset_filter(ordering, cursor))
+
+    page_size = settings.OSLER_LAB_WORKLIST_PAGE_SIZE
+    labs = list(labs
+        .order_by(*ordering)
+        .select_related('patient', 'lab_type')
+        .prefetch_related(
+            Prefetch('continuousmeasurement_set',
+                queryset=ContinuousMeasurement.objects.exclude(abnormal='')
+                    .select_related('measurement_type'),
+                to_attr='abnormal_continuous'),
+            Prefetch('discretemeasurement_set',
+                queryset=DiscreteMeasurement.objects.exclude(abnormal='')
+                    .select_related('measurement_type', 'value'),
+                to_attr='abnormal_discrete'))[:page_size + 1])
+
+    next_cursor = None
+    if len(labs) > page_size:
+        labs = labs[:page_size]
+        last = labs[-1]
+        next_cursor = core_utils.encode_cursor(
+            [str(getattr(last, field.lstrip('-'))) for field in ordering])
+
+    return render(request, 'labs/abnormal_worklist.html', {
+        'labs': labs,
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
+        'can_review': group_has_perm(get_active_role(request), 'labs.change_lab'),
+    })
+
+
+@require_POST
+@active_permission_required('labs.change_lab', raise_exception=True)
+def mark_reviewed(request, pk):
+    """
+    Take a lab off the abnormal lab worklist
+    """
+    lab = get_object_or_404(Lab, pk=pk)
+    if lab.reviewed_datetime is None:
+        lab.reviewed_by = request.user
+        lab.reviewed_datetime = timezone.now()
+        lab.save(update_fields=['reviewed_by', 'reviewed_datetime'])
+    return redirect('labs:abnormal-worklist')
@@ -78,18 +78,25 @@ class FollowupRequest(Note, CompletableMixin):
     MARK_DONE_URL_NAME = 'new-patient-contact'
     ADMIN_URL_NAME = ''
 
+    DISPLAY_RELATED_FIELDS = CompletableMixin.DISPLAY_RELATED_FIELDS + [
+        'referral']
+
     def class_name(self):
         return self.__class__.__name__
 
     def short_name(self):
         return "Referral"
 
+    @classmethod
+    def short_name_expression(cls):
+        return models.Value("Referral", output_field=models.CharField())
+
     def summary(self):
         return self.contact_instructions
 
     def mark_done_url(self):
         return reverse(self.MARK_DONE_URL_NAME,
-                       args=(self.referral.patient.id,
+                       args=(self.referral.patient_id,
                              self.referral.id,
                              self.id))
 
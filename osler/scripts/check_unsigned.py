@@ -1,16 +1,24 @@
-from __future__ import print_function
-from __future__ import unicode_literals
-from datetime import date
-from osler.core.models import Provider
+from collections import defaultdict
+
 from osler.workup.models import Workup
 
-unsigned_workups = Workup.objects.filter(signer=None)
+unsigned_workups = Workup.objects.filter(signer=None) \
+    .select_related('patient', 'encounter') \
+    .order_by('encounter__clinic_day', 'pk')
 
 print(unsigned_workups)
 
+# who signed workups on each day with unsigned workups, in one query
+# rather than one per unsigned workup
+signers_by_day = defaultdict(set)
+signed_workups = Workup.objects \
+    .filter(signer__isnull=False,
+            encounter__clinic_day__in=unsigned_workups.order_by().values(
+                'encounter__clinic_day')) \
+    .select_related('signer', 'encounter')
+for wu in signed_workups:
+    signers_by_day[wu.encounter.clinic_day].add(wu.signer)
+
 for wu in unsigned_workups:
     d = wu.encounter.clinic_day
-    providers = Provider.objects.filter(
-        signed_workups__in=Workup.objects.filter(
-            encounter__clinic_day=d)).distinct()
-    print(wu.patient, providers, d)
+    print(wu.patient, sorted(signers_by_day[d], key=str), d)
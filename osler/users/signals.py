@@ -0,0 +1,20 @@
+"""Signal handlers that keep the group permission cache in
+osler.users.utils current."""
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from osler.users.utils import invalidate_group_cache
+
+
+def group_changed(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_group_cache()
+
+
+m2m_changed.connect(group_changed, sender=Group.permissions.through,
+                    dispatch_uid='group_cache_permissions_changed')
+for model in [Group, Permission]:
+    post_save.connect(group_changed, sender=model,
+                      dispatch_uid='group_cache_save_%s' % model.__name__)
+    post_delete.connect(group_changed, sender=model,
+                        dispatch_uid='group_cache_delete_%s' % model.__name__)
@@ -0,0 +1,90 @@
+import pytest
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from osler.users import utils
+from osler.users.tests.factories import NoPermGroupFactory, PermGroupFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_group_has_perm_is_cached():
+    group = PermGroupFactory(permissions=['core.activate_Patient'])
+    utils.group_has_perm(group, 'core.activate_Patient')
+
+    with CaptureQueriesContext(connection) as queries:
+        assert utils.group_has_perm(group, 'core.activate_Patient')
+        assert not utils.group_has_perm(group, 'core.case_manage_Patient')
+        # a fresh instance of the same group is served by the process cache
+        fresh = Group.objects.get(pk=group.pk)
+    with CaptureQueriesContext(connection) as fresh_queries:
+        assert utils.group_has_perm(fresh, 'core.activate_Patient')
+
+    assert len(queries) == 1  # just the Group.objects.get
+    assert len(fresh_queries) == 0
+
+
+def test_permission_change_invalidates_cache():
+    group = NoPermGroupFactory()
+    assert not utils.group_has_perm(group, 'core.activate_Patient')
+
+    group.permissions.add(Permission.objects.get(
+        codename='activate_Patient', content_type__app_label='core'))
+    assert utils.group_has_perm(
+        Group.objects.get(pk=group.pk), 'core.activate_Patient')
+
+    group.permissions.clear()
+    assert not utils.group_has_perm(
+        Group.objects.get(pk=group.pk), 'core.activate_Patient')
+
+
+def test_reverse_permission_change_invalidates_cache():
+    group = NoPermGroupFactory()
+    perm = Permission.objects.get(
+        codename='activate_Patient', content_type__app_label='core')
+    assert not utils.group_has_perm(group, 'core.activate_Patient')
+
+    perm.group_set.add(group)
+    assert utils.group_has_perm(
+        Group.objects.get(pk=group.pk), 'core.activate_Patient')
+
+
+def test_get_active_role_memoized(rf: RequestFactory):
+    group = PermGroupFactory(permissions=['core.activate_Patient'])
+    request = rf.get('/fake-url/')
+    request.session = {'active_role_pk': group.pk}
+
+    role = utils.get_active_role(request)
+    assert role == group
+    assert role.name == group.name
+
+    with CaptureQueriesContext(connection) as queries:
+        assert utils.get_active_role(request) is role
+        assert utils.group_has_perm(role, 'core.activate_Patient')
+    assert len(queries) == 0
+
+    # renaming the group is picked up by the next request
+    group.name = 'Renamed'
+    group.save()
+    request = rf.get('/fake-url/')
+    request.session = {'active_role_pk': group.pk}
+    assert utils.get_active_role(request).name == 'Renamed'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_invalidated_again_on_commit():
+    group = NoPermGroupFactory()
+    version_key = utils._group_cache.version_key
+
+    with transaction.atomic():
+        group.permissions.add(Permission.objects.get(
+            codename='activate_Patient', content_type__app_label='core'))
+        # another process may reload the uncommitted change's old values
+        # under this version...
+        in_transaction = cache.get(version_key)
+
+    # ...so it's replaced again once the change commits
+    assert cache.get(version_key) not in (None, in_transaction)
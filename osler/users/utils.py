@@ -1,5 +1,48 @@
 from django.contrib.auth.models import Group, Permission
 
+from osler.core.process_cache import VersionedProcessCache
+
+
+def _load_group_info(pk):
+    name = Group.objects.values_list('name', flat=True).get(pk=pk)
+    permissions = frozenset(
+        '%s.%s' % perm for perm in Permission.objects
+        .filter(group=pk)
+        .values_list('content_type__app_label', 'codename'))
+    return name, permissions
+
+
+# The (name, permissions) of each group, by group pk, memoized per process
+# and reloaded whenever a group or its permissions change (see
+# osler.users.signals).
+_group_cache = VersionedProcessCache(
+    'osler.users.group_cache_version', _load_group_info)
+
+
+def invalidate_group_cache():
+    """Forget every memoized group name and permission set, in this and
+    all other processes."""
+
+    _group_cache.invalidate()
+
+
+def _cached_group_info(pk):
+    """The (name, permissions) of the group with primary key pk, from the
+    process cache if it is current and from the database otherwise."""
+
+    return _group_cache.get(pk)
+
+
+def group_permissions(group):
+    """The set of '<app_label>.<codename>' permissions granted to group.
+
+    The set is memoized on the group object itself (so, per request for
+    the group from get_active_role) and per process.
+    """
+    if not hasattr(group, '_osler_permissions'):
+        group._osler_permissions = _cached_group_info(group.pk)[1]
+    return group._osler_permissions
+
 
 def get_active_role(request):
     """Given a request, process which of the user's groups is "active".
@@ -9,7 +52,14 @@ def get_active_role(request):
     """
 
     active_role_pk = request.session['active_role_pk']
-    active_role = Group.objects.get(pk=active_role_pk)
+
+    active_role = getattr(request, '_osler_active_role', None)
+    if active_role is None or active_role.pk != active_role_pk:
+        name, permissions = _cached_group_info(active_role_pk)
+        active_role = Group(pk=active_role_pk, name=name)
+        active_role._osler_permissions = permissions
+        request._osler_active_role = active_role
+
     return active_role
 
 
@@ -17,14 +67,10 @@ def group_has_perm(group, perm: str):
     """Checks that a group has a certain permission.
     Name permission as '<app_label>.<codename>'"""
 
-    split = perm.index('.')
-    app_label = perm[:split]
-    codename = perm[split+1:]
-    return group.permissions.filter(codename=codename, content_type__app_label=app_label).exists()
+    return perm in group_permissions(group)
 
 
 def group_has_perms(group, perms):
     """Checks that a group has been granted a tuple of perms"""
 
     return all(group_has_perm(group, perm) for perm in perms)
-
@@ -110,6 +110,10 @@ class VaccineActionItem(AbstractActionItem):
     def short_name(self):
         return "Vaccine"
 
+    @classmethod
+    def short_name_expression(cls):
+        return models.Value("Vaccine", output_field=models.CharField())
+
     def mark_done_url(self):
         return reverse(self.MARK_DONE_URL_NAME,
                        kwargs={'pt_id': self.patient.pk, 'ai_id': self.pk})
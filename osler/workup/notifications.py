@@ -0,0 +1,85 @@
+"""Digests of unattested workups, emailed to the attendings who should
+sign them.
+
+The workups are fetched with everything the digests show in one joined
+query, ordered so that each attending's are together, and all the digests
+are sent over one mail connection.
+"""
+from itertools import groupby
+
+from django.core.mail import get_connection, send_mass_mail
+from django.urls import reverse
+
+from osler.workup.models import Workup
+
+DIGEST_FROM = 'jrporter@wustl.edu'
+DIGEST_BASE_URL = 'https://osler.wustl.edu'
+
+DRY_RUN_EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+
+def unsigned_workups_by_attending():
+    """Yield (attending, [workups]) for each attending with unsigned
+    workups assigned to them."""
+    workups = Workup.objects \
+        .filter(signer=None, attending__isnull=False) \
+        .select_related('attending', 'patient', 'encounter') \
+        .order_by('attending_id', 'encounter__clinic_day', 'pk')
+
+    for _, group in groupby(workups.iterator(), key=lambda wu: wu.attending_id):
+        group = list(group)
+        yield group[0].attending, group
+
+
+def render_digest(attending, workups):
+    """The (subject, message, from_email, recipient_list) of the digest of
+    workups for attending, as send_mass_mail takes."""
+    last_name = attending.last_name if attending.last_name else ""
+
+    message_lines = [
+        ("Hi there Dr. %s," % last_name),
+        '',
+        "We've noticed something of a backlog of unattested notes, "
+        "and so we've cooked up something to try to "
+        "identify--wherever possible--which unattested notes "
+        "should have been attested by which physicians. From here, "
+        "it looks like the following note(s) should have been "
+        "signed by you:",
+        ""
+    ]
+
+    for wu in workups:
+        message_lines.append(" ".join([
+            '-', str(wu.patient),
+            '(seen %s):' % wu.encounter.clinic_day,
+            DIGEST_BASE_URL + reverse('workup', kwargs={'pk': wu.pk})
+            ]))
+
+    message_lines.extend([
+        "",
+        "Each of these patients' notes should be accessible via the direct link above any time you're on the Barnes/WashU network, or if you're using the VPN. If for some reason you can't access a chart, or you don't think that you were the attending who saw the linked patient, please let me know.",
+        "",
+        "Cheers,",
+        "Justin"
+    ])
+
+    return ('[OSLER] %s Unattested Notes' % len(workups),
+            "\n".join(message_lines),
+            DIGEST_FROM,
+            [attending.email])
+
+
+def send_unsigned_digests(dry_run=False):
+    """Email every attending with unsigned workups a digest of them, over
+    one connection. With dry_run, the digests go to the locmem backend
+    (django.core.mail.outbox) instead of being sent.
+
+    Returns the digests, as (subject, message, from_email, recipient_list).
+    """
+    digests = [render_digest(attending, workups) for attending, workups
+               in unsigned_workups_by_attending() if attending.email]
+
+    connection = get_connection(DRY_RUN_EMAIL_BACKEND if dry_run else None)
+    send_mass_mail(digests, fail_silently=False, connection=connection)
+
+    return digests
@@ -0,0 +1,231 @@
+"""Rendering workups to PDF, with the rendered PDFs cached.
+
+A workup's PDF is cached under a key made of its pk, its last_modified,
+the number and latest last_modified of its addenda, and a digest of the
+patient details it prints, so that editing, signing or adding to the
+workup, or correcting the patient's demographics, moves it to a new key
+and the stale PDF is never served again. The stale PDF is deleted when
+its replacement is cached, and the PDFs, which are patient records, are
+kept in a cache of their own (OSLER_WORKUP_PDF_CACHE) with a short
+timeout.
+Signed workups are pre-rendered in the background as they are signed,
+since that's when they're usually downloaded.
+
+Many workups at once (e.g. a clinic day's) are rendered in parallel across
+a pool of OSLER_WORKUP_PDF_WORKERS processes, and packaged as a ZIP that
+is streamed as it's written, or merged into one PDF.
+"""
+import contextlib
+import hashlib
+import io
+import logging
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryFile
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Count, Max, Prefetch
+from django.template.loader import get_template
+from PyPDF2 import PdfFileMerger
+from xhtml2pdf import pisa
+
+from osler.workup import models
+
+logger = logging.getLogger(__name__)
+
+
+def pdf_cache():
+    return caches[settings.OSLER_WORKUP_PDF_CACHE]
+
+
+def patient_fingerprint(patient):
+    """A digest of the patient details that a workup's PDF prints, so that
+    correcting them (or the patient turning a year older) moves the PDF to
+    a new cache key."""
+    prefetched = getattr(patient, '_prefetched_objects_cache', {})
+    if 'ethnicities' in prefetched:
+        ethnicities = sorted(e.pk for e in prefetched['ethnicities'])
+    else:
+        ethnicities = sorted(patient.ethnicities.values_list('pk', flat=True))
+
+    details = repr((patient.name(), patient.date_of_birth, patient.age(),
+                    patient.gender_id, ethnicities))
+    return hashlib.sha1(details.encode('utf-8')).hexdigest()
+
+
+def pdf_cache_key(workup):
+    prefetched = getattr(workup, '_prefetched_objects_cache', {})
+    if 'addendum_set' in prefetched:
+        addenda = {'n': len(prefetched['addendum_set']),
+                   'last_modified': max((a.last_modified for a in
+                                         prefetched['addendum_set']),
+                                        default=None)}
+    else:
+        addenda = workup.addendum_set.aggregate(
+            n=Count('pk'), last_modified=Max('last_modified'))
+    return 'workup-pdf:%s:%s:%s:%s:%s' % (
+        workup.pk, workup.last_modified.timestamp(), addenda['n'],
+        addenda['last_modified'].timestamp() if addenda['n'] else '',
+        patient_fingerprint(workup.patient))
+
+
+def with_pdf_related(workups):
+    """workups, with everything the PDF template shows fetched up front."""
+    return workups \
+        .select_related('patient__gender', 'encounter', 'author',
+                        'author_type', 'signer', 'attending') \
+        .prefetch_related(
+            'patient__ethnicities', 'other_volunteer', 'diagnosis_categories',
+            Prefetch('addendum_set', queryset=models.Addendum.objects
+                     .select_related('author', 'author_type')))
+
+
+def render_workup_html(workup):
+    return get_template('workup/workup_body.html').render({'workup': workup})
+
+
+def html_to_pdf(html):
+    """The PDF of an HTML document, as bytes. Touches neither the database
+    nor Django, so it can run in a worker process."""
+    with TemporaryFile(mode="w+b") as file:
+        pisa.CreatePDF(html.encode('utf-8'), dest=file, encoding='utf-8')
+        file.seek(0)
+        return file.read()
+
+
+def render_workup_pdf(workup):
+    """The PDF of workup, as bytes, rendered afresh."""
+    return html_to_pdf(render_workup_html(workup))
+
+
+def store_workup_pdf(workup, key, pdf):
+    """Cache pdf, the PDF of workup, under key, dropping its previous PDF
+    (under the key it had before an edit) rather than leaving that copy
+    to expire."""
+    cache = pdf_cache()
+    current = 'workup-pdf-key:%s' % workup.pk
+    previous = cache.get(current)
+    if previous is not None and previous != key:
+        cache.delete(previous)
+    cache.set_many({key: pdf, current: key},
+                   settings.OSLER_WORKUP_PDF_CACHE_TIMEOUT)
+
+
+def get_workup_pdf(workup):
+    """The PDF of workup, as bytes, from the cache if it has been rendered
+    since the workup or its addenda last changed."""
+    key = pdf_cache_key(workup)
+    pdf = pdf_cache().get(key)
+    if pdf is None:
+        pdf = render_workup_pdf(workup)
+        store_workup_pdf(workup, key, pdf)
+    return pdf
+
+
+def get_workup_pdfs(workups):
+    """Yield (workup, PDF bytes) for each of workups, in order. The PDFs
+    that aren't cached are rendered in parallel, and cached."""
+    workups = list(workups)
+    keys = [pdf_cache_key(workup) for workup in workups]
+    cached = pdf_cache().get_many(keys)
+    missing = [workup for workup, key in zip(workups, keys)
+               if key not in cached]
+
+    with contextlib.ExitStack() as stack:
+        htmls = (render_workup_html(workup) for workup in missing)
+        if settings.OSLER_WORKUP_PDF_WORKERS == 1:
+            rendered = map(html_to_pdf, htmls)
+        else:
+            pool = stack.enter_context(ProcessPoolExecutor(
+                max_workers=settings.OSLER_WORKUP_PDF_WORKERS))
+            rendered = pool.map(html_to_pdf, htmls)
+
+        for workup, key in zip(workups, keys):
+            if key in cached:
+                yield workup, cached[key]
+            else:
+                pdf = next(rendered)
+                store_workup_pdf(workup, key, pdf)
+                yield workup, pdf
+
+
+class _ZipStream:
+    """Write-only file that collects what is written until it's taken, for
+    ZipFile to write a streamed archive to."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_workup_pdfs(workups):
+    """Yield the chunks of a ZIP with a PDF per workup, in a folder per
+    patient, as each PDF is rendered."""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for workup, pdf in get_workup_pdfs(workups):
+            archive.writestr('%s/%s %s' % (
+                workup.patient_id, workup.pk, workup_pdf_filename(workup)), pdf)
+            yield stream.take()
+    yield stream.take()
+
+
+def merge_workup_pdfs(workups):
+    """One PDF of all of workups, in order, as bytes."""
+    merger = PdfFileMerger()
+    for _, pdf in get_workup_pdfs(workups):
+        merger.append(io.BytesIO(pdf))
+    packet = io.BytesIO()
+    merger.write(packet)
+    return packet.getvalue()
+
+
+def workup_pdf_filename(workup):
+    """Patient initials and clinic day, e.g. 'JD (01.31.2020).pdf'."""
+    initials = ''.join(name[0].upper() for name in workup.patient.name(
+        reverse=False, middle_short=False).split())
+    clinic_day = workup.encounter.clinic_day
+    formatdate = '.'.join([str(clinic_day.month).zfill(2),
+                           str(clinic_day.day).zfill(2),
+                           str(clinic_day.year)])
+    return '%s (%s).pdf' % (initials, formatdate)
+
+
+def prerender_workup_pdf(pk):
+    """Render workup pk's PDF into the cache, if it isn't there already."""
+    try:
+        workup = models.Workup.objects \
+            .select_related('patient', 'encounter').get(pk=pk)
+        get_workup_pdf(workup)
+    except Exception:
+        logger.exception("Failed to pre-render the PDF of workup %s.", pk)
+
+
+def prerender_workup_pdf_later(workup):
+    """Pre-render workup's PDF in a background thread once the current
+    transaction commits, if OSLER_WORKUP_PDF_PRERENDER is on."""
+    if not settings.OSLER_WORKUP_PDF_PRERENDER:
+        return
+
+    def run():
+        try:
+            prerender_workup_pdf(workup.pk)
+        finally:
+            connection.close()
+
+    transaction.on_commit(lambda: threading.Thread(
+        target=run, name='workup-pdf', daemon=True).start())
@@ -1,6 +1,13 @@
 from __future__ import unicode_literals
 
+import datetime
+import io
+import zipfile
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 from django.urls import reverse
 from django.conf import settings
@@ -12,7 +19,7 @@ import osler.users.tests.factories as user_factories
 import osler.workup.tests.factories as workup_factories
 import osler.core.tests.factories as core_factories
 
-from osler.workup import models
+from osler.workup import models, pdf
 from osler.workup.tests.tests import wu_dict, note_dict
 
 
@@ -122,6 +129,147 @@ class ViewsExistTest(TestCase):
             response = self.client.get(reverse(wu_url, args=(self.wu.id,)))
             assert response.status_code == 200 if group == pdf_perm_group else 403
 
+    def test_workup_pdf_cache(self):
+        """Repeat downloads are served from the cache, which edits and
+        addenda invalidate"""
+        pdf.pdf_cache().clear()
+        url = reverse('workup-pdf', args=(self.wu.id,))
+        user = user_factories.UserFactory(groups=[
+            user_factories.PermGroupFactory(permissions=['workup.export_pdf_Workup'])])
+        log_in_user(self.client, user)
+
+        with mock.patch('osler.workup.pdf.pisa.CreatePDF',
+                        wraps=pdf.pisa.CreatePDF) as create_pdf:
+            first = self.client.get(url).content
+            assert self.client.get(url).content == first
+            assert create_pdf.call_count == 1
+
+            models.Addendum.objects.create(
+                workup=self.wu, patient=self.wu.patient, text='addendum',
+                author=self.user, author_type=self.user.groups.first())
+            self.client.get(url)
+            assert create_pdf.call_count == 2
+
+            self.wu.hpi = 'edited'
+            self.wu.save()
+            self.client.get(url)
+            self.client.get(url)
+            assert create_pdf.call_count == 3
+
+            self.wu.hpi = 'signed'
+            self.wu.save()
+            pdf.prerender_workup_pdf(self.wu.pk)
+            self.client.get(url)
+            assert create_pdf.call_count == 4
+
+    def test_workup_pdf_cache_patient_edit(self):
+        """Correcting the patient's demographics re-renders the PDF"""
+        pdf.pdf_cache().clear()
+        url = reverse('workup-pdf', args=(self.wu.id,))
+        log_in_user(self.client, user_factories.UserFactory(groups=[
+            user_factories.PermGroupFactory(permissions=['workup.export_pdf_Workup'])]))
+
+        with mock.patch('osler.workup.pdf.pisa.CreatePDF',
+                        wraps=pdf.pisa.CreatePDF) as create_pdf:
+            self.client.get(url)
+            self.client.get(url)
+            assert create_pdf.call_count == 1
+            stale_key = pdf.pdf_cache_key(self.wu)
+            assert pdf.pdf_cache().get(stale_key) is not None
+
+            patient = self.wu.patient
+            patient.last_name = 'Corrected'
+            patient.save()
+            self.client.get(url)
+            assert create_pdf.call_count == 2
+            # the PDF with the old name isn't left behind in the cache
+            assert pdf.pdf_cache().get(stale_key) is None
+
+            patient.date_of_birth = patient.date_of_birth.replace(
+                year=patient.date_of_birth.year - 1)
+            patient.save()
+            self.client.get(url)
+            self.client.get(url)
+            assert create_pdf.call_count == 3
+
+            patient.ethnicities.add(core_factories.EthnicityFactory())
+            self.client.get(url)
+            assert create_pdf.call_count == 4
+
+    def test_workup_pdf_packet(self):
+        """A clinic day's workups export as a ZIP of PDFs, rendered in a
+        process pool"""
+        pdf.pdf_cache().clear()
+        other = workup_factories.WorkupFactory(
+            author=self.user, author_type=self.user.groups.first(),
+            encounter=core_factories.EncounterFactory(
+                clinic_day=self.wu.encounter.clinic_day))
+        log_in_user(self.client, user_factories.UserFactory(groups=[
+            user_factories.PermGroupFactory(permissions=['workup.export_pdf_Workup'])]))
+        day = str(self.wu.encounter.clinic_day)
+        url = reverse('workup-pdf-packet')
+
+        with self.settings(OSLER_WORKUP_PDF_WORKERS=2):
+            response = self.client.get(url, {'start_date': day, 'end_date': day})
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        names = archive.namelist()
+        assert sorted(name.split(' ')[0] for name in names) == sorted([
+            '%s/%s' % (wu.patient_id, wu.pk) for wu in [self.wu, other]])
+        assert all(archive.read(name).startswith(b'%PDF') for name in names)
+
+        # the second export comes from the cache
+        with mock.patch('osler.workup.pdf.html_to_pdf') as html_to_pdf, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'start_date': day, 'end_date': day})
+            b''.join(response.streaming_content)
+        assert not html_to_pdf.called
+        n_queries = len(queries)
+
+        workup_factories.WorkupFactory(
+            author=self.user, author_type=self.user.groups.first(),
+            encounter=core_factories.EncounterFactory(
+                clinic_day=self.wu.encounter.clinic_day))
+        with self.settings(OSLER_WORKUP_PDF_WORKERS=1), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'start_date': day, 'end_date': day})
+            assert len(zipfile.ZipFile(io.BytesIO(
+                b''.join(response.streaming_content))).namelist()) == 3
+        assert len(queries) == n_queries
+
+        response = self.client.get(url, {'start_date': 'yesterday'})
+        assert response.status_code == 400
+
+    def test_workup_pdf_packet_limits(self):
+        """Packets over too many days or workups are refused"""
+        log_in_user(self.client, user_factories.UserFactory(groups=[
+            user_factories.PermGroupFactory(permissions=['workup.export_pdf_Workup'])]))
+        url = reverse('workup-pdf-packet')
+        day = self.wu.encounter.clinic_day
+
+        with self.settings(OSLER_WORKUP_PDF_PACKET_MAX_DAYS=31):
+            response = self.client.get(url, {
+                'start_date': str(day - datetime.timedelta(days=31)),
+                'end_date': str(day)})
+        assert response.status_code == 400
+
+        workup_factories.WorkupFactory(
+            author=self.user, author_type=self.user.groups.first(),
+            encounter=core_factories.EncounterFactory(clinic_day=day))
+        with self.settings(OSLER_WORKUP_PDF_PACKET_MAX_WORKUPS=1):
+            response = self.client.get(url, {'start_date': str(day),
+                                              'end_date': str(day)})
+        assert response.status_code == 400
+
+    def test_workup_pdf_packet_merged(self):
+        log_in_user(self.client, user_factories.UserFactory(groups=[
+            user_factories.PermGroupFactory(permissions=['workup.export_pdf_Workup'])]))
+        day = str(self.wu.encounter.clinic_day)
+        with self.settings(OSLER_WORKUP_PDF_WORKERS=1):
+            response = self.client.get(reverse('workup-pdf-packet'), {
+                'start_date': day, 'end_date': day, 'format': 'pdf'})
+        assert response['Content-Type'] == 'application/pdf'
+        assert response.content.startswith(b'%PDF')
+
     def test_workup_submit(self):
         """verify we can submit a valid workup as a signer and nonsigner"""
 
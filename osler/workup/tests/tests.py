@@ -1,7 +1,14 @@
 from __future__ import unicode_literals
 from builtins import str
+import datetime
+import io
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.core import mail
+from django.core.mail import get_connection
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.core.management import call_command
@@ -124,6 +131,73 @@ class TestEmailForUnsignedNotes(TestCase):
         #     'https://osler.wustl.edu/workup/%s/' % wu_unsigned.pk,
         #     mail.outbox[0].body)
 
+    def make_unsigned(self, attending, n):
+        for _ in range(n):
+            wu_data = wu_dict(user=self.user)
+            wu_data['attending'] = attending
+            models.Workup.objects.create(**wu_data)
+
+    def test_unsigned_digests_batched(self):
+
+        attendings = [self.user] + [
+            build_user([user_factories.AttendingGroupFactory])
+            for _ in range(2)]
+        for i, attending in enumerate(attendings):
+            self.make_unsigned(attending, i + 1)
+
+        with mock.patch('osler.workup.notifications.get_connection',
+                        wraps=get_connection) as connect, \
+                CaptureQueriesContext(connection) as queries:
+            call_command('unsigned_wu_notify', stdout=io.StringIO())
+
+        # one connection and one query, however many attendings and workups
+        assert connect.call_count == 1
+        assert len(queries) == 1
+
+        assert sorted(m.subject for m in mail.outbox) == [
+            '[OSLER] %s Unattested Notes' % n for n in (1, 2, 3)]
+        for attending in attendings:
+            digest, = [m for m in mail.outbox if m.to == [attending.email]]
+            assert attending.last_name in digest.body
+            for wu in models.Workup.objects.filter(attending=attending):
+                assert reverse('workup', kwargs={'pk': wu.pk}) in digest.body
+
+    def test_unsigned_digests_same_last_name(self):
+
+        other = build_user([user_factories.AttendingGroupFactory])
+        other.last_name = self.user.last_name
+        other.save()
+
+        # interleave the two attendings' workups by clinic day
+        today = now().date()
+        for i, attending in enumerate([self.user, other, self.user, other]):
+            wu_data = wu_dict(user=self.user)
+            wu_data['attending'] = attending
+            wu = models.Workup.objects.create(**wu_data)
+            Encounter.objects.filter(pk=wu.encounter.pk).update(
+                clinic_day=today - datetime.timedelta(days=i))
+
+        call_command('unsigned_wu_notify', stdout=io.StringIO())
+
+        assert sorted((m.to[0], m.subject) for m in mail.outbox) == sorted(
+            (attending.email, '[OSLER] 2 Unattested Notes')
+            for attending in (self.user, other))
+
+    def test_unsigned_digests_dry_run(self):
+
+        self.make_unsigned(self.user, 2)
+
+        with self.settings(
+                EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend'):
+            out = io.StringIO()
+            call_command('unsigned_wu_notify', '--dry-run', stdout=out)
+
+        # delivered to locmem, not through the configured backend
+        assert len(mail.outbox) == 1
+        assert mail.outbox[0].subject == '[OSLER] 2 Unattested Notes'
+        assert '[OSLER] 2 Unattested Notes' in out.getvalue()
+        assert 'Would have sent 1 digests.' in out.getvalue()
+
 
 class TestWorkupFieldValidators(TestCase):
     '''
@@ -40,6 +40,10 @@ unwrapped_urlconf = [
         r'^(?P<pk>[0-9]+)/pdf/$',
         views.pdf_workup,
         name="workup-pdf"),
+    re_path(
+        r'^pdf-packet/$',
+        views.pdf_packet,
+        name="workup-pdf-packet"),
 
     # ATTESTABLE BASIC NOTES
     re_path(
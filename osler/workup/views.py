@@ -1,22 +1,22 @@
-from tempfile import TemporaryFile
-from xhtml2pdf import pisa
+import datetime
 
 from django.conf import settings
 from django.contrib.auth.models import Group
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.http import (HttpResponseRedirect, HttpResponseServerError,
-                         HttpResponse)
+                         HttpResponse, HttpResponseBadRequest,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render
-from django.template.loader import get_template
 from django.views.generic.edit import FormView
 from django.urls import reverse
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 
 from osler.core.views import NoteFormView, NoteUpdate
 from osler.core.models import Patient, Encounter
 
 from osler.workup import models
 from osler.workup import forms
+from osler.workup import pdf
 
 from osler.users.utils import get_active_role, group_has_perm
 from osler.users.decorators import active_permission_required
@@ -368,6 +368,8 @@ def sign_attestable_note(request, pk, attestable):
     try:
         note.sign(request.user, active_role)
         note.save()
+        if isinstance(note, models.Workup):
+            pdf.prerender_workup_pdf_later(note)
     except ValueError:
         # thrown exception can be ignored since we just redirect back to the
         # workup detail view anyway
@@ -387,30 +389,54 @@ def error_workup(request, pk):
 @active_permission_required('workup.export_pdf_Workup', raise_exception=True)
 def pdf_workup(request, pk):
 
-    wu = get_object_or_404(models.Workup, pk=pk)
-
-    data = {'workup': wu}
-
-    template = get_template('workup/workup_body.html')
-    html = template.render(data)
+    wu = get_object_or_404(
+        models.Workup.objects.select_related('patient', 'encounter'), pk=pk)
 
-    with TemporaryFile(mode="w+b") as file:
-        pisa.CreatePDF(html.encode('utf-8'), dest=file,
-                       encoding='utf-8')
+    response = HttpResponse(pdf.get_workup_pdf(wu), 'application/pdf')
+    response["Content-Disposition"] = (
+        "attachment; filename=%s" % (pdf.workup_pdf_filename(wu),))
 
-        file.seek(0)
-        pdf = file.read()
+    return response
 
-    initials = ''.join(name[0].upper() for name in wu.patient.name(
-        reverse=False, middle_short=False).split())
-    formatdate = '.'.join(
-        [str(wu.encounter.clinic_day.month).zfill(2),
-         str(wu.encounter.clinic_day.day).zfill(2),
-         str(wu.encounter.clinic_day.year)])
-    filename = ''.join([initials, ' (', formatdate, ')'])
 
-    response = HttpResponse(pdf, 'application/pdf')
-    response["Content-Disposition"] = (
-        "attachment; filename=%s.pdf" % (filename,))
+@active_permission_required('workup.export_pdf_Workup', raise_exception=True)
+def pdf_packet(request):
+    """All workups from clinic days start_date through end_date (by default
+    today) as a streamed ZIP of PDFs, or with format=pdf merged into one
+    PDF."""
+    try:
+        start_date, end_date = [
+            datetime.datetime.strptime(request.GET[param], '%Y-%m-%d').date()
+            if request.GET.get(param) else localdate()
+            for param in ['start_date', 'end_date']]
+    except ValueError:
+        return HttpResponseBadRequest("Dates must be given as YYYY-MM-DD.")
+
+    max_days = settings.OSLER_WORKUP_PDF_PACKET_MAX_DAYS
+    if (end_date - start_date).days + 1 > max_days:
+        return HttpResponseBadRequest(
+            "Packets can cover at most %s clinic days." % max_days)
+
+    # fetched here, in one go, so the response doesn't query as it streams
+    max_workups = settings.OSLER_WORKUP_PDF_PACKET_MAX_WORKUPS
+    workups = list(pdf.with_pdf_related(models.Workup.objects.filter(
+        encounter__clinic_day__range=(start_date, end_date))).order_by(
+        'encounter__clinic_day', 'patient__last_name', 'patient__first_name',
+        'pk')[:max_workups + 1])
+    if len(workups) > max_workups:
+        return HttpResponseBadRequest(
+            "Packets can hold at most %s workups; choose fewer days." %
+            max_workups)
+
+    filename = 'workups %s to %s' % (start_date, end_date)
+    if request.GET.get('format') == 'pdf':
+        response = HttpResponse(pdf.merge_workup_pdfs(workups),
+                                'application/pdf')
+        filename += '.pdf'
+    else:
+        response = StreamingHttpResponse(pdf.zip_workup_pdfs(workups),
+                                         'application/zip')
+        filename += '.zip'
+    response["Content-Disposition"] = 'attachment; filename="%s"' % filename
 
     return response